@@ -87,6 +87,13 @@ unprecedented flexibility while maintaining high performance and code clarity.
 
         # Views (ordered by dependency)
         'views/hypervisor_server_views.xml',
+        'views/hypervisor_task_views.xml',
+        'views/vm_provision_job_views.xml',
+        'views/vm_warm_pool_views.xml',
+        'views/hypervisor_placement_views.xml',
+        'views/hypervisor_capacity_views.xml',
+        'views/hypervisor_template_replica_views.xml',
+        'views/vm_provision_stats_views.xml',
         'views/vm_wizard_view.xml',
         'views/vm_instance_view.xml',
         'views/vm_report_view.xml',
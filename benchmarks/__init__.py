@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+# Симуляторы API гипервизоров и бенчмарки сервисного слоя (не загружаются сервером Odoo)
@@ -0,0 +1,147 @@
+# vm_rental/benchmarks/bench_proxmox.py
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк ProxmoxService против локального симулятора API (proxmox_simulator.py).
+
+Для каждого метода BaseHypervisorService выводит число HTTP-запросов на вызов
+и задержки p50/p95 - чтобы лишние обращения к API (повторное определение типа
+гостя, чтение по одной ноде и т.п.) были видны до выката.
+
+Запуск (из каталога аддонов, Odoo и proxmoxer доступны в PYTHONPATH):
+    python -m vm_rental.benchmarks.bench_proxmox --nodes 5 --vms-per-node 200 --latency-ms 10
+    python -m vm_rental.benchmarks.bench_proxmox --error-rate 0.05 --error-status 503 --json
+"""
+import argparse
+import json
+import logging
+
+from ..services.circuit_breaker import circuit_breaker
+from ..services.connection_pool import ServiceSession
+from ..services.proxmox_service import ProxmoxService
+from .common import make_server_stub, measure, print_table
+from .proxmox_simulator import ProxmoxSimulator
+
+
+class ProxmoxBenchmark:
+
+    def __init__(self, simulator, args):
+        self.simulator = simulator
+        self.args = args
+        self.server = make_server_stub(args.concurrency)
+        self.session = ServiceSession(simulator.make_api())
+
+        self.node = simulator.nodes[0]
+        guests = [g for g in simulator.guests.values() if g['node'] == self.node]
+        self.template_vmid = next(g['vmid'] for g in guests if g['template'])
+        self.vmid = next(g['vmid'] for g in guests if g['type'] == 'qemu' and not g['template'])
+        self.guest_refs = [(g['node'], g['vmid']) for g in simulator.guests.values() if not g['template']]
+        self.created = []
+        self.upids = []
+
+    def service(self):
+        # --cold: новая сессия на каждый вызов (индексы сессии строятся заново)
+        session = ServiceSession(self.simulator.make_api()) if self.args.cold else self.session
+        return ProxmoxService(self.server, session=session)
+
+    def operations(self):
+        node, vmid = self.node, self.vmid
+
+        # Провижининг Proxmox только запускает клон; остальные шаги цепочки ведет hypervisor.task
+        def clone_vm(s, i, linked=False):
+            new_id = int(s.get_next_vmid())
+            s.clone_vm(node, new_id, f'bench-{new_id}', self.template_vmid, 'local-lvm', linked=linked)
+            self.created.append(new_id)
+
+        def clone_vm_linked(s, i):
+            if s.linked_clone_possible(node, self.template_vmid, 'local-lvm'):
+                clone_vm(s, i, linked=True)
+
+        def start_vm(s, i):
+            self.upids.append(s.start_vm(node, vmid))
+
+        def delete_vm(s, i):
+            if self.created:
+                s.delete_vm(node, self.created.pop())
+
+        return [
+            ('get_version', lambda s, i: s.get_version()),
+            ('list_nodes', lambda s, i: s.list_nodes()),
+            ('list_storages', lambda s, i: s.list_storages(node)),
+            ('list_os_templates', lambda s, i: s.list_os_templates(node)),
+            ('list_all_vms', lambda s, i: s.list_all_vms(node)),
+            ('get_cluster_inventory', lambda s, i: s.get_cluster_inventory()),
+            ('get_next_vmid', lambda s, i: s.get_next_vmid()),
+            ('get_vm_config', lambda s, i: s.get_vm_config(node, vmid)),
+            ('get_vm_configs', lambda s, i: s.get_vm_configs(self.guest_refs)),
+            ('clone_vm', clone_vm),
+            ('clone_vm_linked', clone_vm_linked),
+            ('start_vm', start_vm),
+            ('get_task_statuses', lambda s, i: s.get_task_statuses([(node, u) for u in self.upids if u])),
+            ('stop_vm', lambda s, i: s.stop_vm(node, vmid)),
+            ('reboot_vm', lambda s, i: s.reboot_vm(node, vmid)),
+            ('suspend_vm', lambda s, i: s.suspend_vm(node, vmid)),
+            ('create_snapshot', lambda s, i: s.create_snapshot(node, vmid, f'bench-{i}', 'benchmark')),
+            ('rollback_snapshot', lambda s, i: s.rollback_snapshot(node, vmid, f'bench-{i}')),
+            ('delete_snapshot', lambda s, i: s.delete_snapshot(node, vmid, f'bench-{i}')),
+            ('get_console_url', lambda s, i: s.get_console_url(node, vmid)),
+            ('delete_vm', delete_vm),
+        ]
+
+    def run(self):
+        only = set(self.args.only.split(',')) if self.args.only else None
+        return [
+            measure(name, operation, self.args.iterations, self.service, self.simulator.total_requests)
+            for name, operation in self.operations()
+            if not only or name in only
+        ]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ProxmoxService against a local Proxmox API simulator")
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--vms-per-node', type=int, default=50)
+    parser.add_argument('--lxc-per-node', type=int, default=10)
+    parser.add_argument('--templates-per-node', type=int, default=2)
+    parser.add_argument('--latency-ms', type=float, default=5.0, help="base latency of every API response")
+    parser.add_argument('--jitter-ms', type=float, default=2.0, help="random extra latency (0..jitter)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests failing with --error-status")
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--task-ms', type=float, default=0.0, help="duration of hypervisor tasks (UPID)")
+    parser.add_argument('--full-clone-ms', type=float, help="duration of full clone tasks (default --task-ms)")
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4, help="max_concurrency of the server (fan-out)")
+    parser.add_argument('--cold', action='store_true', help="new session per call (no session caches)")
+    parser.add_argument('--only', help="comma-separated operations to run")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    parser.add_argument('--log-level', default='CRITICAL')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.CRITICAL))
+    # Состояние circuit breaker хранится в БД Odoo - в бенчмарке оно не нужно
+    circuit_breaker.enabled = False
+
+    simulator = ProxmoxSimulator(
+        nodes=args.nodes, vms_per_node=args.vms_per_node, lxc_per_node=args.lxc_per_node,
+        templates_per_node=args.templates_per_node,
+        latency=args.latency_ms / 1000.0, jitter=args.jitter_ms / 1000.0,
+        error_rate=args.error_rate, error_status=args.error_status,
+        task_duration=args.task_ms / 1000.0,
+        full_clone_duration=args.full_clone_ms / 1000.0 if args.full_clone_ms is not None else None,
+        seed=args.seed,
+    )
+    with simulator:
+        results = ProxmoxBenchmark(simulator, args).run()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+# vm_rental/benchmarks/bench_vmware.py
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк VmwareService против заменителя vCenter (vcenter_simulator.py).
+
+Для каждого размера парка (по умолчанию 100, 1 000 и 10 000 VM) выводит число
+SOAP-запросов на вызов и задержки p50/p95 для list_all_vms, list_os_templates,
+create_vm, операций со снапшотами и остальных методов сервиса.
+
+Запуск (из каталога аддонов, Odoo и pyVmomi доступны в PYTHONPATH):
+    python -m vm_rental.benchmarks.bench_vmware --vms 100,1000,10000 --latency-ms 2
+    python -m vm_rental.benchmarks.bench_vmware --vms 1000 --only create_vm --task-ms 200 --calls
+"""
+import argparse
+import json
+import logging
+
+from ..services.circuit_breaker import circuit_breaker
+from ..services.connection_pool import ServiceSession
+from ..services.vmware_service import VmwareService
+from .common import make_server_stub, measure, print_table
+from .vcenter_simulator import VcenterSimulator
+
+
+class VmwareBenchmark:
+
+    def __init__(self, simulator, args):
+        self.simulator = simulator
+        self.args = args
+        self.server = make_server_stub(args.concurrency)
+        self.session = ServiceSession(simulator.service_instance())
+
+        self.node = simulator.cluster_names[0]
+        self.datastore = simulator.datastore_names[0]
+        self.template_uuid = simulator.vm_uuids(template=True)[0]
+        # Шаблон для связанных клонов: снапшот создается перед первым клонированием
+        self.linked_template_uuid = simulator.vm_uuids(template=True)[-1]
+        self.linked_template_ready = False
+        self.vm_uuids = simulator.vm_uuids()
+        # Операции питания и снапшотов - над включенными VM
+        self.running_vms = simulator.vm_uuids(power_state='poweredOn')
+        self.snapshot_vm = self.running_vms[0]
+        self.created = []
+
+    def service(self):
+        # --cold: новая сессия на каждый вызов (ServiceContent и индекс объектов читаются заново)
+        session = ServiceSession(self.simulator.service_instance()) if self.args.cold else self.session
+        return VmwareService(self.server, session=session)
+
+    def operations(self):
+        node, vm = self.node, self.snapshot_vm
+        power_vms = self.running_vms[1:1 + self.args.iterations]
+
+        def create_vm(s, i):
+            self.created.append(s.create_vm(node, f'bench-{len(self.created)}', self.template_uuid,
+                                            2, 2048, 40, self.datastore))
+
+        def create_vm_linked(s, i):
+            if not self.linked_template_ready:
+                s.create_snapshot(node, self.linked_template_uuid, 'base', 'linked clone base')
+                self.linked_template_ready = True
+            # Диск - как у шаблона: дочерний диск связанного клона не увеличивается
+            self.created.append(s.create_vm(node, f'bench-{len(self.created)}', self.linked_template_uuid,
+                                            2, 4096, 32, self.datastore, linked=True))
+
+        def delete_vm(s, i):
+            if self.created:
+                s.delete_vm(node, self.created.pop())
+
+        return [
+            ('list_nodes', lambda s, i: s.list_nodes()),
+            ('list_storages', lambda s, i: s.list_storages(node)),
+            ('list_os_templates', lambda s, i: s.list_os_templates(node)),
+            ('list_all_vms', lambda s, i: s.list_all_vms(node)),
+            ('get_cluster_inventory', lambda s, i: s.get_cluster_inventory()),
+            ('get_vm_config', lambda s, i: s.get_vm_config(vm)),
+            ('get_vm_configs', lambda s, i: s.get_vm_configs([(node, u) for u in self.vm_uuids[:20]])),
+            ('create_vm', create_vm),
+            ('create_vm_linked', create_vm_linked),
+            ('stop_vm', lambda s, i: s.stop_vm(node, power_vms[i % len(power_vms)])),
+            ('start_vm', lambda s, i: s.start_vm(node, power_vms[i % len(power_vms)])),
+            ('reboot_vm', lambda s, i: s.reboot_vm(node, vm)),
+            ('create_snapshot', lambda s, i: s.create_snapshot(node, vm, f'bench-{i}', 'benchmark')),
+            ('rollback_snapshot', lambda s, i: s.rollback_snapshot(node, vm, f'bench-{i}')),
+            ('delete_snapshot', lambda s, i: s.delete_snapshot(node, vm, f'bench-{i}')),
+            ('get_console_url', lambda s, i: s.get_console_url(node, vm)),
+            ('delete_vm', delete_vm),
+        ]
+
+    def run(self):
+        only = set(self.args.only.split(',')) if self.args.only else None
+        results = []
+        for name, operation in self.operations():
+            if only and name not in only:
+                continue
+            self.simulator.reset_counters()
+            result = measure(name, operation, self.args.iterations, self.service, self.simulator.total_calls)
+            result['objects_per_call'] = round(self.simulator.objects_returned / max(result['calls'], 1))
+            if self.args.calls:
+                result['breakdown'] = dict(self.simulator.calls.most_common())
+            results.append(result)
+        return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark VmwareService against an in-process vCenter stand-in")
+    parser.add_argument('--vms', default='100,1000,10000', help="comma-separated fleet sizes")
+    parser.add_argument('--clusters', type=int, default=2)
+    parser.add_argument('--hosts-per-cluster', type=int, default=4)
+    parser.add_argument('--standalone-hosts', type=int, default=1)
+    parser.add_argument('--templates', type=int, default=5)
+    parser.add_argument('--datastores', type=int, default=4)
+    parser.add_argument('--latency-ms', type=float, default=2.0, help="latency of every SOAP round-trip")
+    parser.add_argument('--jitter-ms', type=float, default=1.0, help="random extra latency (0..jitter)")
+    parser.add_argument('--object-us', type=float, default=20.0,
+                        help="extra RetrievePropertiesEx latency per returned object, microseconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of round-trips failing")
+    parser.add_argument('--error-kind', choices=('network', 'fault'), default='network')
+    parser.add_argument('--task-ms', type=float, default=0.0, help="duration of vCenter tasks")
+    parser.add_argument('--full-clone-ms', type=float, help="duration of full clone tasks (default --task-ms)")
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=4, help="max_concurrency of the server (fan-out)")
+    parser.add_argument('--cold', action='store_true', help="new session per call (no session caches)")
+    parser.add_argument('--only', help="comma-separated operations to run")
+    parser.add_argument('--calls', action='store_true', help="include per-method round-trip breakdown (JSON)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    parser.add_argument('--log-level', default='CRITICAL')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.CRITICAL))
+    # Состояние circuit breaker хранится в БД Odoo - в бенчмарке оно не нужно
+    circuit_breaker.enabled = False
+
+    results = []
+    for vm_count in [int(v) for v in args.vms.split(',') if v]:
+        simulator = VcenterSimulator(
+            clusters=args.clusters, hosts_per_cluster=args.hosts_per_cluster,
+            standalone_hosts=args.standalone_hosts, vms=vm_count, templates=args.templates,
+            datastores=args.datastores, latency=args.latency_ms / 1000.0, jitter=args.jitter_ms / 1000.0,
+            latency_per_object=args.object_us / 1e6, error_rate=args.error_rate, error_kind=args.error_kind,
+            task_duration=args.task_ms / 1000.0,
+            full_clone_duration=args.full_clone_ms / 1000.0 if args.full_clone_ms is not None else None,
+            seed=args.seed,
+        )
+        for result in VmwareBenchmark(simulator, args).run():
+            results.append(dict(result, vms=vm_count))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results, extra_columns=(('vms', 'vms'), ('objects_per_call', 'objects')))
+    return results
+
+
+if __name__ == '__main__':
+    main()
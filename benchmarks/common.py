@@ -0,0 +1,66 @@
+# vm_rental/benchmarks/common.py
+# -*- coding: utf-8 -*-
+"""Общие помощники бенчмарков сервисного слоя"""
+import time
+from types import SimpleNamespace
+
+
+def percentile(values, pct):
+    """Перцентиль по методу ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def make_server_stub(concurrency=4, host='127.0.0.1'):
+    """Значения hypervisor.server, которые сервис читает в __init__ (без ORM)"""
+    return SimpleNamespace(
+        id=1,
+        env=SimpleNamespace(cr=SimpleNamespace(dbname='vm_rental_benchmark')),
+        host=host,
+        breaker_threshold=3,
+        breaker_open_seconds=30,
+        connect_timeout=5,
+        read_timeout=30,
+        operation_timeout=120,
+        max_concurrency=concurrency,
+    )
+
+
+def measure(name, operation, iterations, make_service, count_requests):
+    """
+    Выполняет operation(service, i) iterations раз.
+    count_requests() - текущее число запросов к API (счетчик симулятора).
+    """
+    latencies, requests, errors = [], 0, 0
+    for i in range(iterations):
+        service = make_service()
+        before = count_requests()
+        started = time.perf_counter()
+        try:
+            operation(service, i)
+        except Exception:
+            errors += 1
+        latencies.append((time.perf_counter() - started) * 1000)
+        requests += count_requests() - before
+    return {
+        'operation': name,
+        'calls': len(latencies),
+        'errors': errors,
+        'requests_per_call': requests / len(latencies) if latencies else 0,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+    }
+
+
+def print_table(results, extra_columns=()):
+    header = f"{'operation':<24}" + ''.join(f'{title:>10}' for _key, title in extra_columns) \
+        + f"{'calls':>7}{'errors':>8}{'req/call':>10}{'p50 ms':>10}{'p95 ms':>10}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['operation']:<24}" + ''.join(f'{r[key]:>10}' for key, _title in extra_columns)
+              + f"{r['calls']:>7}{r['errors']:>8}{r['requests_per_call']:>10.1f}"
+              f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}")
@@ -0,0 +1,509 @@
+# vm_rental/benchmarks/proxmox_simulator.py
+# -*- coding: utf-8 -*-
+"""
+Локальный HTTP-заменитель REST API Proxmox VE для тестов и бенчмарков ProxmoxService.
+
+Моделирует ноды, хранилища, гостей qemu/lxc, задачи (UPID), снапшоты и vncproxy.
+Задержка, доля ошибок и размер парка настраиваются; каждый запрос учитывается
+в счетчиках по шаблону пути ("GET /nodes/{node}/qemu").
+
+Пример:
+    with ProxmoxSimulator(nodes=3, vms_per_node=100, latency=0.005) as sim:
+        api = sim.make_api()   # ProxmoxAPI, направленный на симулятор
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+API_PREFIX = '/api2/json'
+
+# (метод, шаблон пути, обработчик); шаблон используется и как ключ счетчиков
+ROUTES = [
+    ('GET', '/version', '_get_version'),
+    ('GET', '/nodes', '_get_nodes'),
+    ('GET', '/nodes/{node}/storage', '_get_storages'),
+    ('GET', '/nodes/{node}/storage/{storage}/content', '_get_storage_content'),
+    ('GET', '/nodes/{node}/{type}', '_get_guests'),
+    ('POST', '/nodes/{node}/lxc', '_create_container'),
+    ('GET', '/nodes/{node}/{type}/{vmid}/config', '_get_config'),
+    ('POST', '/nodes/{node}/{type}/{vmid}/config', '_set_config'),
+    ('PUT', '/nodes/{node}/{type}/{vmid}/resize', '_resize'),
+    ('POST', '/nodes/{node}/qemu/{vmid}/clone', '_clone'),
+    ('POST', '/nodes/{node}/qemu/{vmid}/template', '_convert_to_template'),
+    ('POST', '/nodes/{node}/{type}/{vmid}/status/{action}', '_set_status'),
+    ('POST', '/nodes/{node}/{bulk}', '_bulk_status'),
+    ('GET', '/nodes/{node}/{type}/{vmid}/snapshot', '_list_snapshots'),
+    ('POST', '/nodes/{node}/{type}/{vmid}/snapshot', '_create_snapshot'),
+    ('POST', '/nodes/{node}/{type}/{vmid}/snapshot/{snapname}/rollback', '_rollback_snapshot'),
+    ('DELETE', '/nodes/{node}/{type}/{vmid}/snapshot/{snapname}', '_delete_snapshot'),
+    ('POST', '/nodes/{node}/{type}/{vmid}/vncproxy', '_vncproxy'),
+    ('DELETE', '/nodes/{node}/{type}/{vmid}', '_delete_guest'),
+    ('GET', '/nodes/{node}/tasks/{upid}/status', '_task_status'),
+    ('GET', '/cluster/nextid', '_next_id'),
+    ('GET', '/cluster/resources', '_cluster_resources'),
+    ('GET', '/cluster/tasks', '_cluster_tasks'),
+]
+
+_SEGMENT_PATTERNS = {
+    'type': '(?P<type>qemu|lxc)',
+    'vmid': r'(?P<vmid>\d+)',
+    'bulk': '(?P<bulk>startall|stopall|suspendall)',
+}
+
+
+def _compile(template):
+    def segment(match):
+        name = match.group(1)
+        return _SEGMENT_PATTERNS.get(name, f'(?P<{name}>[^/]+)')
+    return re.compile('^' + re.sub(r'\{(\w+)\}', segment, template) + '$')
+
+
+_COMPILED_ROUTES = [(method, template, _compile(template), handler) for method, template, handler in ROUTES]
+
+
+class SimulatorError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ProxmoxSimulator:
+    """
+    Args:
+        nodes: количество нод
+        vms_per_node: qemu-гостей на ноду
+        lxc_per_node: lxc-гостей на ноду
+        templates_per_node: qemu-шаблонов на ноду
+        latency: базовая задержка ответа, сек.
+        jitter: случайная добавка к задержке (0..jitter), сек.
+        error_rate: доля запросов, завершающихся ошибкой error_status
+        error_status: HTTP-код инжектируемой ошибки
+        error_methods: ограничить ошибки методами ('GET', 'POST', ...)
+        task_duration: время выполнения задач (UPID), сек.
+        full_clone_duration: время полного клонирования, сек. (по умолчанию task_duration);
+            связанный клон выполняется за task_duration
+        seed: зерно генератора случайных чисел
+    """
+
+    def __init__(self, nodes=3, vms_per_node=20, lxc_per_node=5, templates_per_node=2,
+                 latency=0.0, jitter=0.0, error_rate=0.0, error_status=500, error_methods=None,
+                 task_duration=0.0, full_clone_duration=None, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.error_methods = set(error_methods) if error_methods else None
+        self.task_duration = task_duration
+        self.full_clone_duration = task_duration if full_clone_duration is None else full_clone_duration
+
+        self.requests = Counter()
+        self.errors = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._server = None
+        self._thread = None
+        self._pid = 1000
+
+        self.nodes = [f'pve{i + 1:02d}' for i in range(nodes)]
+        self.guests = {}
+        self.tasks = {}
+        self._populate(vms_per_node, lxc_per_node, templates_per_node)
+
+    # --- Жизненный цикл ---
+
+    def start(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Без Nagle: иначе keep-alive ответы задерживаются на delayed ACK (~40 мс)
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                simulator._handle(self, 'GET')
+
+            def do_POST(self):
+                simulator._handle(self, 'POST')
+
+            def do_PUT(self):
+                simulator._handle(self, 'PUT')
+
+            def do_DELETE(self):
+                simulator._handle(self, 'DELETE')
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='proxmox-simulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.port}{API_PREFIX}'
+
+    def make_api(self, timeout=(5, 30)):
+        """ProxmoxAPI (token auth), у которого запросы идут на симулятор по HTTP"""
+        from proxmoxer import ProxmoxAPI
+        api = ProxmoxAPI('127.0.0.1', port=self.port, user='root@pam', token_name='simulator',
+                         token_value='secret', verify_ssl=False, timeout=timeout)
+        api._store['base_url'] = self.base_url
+        return api
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests.clear()
+            self.errors.clear()
+
+    def total_requests(self):
+        with self._lock:
+            return sum(self.requests.values())
+
+    # --- Парк ---
+
+    def _populate(self, vms_per_node, lxc_per_node, templates_per_node):
+        vmid = 100
+        for node in self.nodes:
+            for i in range(templates_per_node):
+                self._add_guest(9000 + len([g for g in self.guests.values() if g['template']]), node, 'qemu',
+                                f'template-{node}-{i}', template=True)
+            for i in range(vms_per_node):
+                self._add_guest(vmid, node, 'qemu', f'vm-{vmid}', status='running' if i % 3 else 'stopped')
+                vmid += 1
+            for i in range(lxc_per_node):
+                self._add_guest(vmid, node, 'lxc', f'ct-{vmid}', status='running')
+                vmid += 1
+
+    def _add_guest(self, vmid, node, vm_type, name, status='stopped', template=False, cores=2, memory=2048, disk=32,
+                   storage='local-lvm'):
+        self.guests[int(vmid)] = {
+            'vmid': int(vmid), 'node': node, 'type': vm_type, 'name': name, 'status': status,
+            'template': template, 'cores': cores, 'memory': memory, 'disk': disk, 'snapshots': {},
+            'storage': storage,
+        }
+        return self.guests[int(vmid)]
+
+    def _storages(self, node):
+        return [
+            {'storage': 'local', 'type': 'dir', 'content': 'iso,vztmpl,backup', 'shared': 0,
+             'total': 100 * 2 ** 30, 'used': 20 * 2 ** 30},
+            {'storage': 'local-lvm', 'type': 'lvmthin', 'content': 'images,rootdir', 'shared': 0,
+             'total': 500 * 2 ** 30, 'used': 120 * 2 ** 30},
+            {'storage': 'nfs-templates', 'type': 'nfs', 'content': 'vztmpl', 'shared': 1,
+             'total': 1024 * 2 ** 30, 'used': 50 * 2 ** 30},
+        ]
+
+    def _storage_volumes(self, storage):
+        if storage == 'nfs-templates':
+            return ['debian-12-standard_12.2-1_amd64.tar.zst', 'ubuntu-22.04-standard_22.04-1_amd64.tar.zst']
+        if storage == 'local':
+            return ['alpine-3.19-default_20240207_amd64.tar.xz']
+        return []
+
+    # --- Обработка запросов ---
+
+    def _handle(self, request, method):
+        url = urlsplit(request.path)
+        path = url.path[len(API_PREFIX):] if url.path.startswith(API_PREFIX) else url.path
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(request.headers.get('Content-Length') or 0)
+        if length:
+            body = request.rfile.read(length).decode('utf-8')
+            params.update({k: v[-1] for k, v in parse_qs(body).items()})
+
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        status, payload = 200, None
+        route_key = f'{method} {path}'
+        try:
+            for route_method, template, regex, handler in _COMPILED_ROUTES:
+                match = regex.match(path)
+                if route_method != method or not match:
+                    continue
+                route_key = f'{method} {template}'
+                with self._lock:
+                    self.requests[route_key] += 1
+                    if self._should_fail(method):
+                        self.errors[route_key] += 1
+                        raise SimulatorError(self.error_status, 'injected error')
+                    payload = getattr(self, handler)(params, **match.groupdict())
+                break
+            else:
+                with self._lock:
+                    self.requests[route_key] += 1
+                raise SimulatorError(501, f'Method \'{method} {path}\' not implemented')
+        except SimulatorError as e:
+            status, payload = e.status, None
+            body = json.dumps({'data': None, 'errors': {'message': e.message}}).encode('utf-8')
+        else:
+            body = json.dumps({'data': payload}).encode('utf-8')
+
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json;charset=UTF-8')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _should_fail(self, method):
+        if not self.error_rate:
+            return False
+        if self.error_methods and method not in self.error_methods:
+            return False
+        return self._random.random() < self.error_rate
+
+    def _guest(self, node, vmid, vm_type=None):
+        guest = self.guests.get(int(vmid))
+        if not guest or guest['node'] != node or (vm_type and guest['type'] != vm_type):
+            raise SimulatorError(500, f'Configuration file \'{vm_type or "qemu"}/{vmid}.conf\' does not exist')
+        return guest
+
+    def _new_task(self, node, task_type, task_id, duration=None, exitstatus='OK'):
+        self._pid += 1
+        started = time.time()
+        upid = f'UPID:{node}:{self._pid:08X}:{int(started * 100) & 0xFFFFFFFF:08X}:{int(started):08X}:' \
+               f'{task_type}:{task_id}:root@pam:'
+        duration = self.task_duration if duration is None else duration
+        self.tasks[upid] = {'upid': upid, 'node': node, 'type': task_type, 'id': str(task_id),
+                            'starttime': int(started), 'due': started + duration, 'exitstatus': exitstatus}
+        return upid
+
+    def _task_finished(self, task):
+        return time.time() >= task['due']
+
+    # --- Эндпоинты ---
+
+    def _get_version(self, params):
+        return {'version': '8.1.4', 'release': '8.1', 'repoid': 'simulator'}
+
+    def _get_nodes(self, params):
+        return [{'node': node, 'status': 'online', 'maxcpu': 32, 'maxmem': 128 * 2 ** 30, 'cpu': 0.1,
+                 'mem': 32 * 2 ** 30, 'maxdisk': 1024 * 2 ** 30, 'disk': 100 * 2 ** 30} for node in self.nodes]
+
+    def _get_storages(self, params, node):
+        return [dict(s, active=1, enabled=1, avail=s['total'] - s['used']) for s in self._storages(node)]
+
+    def _get_storage_content(self, params, node, storage):
+        content = params.get('content')
+        if content and content != 'vztmpl':
+            return []
+        return [{'volid': f'{storage}:vztmpl/{name}', 'content': 'vztmpl', 'format': 'tzst', 'size': 120 * 2 ** 20}
+                for name in self._storage_volumes(storage)]
+
+    def _get_guests(self, params, node, type):
+        guests = []
+        for guest in self.guests.values():
+            if guest['node'] != node or guest['type'] != type:
+                continue
+            item = {'vmid': guest['vmid'], 'name': guest['name'], 'status': guest['status'],
+                    'cpus': guest['cores'], 'maxmem': guest['memory'] * 2 ** 20, 'maxdisk': guest['disk'] * 2 ** 30}
+            if guest['template']:
+                item['template'] = 1
+            guests.append(item)
+        return guests
+
+    def _get_config(self, params, node, type, vmid):
+        guest = self._guest(node, vmid, type)
+        if type == 'lxc':
+            return {'hostname': guest['name'], 'cores': guest['cores'], 'memory': guest['memory'],
+                    'rootfs': f'local-lvm:vm-{vmid}-disk-0,size={guest["disk"]}G'}
+        config = {'name': guest['name'], 'cores': guest['cores'], 'memory': guest['memory'],
+                  'scsi0': f'{guest["storage"]}:{"base" if guest["template"] else "vm"}-{vmid}-disk-0,'
+                           f'size={guest["disk"]}G',
+                  'ide2': 'none,media=cdrom'}
+        if guest['template']:
+            config['template'] = 1
+        # Как в PVE: SHA1 файла конфигурации
+        config['digest'] = hashlib.sha1(repr(sorted(config.items())).encode()).hexdigest()
+        return config
+
+    def _set_config(self, params, node, type, vmid):
+        guest = self._guest(node, vmid, type)
+        if 'cores' in params:
+            guest['cores'] = int(params['cores'])
+        if 'memory' in params:
+            guest['memory'] = int(params['memory'])
+        if 'name' in params:
+            guest['name'] = params['name']
+        return self._new_task(node, 'qmconfig', vmid)
+
+    def _resize(self, params, node, type, vmid):
+        guest = self._guest(node, vmid, type)
+        size = params.get('size', '+0G')
+        if size.startswith('+'):
+            guest['disk'] += int(size.strip('+G') or 0)
+        else:
+            guest['disk'] = int(size.strip('G') or guest['disk'])
+        return self._new_task(node, 'resize', vmid)
+
+    def _clone(self, params, node, vmid):
+        source = self._guest(node, vmid, 'qemu')
+        newid = int(params['newid'])
+        if newid in self.guests:
+            raise SimulatorError(500, f'unable to create VM {newid}: config file already exists')
+        # Как в PVE: без full шаблон клонируется связанным клоном, storage для него недопустим
+        full = str(params.get('full', '0' if source['template'] else '1')).lower() in ('1', 'true')
+        if not full and not source['template']:
+            raise SimulatorError(500, 'Linked clone feature is only available for templates')
+        if not full and params.get('storage'):
+            raise SimulatorError(400, "parameter 'storage' is not allowed for linked clones")
+        target = params.get('target') or node
+        if target != node and not any(item['storage'] == source['storage'] and item['shared']
+                                      for item in self._storages(node)):
+            raise SimulatorError(500, f"can't clone VM to node '{target}' (VM uses local storage)")
+        clone = self._add_guest(newid, target, 'qemu', params.get('name') or f'vm-{newid}',
+                                cores=source['cores'], memory=source['memory'], disk=source['disk'],
+                                storage=params.get('storage') if full and params.get('storage') else source['storage'])
+        if not full:
+            clone['base'] = source['vmid']
+        return self._new_task(node, 'qmclone', vmid, duration=self.full_clone_duration if full else None)
+
+    def _convert_to_template(self, params, node, vmid):
+        guest = self._guest(node, vmid, 'qemu')
+        guest['template'] = True
+        return self._new_task(node, 'qmtemplate', vmid)
+
+    def _create_container(self, params, node):
+        vmid = int(params['vmid'])
+        if vmid in self.guests:
+            raise SimulatorError(500, f'CT {vmid} already exists')
+        self._add_guest(vmid, node, 'lxc', params.get('hostname') or f'ct-{vmid}',
+                        cores=int(params.get('cores', 1)), memory=int(params.get('memory', 512)))
+        return self._new_task(node, 'vzcreate', vmid)
+
+    def _set_status(self, params, node, type, vmid, action):
+        guest = self._guest(node, vmid, type)
+        new_status = {'start': 'running', 'stop': 'stopped', 'shutdown': 'stopped', 'reboot': 'running',
+                      'suspend': 'paused', 'resume': 'running'}.get(action)
+        if new_status is None:
+            raise SimulatorError(501, f'Unknown status action {action}')
+        guest['status'] = new_status
+        prefix = 'qm' if type == 'qemu' else 'vz'
+        return self._new_task(node, f'{prefix}{action}', vmid)
+
+    def _bulk_status(self, params, node, bulk):
+        # Как в PVE: без force startall запускает только гостей с onboot (в симуляторе их нет),
+        # suspendall касается только qemu
+        vmids = {int(v) for v in params.get('vms', '').split(',') if v}
+        new_status = {'startall': 'running', 'stopall': 'stopped', 'suspendall': 'paused'}[bulk]
+        if bulk == 'startall' and not int(params.get('force', 0)):
+            return self._new_task(node, bulk, '')
+        for vmid, guest in self.guests.items():
+            if guest['node'] != node or guest['template'] or (vmids and vmid not in vmids):
+                continue
+            if bulk == 'suspendall' and guest['type'] != 'qemu':
+                continue
+            guest['status'] = new_status
+        return self._new_task(node, bulk, '')
+
+    def _list_snapshots(self, params, node, type, vmid):
+        guest = self._guest(node, vmid, type)
+        return [{'name': name, **snap} for name, snap in guest['snapshots'].items()] + [{'name': 'current'}]
+
+    def _create_snapshot(self, params, node, type, vmid):
+        guest = self._guest(node, vmid, type)
+        name = params['snapname']
+        if name in guest['snapshots']:
+            raise SimulatorError(500, f'snapshot name \'{name}\' already used')
+        guest['snapshots'][name] = {'description': params.get('description', ''), 'snaptime': int(time.time())}
+        return self._new_task(node, 'qmsnapshot', vmid)
+
+    def _rollback_snapshot(self, params, node, type, vmid, snapname):
+        guest = self._guest(node, vmid, type)
+        if snapname not in guest['snapshots']:
+            raise SimulatorError(500, f'snapshot \'{snapname}\' does not exist')
+        return self._new_task(node, 'qmrollback', vmid)
+
+    def _delete_snapshot(self, params, node, type, vmid, snapname):
+        guest = self._guest(node, vmid, type)
+        if guest['snapshots'].pop(snapname, None) is None:
+            raise SimulatorError(500, f'snapshot \'{snapname}\' does not exist')
+        return self._new_task(node, 'qmdelsnapshot', vmid)
+
+    def _vncproxy(self, params, node, type, vmid):
+        self._guest(node, vmid, type)
+        return {'port': str(5900 + int(vmid) % 100), 'ticket': f'PVEVNC:{vmid}:simulator', 'user': 'root@pam',
+                'cert': '', 'upid': self._new_task(node, 'vncproxy', vmid)}
+
+    def _delete_guest(self, params, node, type, vmid):
+        guest = self._guest(node, vmid, type)
+        task_type = 'qmdestroy' if type == 'qemu' else 'vzdestroy'
+        # Как в PVE: запрос принимается, а занятость базового тома связанными клонами
+        # обнаруживает уже задача удаления
+        if any(other.get('base') == guest['vmid'] for other in self.guests.values()):
+            return self._new_task(node, task_type, vmid, exitstatus=f"base volume 'base-{vmid}-disk-0' is still "
+                                                                   f"in use by linked cloned VM")
+        del self.guests[guest['vmid']]
+        return self._new_task(node, task_type, vmid)
+
+    def _task_status(self, params, node, upid):
+        task = self.tasks.get(upid)
+        if not task:
+            raise SimulatorError(500, f'no such task \'{upid}\'')
+        if self._task_finished(task):
+            return {'upid': upid, 'node': node, 'status': 'stopped', 'exitstatus': task['exitstatus']}
+        return {'upid': upid, 'node': node, 'status': 'running'}
+
+    def _next_id(self, params):
+        return str(max(self.guests, default=99) + 1)
+
+    def _cluster_resources(self, params):
+        wanted = params.get('type')
+        resources = []
+        if wanted in (None, 'node'):
+            for node in self._get_nodes(params):
+                resources.append(dict(node, type='node', id=f'node/{node["node"]}'))
+        if wanted in (None, 'storage'):
+            for node in self.nodes:
+                for storage in self._storages(node):
+                    resources.append({
+                        'type': 'storage', 'id': f'storage/{node}/{storage["storage"]}', 'node': node,
+                        'storage': storage['storage'], 'status': 'available', 'content': storage['content'],
+                        'plugintype': storage['type'], 'shared': storage['shared'],
+                        'maxdisk': storage['total'], 'disk': storage['used'],
+                    })
+        if wanted in (None, 'vm'):
+            for guest in self.guests.values():
+                resources.append({
+                    'type': guest['type'], 'id': f'{guest["type"]}/{guest["vmid"]}', 'vmid': guest['vmid'],
+                    'node': guest['node'], 'name': guest['name'], 'status': guest['status'],
+                    'template': 1 if guest['template'] else 0, 'maxcpu': guest['cores'],
+                    'maxmem': guest['memory'] * 2 ** 20, 'maxdisk': guest['disk'] * 2 ** 30,
+                })
+        return resources
+
+    def _cluster_tasks(self, params):
+        tasks = []
+        for task in self.tasks.values():
+            item = {'upid': task['upid'], 'node': task['node'], 'type': task['type'], 'id': task['id'],
+                    'starttime': task['starttime'], 'user': 'root@pam'}
+            if self._task_finished(task):
+                item.update(endtime=int(task['due']), status=task['exitstatus'])
+            tasks.append(item)
+        return tasks
@@ -0,0 +1,699 @@
+# vm_rental/benchmarks/vcenter_simulator.py
+# -*- coding: utf-8 -*-
+"""
+Заменитель vCenter в процессе для тестов и бенчмарков VmwareService.
+
+Симулятор выступает SOAP-стабом pyVmomi: управляемые объекты - настоящие vim.*
+(isinstance, типы данных и сигнатуры методов как у vCenter), а каждый вызов метода
+или чтение свойства, которые в реальности были бы отдельным SOAP-запросом,
+проходят через InvokeMethod/InvokeAccessor, учитываются в счетчиках
+("VirtualMachine.PowerOnVM_Task", "Task.info (property)") и получают задержку.
+
+Моделируются инвентарь (кластеры, хосты, пулы, хранилища, VM и шаблоны),
+PropertyCollector (RetrievePropertiesEx с постраничной выдачей, WaitForUpdatesEx),
+задачи, снапшоты, клонирование (полное, связанное, InstantClone) и реконфигурация.
+
+Пример:
+    sim = VcenterSimulator(vms=1000, latency=0.002)
+    si = sim.service_instance()    # vim.ServiceInstance, как из SmartConnect
+"""
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from pyVmomi import vim, vmodl
+
+PC = vmodl.query.PropertyCollector
+
+POWERED_ON = vim.VirtualMachinePowerState.poweredOn
+POWERED_OFF = vim.VirtualMachinePowerState.poweredOff
+SUSPENDED = vim.VirtualMachinePowerState.suspended
+
+TASK_RUNNING = vim.TaskInfo.State.running
+TASK_SUCCESS = vim.TaskInfo.State.success
+TASK_ERROR = vim.TaskInfo.State.error
+
+# Максимальное ожидание WaitForUpdatesEx без maxWaitSeconds, сек.
+DEFAULT_MAX_WAIT = 60
+
+
+class VcenterSimulator:
+    """
+    Args:
+        clusters: количество кластеров (ClusterComputeResource)
+        hosts_per_cluster: хостов в кластере
+        standalone_hosts: хостов вне кластеров (ComputeResource)
+        vms: количество VM (без шаблонов)
+        templates: количество шаблонов
+        datastores: количество хранилищ (доступны всем хостам)
+        latency: задержка одного SOAP-запроса, сек.
+        jitter: случайная добавка к задержке (0..jitter), сек.
+        latency_per_object: добавка к RetrievePropertiesEx на каждый объект страницы, сек.
+        error_rate: доля запросов, завершающихся ошибкой
+        error_kind: 'network' (обрыв соединения) или 'fault' (vmodl.fault.SystemError)
+        task_duration: время выполнения задач, сек.
+        full_clone_duration: время полного клонирования, сек. (по умолчанию task_duration);
+            связанный и instant-клон выполняются за task_duration
+        seed: зерно генератора случайных чисел
+    """
+
+    def __init__(self, clusters=2, hosts_per_cluster=4, standalone_hosts=1, vms=100, templates=5, datastores=4,
+                 latency=0.0, jitter=0.0, latency_per_object=0.0, error_rate=0.0, error_kind='network',
+                 task_duration=0.0, full_clone_duration=None, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.latency_per_object = latency_per_object
+        self.error_rate = error_rate
+        self.error_kind = error_kind
+        self.task_duration = task_duration
+        self.full_clone_duration = task_duration if full_clone_duration is None else full_clone_duration
+
+        self.calls = Counter()
+        self.objects_returned = 0
+        self.errors = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._sequence = 0
+
+        # moId -> свойства верхнего уровня (для VM и задач - см. _vms/_tasks)
+        self._entities = {}
+        self._objects = {}
+        self._vms = {}
+        self._vm_by_uuid = {}
+        self._tasks = {}
+        self._snapshots = {}
+        self._views = {}
+        self._retrievals = {}
+        self._collectors = {}
+
+        self._build_inventory(clusters, hosts_per_cluster, standalone_hosts, vms, templates, datastores)
+
+    # --- Публичный API ---
+
+    def service_instance(self):
+        return vim.ServiceInstance('ServiceInstance', self)
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+            self.objects_returned = 0
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    @property
+    def cluster_names(self):
+        return [self._entities[c._moId]['name'] for c in self._objects.values()
+                if isinstance(c, vim.ClusterComputeResource)]
+
+    @property
+    def datastore_names(self):
+        return [self._entities[d._moId]['name'] for d in self._objects.values() if isinstance(d, vim.Datastore)]
+
+    def vm_uuids(self, template=False, power_state=None):
+        return [state['uuid'] for state in self._vms.values()
+                if state['template'] == template and power_state in (None, state['power'])]
+
+    # --- Интерфейс стаба pyVmomi ---
+
+    def InvokeMethod(self, mo, info, args):
+        key = f'{mo._wsdlName}.{info.wsdlName}'
+        params = dict(zip([param.name for param in info.params], args))
+        self._round_trip(key)
+        if info.wsdlName == 'WaitForUpdatesEx':
+            # Ожидание не держит блокировку симулятора
+            return self._wait_for_updates(mo, **params)
+        with self._lock:
+            self._advance_tasks()
+            handler = getattr(self, f'_m_{mo._wsdlName}_{info.wsdlName}', None)
+            if handler is None:
+                raise vmodl.fault.NotImplemented(msg=f'{key} is not simulated')
+            return handler(mo, **params)
+
+    def InvokeAccessor(self, mo, info):
+        self._round_trip(f'{mo._wsdlName}.{info.name} (property)')
+        with self._lock:
+            self._advance_tasks()
+            return self._top_property(mo, info.name)
+
+    def SupportServerGUIDs(self):
+        return False
+
+    def _round_trip(self, key):
+        with self._lock:
+            self.calls[key] += 1
+            fail = self.error_rate and self._random.random() < self.error_rate
+            if fail:
+                self.errors[key] += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            if self.error_kind == 'fault':
+                raise vmodl.fault.SystemError(msg='Injected fault', reason='simulator')
+            raise ConnectionResetError(f'Injected network error in {key}')
+
+    # --- Инвентарь ---
+
+    def _next_id(self):
+        self._sequence += 1
+        return self._sequence
+
+    def _add(self, mo, **props):
+        self._objects[mo._moId] = mo
+        self._entities[mo._moId] = props
+        return mo
+
+    def _build_inventory(self, clusters, hosts_per_cluster, standalone_hosts, vm_count, template_count, datastore_count):
+        self.root_folder = self._add(vim.Folder('group-d1', self), name='Datacenters', parent=None)
+        self.datacenter = self._add(vim.Datacenter('datacenter-1', self), name='DC1', parent=self.root_folder)
+        self.vm_folder = self._add(vim.Folder('group-v1', self), name='vm', parent=self.datacenter)
+        self.host_folder = self._add(vim.Folder('group-h1', self), name='host', parent=self.datacenter)
+        self.datastore_folder = self._add(vim.Folder('group-s1', self), name='datastore', parent=self.datacenter)
+
+        datastores = [
+            self._add(vim.Datastore(f'datastore-{i + 1}', self), name=f'datastore{i + 1}', parent=self.datastore_folder,
+                      summary=None, host=None)
+            for i in range(datastore_count)
+        ]
+        self._datastores = datastores
+        self._hosts = []
+        # пул ресурсов -> хосты его ComputeResource
+        self._pool_hosts = {}
+        host_number = 0
+
+        def add_compute_resource(cls, mo_id, name, host_count):
+            nonlocal host_number
+            compute = vim.ClusterComputeResource(mo_id, self) if cls == 'cluster' else vim.ComputeResource(mo_id, self)
+            pool = self._add(vim.ResourcePool(f'resgroup-{mo_id}', self), name='Resources', parent=compute)
+            hosts = []
+            for _i in range(host_count):
+                host_number += 1
+                host_name = name if cls == 'standalone' else f'esx{host_number:02d}.lab.local'
+                hosts.append(self._add(vim.HostSystem(f'host-{host_number}', self), name=host_name, parent=compute,
+                                       datastore=vim.Datastore.Array(datastores), summary=None,
+                                       runtime=vim.host.RuntimeInfo(connectionState='connected')))
+            self._add(compute, name=name, parent=self.host_folder, resourcePool=pool,
+                      host=vim.HostSystem.Array(hosts), datastore=vim.Datastore.Array(datastores))
+            self._pool_hosts[pool._moId] = hosts
+            self._hosts.extend(hosts)
+
+        for i in range(clusters):
+            add_compute_resource('cluster', f'domain-c{i + 1}', f'Cluster-{i + 1}', hosts_per_cluster)
+        for i in range(standalone_hosts):
+            add_compute_resource('standalone', f'domain-s{i + 1}', f'esx-standalone-{i + 1:02d}.lab.local', 1)
+
+        for datastore in datastores:
+            self._entities[datastore._moId]['host'] = vim.Datastore.HostMount.Array(
+                [vim.Datastore.HostMount(key=host) for host in self._hosts])
+
+        for i in range(template_count):
+            self._add_vm(f'template-{i + 1}', self._hosts[0], datastores[0], template=True, power=POWERED_OFF)
+        for i in range(vm_count):
+            host = self._hosts[i % len(self._hosts)]
+            self._add_vm(f'vm-{i + 1:05d}', host, datastores[i % len(datastores)],
+                         power=POWERED_ON if i % 3 else POWERED_OFF)
+
+    def _add_vm(self, name, host, datastore, template=False, power=POWERED_OFF, cores=2, memory=2048, disk=32):
+        mo = vim.VirtualMachine(f'vm-{self._next_id()}', self)
+        state = {
+            'mo': mo, 'name': name, 'uuid': str(uuid.UUID(int=self._random.getrandbits(128))),
+            'template': template, 'power': power, 'host': host, 'datastore': datastore, 'parent': self.vm_folder,
+            'cores': cores, 'memory': memory, 'disk': disk, 'snapshots': [],
+        }
+        self._objects[mo._moId] = mo
+        self._vms[mo._moId] = state
+        self._vm_by_uuid[state['uuid']] = mo
+        return mo
+
+    # --- Свойства ---
+
+    # Пути, которые читаются без построения объектов данных целиком
+    _VM_PATHS = {
+        'name': lambda s: s['name'],
+        'parent': lambda s: s['parent'],
+        'config.name': lambda s: s['name'],
+        'config.template': lambda s: s['template'],
+        'config.instanceUuid': lambda s: s['uuid'],
+        'config.hardware.numCPU': lambda s: s['cores'],
+        'config.hardware.memoryMB': lambda s: s['memory'],
+        'runtime.powerState': lambda s: s['power'],
+        'runtime.host': lambda s: s['host'],
+        'summary.config.instanceUuid': lambda s: s['uuid'],
+    }
+
+    def _property(self, mo, path):
+        state = self._vms.get(mo._moId)
+        if state is not None and path in self._VM_PATHS:
+            return self._VM_PATHS[path](state)
+        if path == 'info.state' and mo._moId in self._tasks:
+            return self._tasks[mo._moId]['state']
+        head, _sep, rest = path.partition('.')
+        value = self._top_property(mo, head)
+        for name in rest.split('.') if rest else []:
+            if value is None:
+                return None
+            value = getattr(value, name, None)
+        return value
+
+    def _top_property(self, mo, name):
+        state = self._vms.get(mo._moId)
+        if state is not None:
+            return self._vm_property(state, name)
+        if mo._moId in self._tasks:
+            return self._task_info(self._tasks[mo._moId]) if name == 'info' else None
+        if mo._moId in self._views:
+            return self._views[mo._moId]['objects'] if name == 'view' else None
+        if name == 'summary' and isinstance(mo, vim.HostSystem):
+            return self._host_summary(mo)
+        if name == 'summary' and isinstance(mo, vim.Datastore):
+            return self._datastore_summary(mo)
+        return self._entities.get(mo._moId, {}).get(name)
+
+    # Хост: 2 сокета по 16 ядер 2.4 ГГц, 512 ГБ; хранилище - 4 ТБ VMFS
+    HOST_CORES = 32
+    HOST_CPU_MHZ = 2400
+    HOST_MEMORY = 512 * 2 ** 30
+    DATASTORE_CAPACITY = 4 * 2 ** 40
+
+    def _host_summary(self, host):
+        powered_on = [state for state in self._vms.values()
+                      if state['host'] is host and state['power'] == POWERED_ON]
+        return vim.host.Summary(
+            host=host,
+            hardware=vim.host.Summary.HardwareSummary(numCpuCores=self.HOST_CORES, cpuMhz=self.HOST_CPU_MHZ,
+                                                      memorySize=self.HOST_MEMORY),
+            quickStats=vim.host.Summary.QuickStats(
+                overallCpuUsage=sum(state['cores'] for state in powered_on) * self.HOST_CPU_MHZ // 4,
+                overallMemoryUsage=sum(state['memory'] for state in powered_on)),
+        )
+
+    def _datastore_summary(self, datastore):
+        used = sum(state['disk'] for state in self._vms.values() if state['datastore'] is datastore) * 2 ** 30
+        return vim.Datastore.Summary(
+            datastore=datastore, name=self._entities[datastore._moId]['name'], url=f'ds:///{datastore._moId}/',
+            capacity=self.DATASTORE_CAPACITY, freeSpace=self.DATASTORE_CAPACITY - used, type='VMFS',
+            accessible=True, multipleHostAccess=True,
+        )
+
+    def _vm_property(self, state, name):
+        if name == 'name':
+            return state['name']
+        if name == 'parent':
+            return state['parent']
+        if name == 'datastore':
+            return vim.Datastore.Array([state['datastore']])
+        if name == 'config':
+            return vim.vm.ConfigInfo(
+                name=state['name'], template=state['template'], instanceUuid=state['uuid'],
+                uuid=state['uuid'], guestId='ubuntu64Guest',
+                hardware=vim.vm.VirtualHardware(numCPU=state['cores'], memoryMB=state['memory'],
+                                                device=self._vm_devices(state)),
+            )
+        if name == 'runtime':
+            return vim.vm.RuntimeInfo(powerState=state['power'], host=state['host'], connectionState='connected')
+        if name == 'summary':
+            return vim.vm.Summary(
+                config=vim.vm.Summary.ConfigSummary(
+                    name=state['name'], template=state['template'], instanceUuid=state['uuid'],
+                    numCpu=state['cores'], memorySizeMB=state['memory']),
+                runtime=vim.vm.RuntimeInfo(powerState=state['power'], host=state['host']),
+            )
+        if name == 'snapshot':
+            if not state['snapshots']:
+                return None
+            trees = [self._snapshot_tree(state, snapshot) for snapshot in state['snapshots']]
+            return vim.vm.SnapshotInfo(currentSnapshot=state['snapshots'][-1]['mo'], rootSnapshotList=trees)
+        return None
+
+    def _vm_devices(self, state):
+        disk = vim.vm.device.VirtualDisk(key=2000, controllerKey=1000, unitNumber=0,
+                                         capacityInKB=state['disk'] * 1024 * 1024)
+        return vim.vm.device.VirtualDevice.Array([disk])
+
+    def _snapshot_tree(self, state, snapshot):
+        return vim.vm.SnapshotTree(
+            snapshot=snapshot['mo'], vm=state['mo'], name=snapshot['name'], description=snapshot['description'],
+            id=snapshot['id'], createTime=snapshot['created'], state=state['power'], quiesced=False,
+            childSnapshotList=[],
+        )
+
+    # --- ServiceInstance, ViewManager, SearchIndex ---
+
+    def _m_ServiceInstance_RetrieveServiceContent(self, mo):
+        return vim.ServiceInstanceContent(
+            rootFolder=self.root_folder,
+            propertyCollector=vmodl.query.PropertyCollector('propertyCollector', self),
+            viewManager=vim.view.ViewManager('ViewManager', self),
+            searchIndex=vim.SearchIndex('SearchIndex', self),
+            about=vim.AboutInfo(
+                name='VMware vCenter Server', fullName='VMware vCenter Server 8.0.2 build-simulator',
+                vendor='VMware, Inc.', version='8.0.2', build='0', osType='linux-x64', productLineId='vpx',
+                apiType='VirtualCenter', apiVersion='8.0.2.0', instanceUuid='00000000-0000-0000-0000-000000000001',
+            ),
+        )
+
+    def _m_ServiceInstance_CurrentTime(self, mo):
+        return datetime.now(timezone.utc)
+
+    def _m_ViewManager_CreateContainerView(self, mo, container, type, recursive):
+        view = vim.view.ContainerView(f'session[simulator]view-{self._next_id()}', self)
+        wanted = tuple(type or [vim.ManagedEntity])
+        objects = [obj for obj in self._objects.values()
+                   if isinstance(obj, wanted) and self._contains(container, obj, recursive)]
+        self._views[view._moId] = {'objects': vim.ManagedObject.Array(objects)}
+        return view
+
+    def _contains(self, container, obj, recursive=True):
+        """
+        Виден ли obj в ContainerView с корнем container: по цепочке parent, а VM -
+        также через свой хост (ComputeResource, пул ресурсов), как в vCenter.
+        """
+        if container is None or container is self.root_folder and recursive:
+            return True
+        state = self._vms.get(obj._moId)
+        if state is not None:
+            compute = self._entities[state['host']._moId]['parent']
+            direct = [state['parent'], state['host'], self._entities[compute._moId]['resourcePool']]
+        else:
+            direct = [self._entities.get(obj._moId, {}).get('parent')]
+        if not recursive:
+            return any(mo is container for mo in direct)
+        pending, seen = list(direct), set()
+        while pending:
+            mo = pending.pop()
+            if mo is None or mo._moId in seen:
+                continue
+            if mo is container:
+                return True
+            seen.add(mo._moId)
+            pending.append(self._entities.get(mo._moId, {}).get('parent'))
+        return False
+
+    def _m_ContainerView_DestroyView(self, mo):
+        self._views.pop(mo._moId, None)
+
+    def _m_SearchIndex_FindByUuid(self, mo, datacenter, uuid, vmSearch, instanceUuid):
+        vm = self._vm_by_uuid.get(uuid)
+        return vm if vm is not None and vmSearch else None
+
+    # --- PropertyCollector ---
+
+    def _m_PropertyCollector_RetrievePropertiesEx(self, mo, specSet, options):
+        results = []
+        for spec in specSet:
+            for obj in self._spec_objects(spec.objectSet):
+                for prop_spec in spec.propSet:
+                    if not isinstance(obj, prop_spec.type):
+                        continue
+                    prop_set = []
+                    for path in prop_spec.pathSet or []:
+                        value = self._property(obj, path)
+                        if value is not None:
+                            prop_set.append(vmodl.DynamicProperty(name=path, val=value))
+                    results.append(PC.ObjectContent(obj=obj, propSet=prop_set))
+                    break
+        page_size = options.maxObjects if options and options.maxObjects else len(results) or 1
+        return self._page(results, page_size)
+
+    def _m_PropertyCollector_ContinueRetrievePropertiesEx(self, mo, token):
+        results, page_size = self._retrievals.pop(token, ([], 1))
+        return self._page(results, page_size)
+
+    def _m_PropertyCollector_CancelRetrievePropertiesEx(self, mo, token):
+        self._retrievals.pop(token, None)
+
+    def _page(self, results, page_size):
+        if not results:
+            return None
+        page, rest = results[:page_size], results[page_size:]
+        token = None
+        if rest:
+            token = f'token-{self._next_id()}'
+            self._retrievals[token] = (rest, page_size)
+        self.objects_returned += len(page)
+        if self.latency_per_object:
+            time.sleep(self.latency_per_object * len(page))
+        return PC.RetrieveResult(token=token, objects=page)
+
+    def _spec_objects(self, object_specs):
+        objects = []
+        for object_spec in object_specs:
+            if not object_spec.skip:
+                objects.append(object_spec.obj)
+            for select in object_spec.selectSet or []:
+                if getattr(select, 'path', None) != 'view' or object_spec.obj._moId not in self._views:
+                    raise vmodl.fault.NotImplemented(msg='Only ContainerView traversal is simulated')
+                objects.extend(self._views[object_spec.obj._moId]['objects'])
+        return objects
+
+    def _m_PropertyCollector_CreatePropertyCollector(self, mo):
+        collector = vmodl.query.PropertyCollector(f'session[simulator]pc-{self._next_id()}', self)
+        self._collectors[collector._moId] = {'filters': [], 'version': 0}
+        return collector
+
+    def _m_PropertyCollector_DestroyPropertyCollector(self, mo):
+        self._collectors.pop(mo._moId, None)
+
+    def _m_PropertyCollector_CreateFilter(self, mo, spec, partialUpdates):
+        collector = self._collectors.setdefault(mo._moId, {'filters': [], 'version': 0})
+        property_filter = vmodl.query.PropertyCollector.Filter(f'session[simulator]filter-{self._next_id()}', self)
+        paths = [path for prop_spec in spec.propSet for path in prop_spec.pathSet or []]
+        collector['filters'].append({
+            'mo': property_filter, 'objects': self._spec_objects(spec.objectSet), 'paths': paths, 'reported': {},
+        })
+        return property_filter
+
+    def _wait_for_updates(self, mo, version, options):
+        max_wait = options.maxWaitSeconds if options and options.maxWaitSeconds is not None else DEFAULT_MAX_WAIT
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                self._advance_tasks()
+                collector = self._collectors.get(mo._moId)
+                if collector is None:
+                    raise vmodl.fault.ManagedObjectNotFound(msg='Property collector was destroyed', obj=mo)
+                update = self._collect_updates(collector)
+                next_due = min((t['due'] for t in self._tasks.values() if not t['done']), default=None)
+            if update is not None:
+                return update
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return None
+            pause = left if next_due is None else max(min(left, next_due - time.time()), 0.001)
+            time.sleep(min(pause, 0.05))
+
+    def _collect_updates(self, collector):
+        filter_updates = []
+        for property_filter in collector['filters']:
+            object_updates = []
+            for obj in property_filter['objects']:
+                reported = property_filter['reported'].setdefault(obj._moId, {})
+                kind = 'modify' if reported else 'enter'
+                changes = []
+                for path in property_filter['paths']:
+                    value = self._property(obj, path)
+                    if path not in reported or reported[path] != value:
+                        reported[path] = value
+                        changes.append(PC.Change(name=path, op='assign', val=value))
+                if changes:
+                    object_updates.append(PC.ObjectUpdate(kind=kind, obj=obj, changeSet=changes))
+            if object_updates:
+                filter_updates.append(PC.FilterUpdate(filter=property_filter['mo'], objectSet=object_updates))
+        if not filter_updates:
+            return None
+        collector['version'] += 1
+        return PC.UpdateSet(version=str(collector['version']), filterSet=filter_updates)
+
+    # --- Задачи ---
+
+    def _new_task(self, entity, name, apply, description_id=None, duration=None):
+        """apply() выполняется при завершении задачи и возвращает ее результат (исключение - ошибка задачи)"""
+        task = vim.Task(f'task-{self._next_id()}', self)
+        now = time.time()
+        self._objects[task._moId] = task
+        self._tasks[task._moId] = {
+            'mo': task, 'name': name, 'entity': entity, 'apply': apply,
+            'due': now + (self.task_duration if duration is None else duration),
+            'queued': datetime.now(timezone.utc), 'completed': None, 'done': False,
+            'state': TASK_RUNNING, 'result': None, 'error': None, 'description_id': description_id or name,
+        }
+        self._advance_tasks()
+        return task
+
+    def _advance_tasks(self):
+        now = time.time()
+        for task in self._tasks.values():
+            if task['done'] or task['due'] > now:
+                continue
+            try:
+                task['result'] = task['apply']()
+                task['state'] = TASK_SUCCESS
+            except vmodl.MethodFault as e:
+                task['error'] = e
+                task['state'] = TASK_ERROR
+            task['done'] = True
+            task['completed'] = datetime.now(timezone.utc)
+
+    def _task_info(self, task):
+        entity = task['entity']
+        entity_state = self._vms.get(entity._moId) if entity is not None else None
+        return vim.TaskInfo(
+            key=task['mo']._moId, task=task['mo'], descriptionId=task['description_id'],
+            entity=entity, entityName=entity_state['name'] if entity_state else None,
+            state=task['state'], result=task['result'], error=task['error'],
+            cancelled=False, cancelable=False, queueTime=task['queued'], completeTime=task['completed'],
+            eventChainId=0,
+        )
+
+    def _vm(self, mo):
+        state = self._vms.get(mo._moId)
+        if state is None:
+            raise vmodl.fault.ManagedObjectNotFound(msg=f'The object {mo._moId} has already been deleted', obj=mo)
+        return state
+
+    # --- VirtualMachine ---
+
+    def _power_task(self, mo, name, allowed_from, new_power):
+        state = self._vm(mo)
+
+        def apply():
+            if state['power'] not in allowed_from:
+                raise vim.fault.InvalidPowerState(msg=f'The attempted operation cannot be performed in the '
+                                                      f'current state ({state["power"]}).',
+                                                  existingState=state['power'])
+            state['power'] = new_power
+        return self._new_task(mo, name, apply)
+
+    def _m_VirtualMachine_PowerOnVM_Task(self, mo, host=None):
+        return self._power_task(mo, 'PowerOnVM_Task', (POWERED_OFF, SUSPENDED), POWERED_ON)
+
+    def _m_VirtualMachine_PowerOffVM_Task(self, mo):
+        return self._power_task(mo, 'PowerOffVM_Task', (POWERED_ON, SUSPENDED), POWERED_OFF)
+
+    def _m_VirtualMachine_SuspendVM_Task(self, mo):
+        return self._power_task(mo, 'SuspendVM_Task', (POWERED_ON,), SUSPENDED)
+
+    def _m_VirtualMachine_ResetVM_Task(self, mo):
+        return self._power_task(mo, 'ResetVM_Task', (POWERED_ON,), POWERED_ON)
+
+    def _m_VirtualMachine_RebootGuest(self, mo):
+        state = self._vm(mo)
+        if state['power'] != POWERED_ON:
+            raise vim.fault.InvalidPowerState(msg='VM is not powered on', existingState=state['power'])
+
+    def _m_VirtualMachine_AcquireMksTicket(self, mo):
+        state = self._vm(mo)
+        return vim.VirtualMachineMksTicket(ticket=f'mks-{self._next_id()}', cfgFile='', port=902,
+                                           host=self._entities[state['host']._moId]['name'])
+
+    def _place_clone(self, source, folder, name, location, power, template=False):
+        if any(s['name'] == name and s['parent'] == (folder or source['parent']) for s in self._vms.values()):
+            raise vim.fault.DuplicateName(msg=f"The name '{name}' already exists.", name=name)
+        host = location.host if location and location.host else None
+        if host is None:
+            pool = location.pool if location and location.pool else None
+            hosts = self._pool_hosts.get(pool._moId) if pool is not None else None
+            host = (hosts or [source['host']])[self._random.randrange(len(hosts or [source['host']]))]
+        datastore = location.datastore if location and location.datastore else source['datastore']
+        clone = self._add_vm(name, host, datastore, template=template, power=power,
+                             cores=source['cores'], memory=source['memory'], disk=source['disk'])
+        self._vms[clone._moId]['parent'] = folder or source['parent']
+        return clone
+
+    def _m_VirtualMachine_CloneVM_Task(self, mo, folder, name, spec):
+        source = self._vm(mo)
+        location = spec.location if spec else None
+        # Связанный клон: дочерний диск от снапшота, как в vCenter - только при заданном spec.snapshot
+        linked = bool(location and location.diskMoveType == 'createNewChildDiskBacking')
+        if linked and not spec.snapshot:
+            raise vmodl.fault.InvalidArgument(msg='A snapshot is required for a linked clone',
+                                              invalidProperty='snapshot')
+
+        def apply():
+            clone = self._place_clone(source, folder, name, location,
+                                      power=POWERED_ON if spec and spec.powerOn else POWERED_OFF,
+                                      template=bool(spec and spec.template))
+            if spec and spec.config:
+                self._apply_config(self._vms[clone._moId], spec.config, linked=linked)
+            return clone
+        return self._new_task(mo, 'CloneVM_Task', apply, duration=None if linked else self.full_clone_duration)
+
+    def _m_VirtualMachine_InstantClone_Task(self, mo, spec):
+        source = self._vm(mo)
+        if source['power'] != POWERED_ON:
+            raise vim.fault.InvalidPowerState(msg='Instant clone source must be powered on',
+                                              existingState=source['power'])
+
+        def apply():
+            return self._place_clone(source, None, spec.name, spec.location, power=POWERED_ON)
+        return self._new_task(mo, 'InstantClone_Task', apply)
+
+    def _apply_config(self, state, spec, linked=False):
+        if spec.numCPUs:
+            state['cores'] = spec.numCPUs
+        if spec.memoryMB:
+            state['memory'] = spec.memoryMB
+        for change in spec.deviceChange or []:
+            if isinstance(change.device, vim.vm.device.VirtualDisk) and change.device.capacityInKB:
+                new_disk = int(change.device.capacityInKB / 1024 / 1024)
+                if new_disk < state['disk']:
+                    raise vim.fault.InvalidDeviceOperation(msg='Disk shrinking is not supported')
+                if linked and new_disk > state['disk']:
+                    raise vim.fault.InvalidDeviceOperation(msg='Disks with child backings cannot be extended')
+                state['disk'] = new_disk
+
+    def _m_VirtualMachine_ReconfigVM_Task(self, mo, spec):
+        state = self._vm(mo)
+        return self._new_task(mo, 'ReconfigVM_Task', lambda: self._apply_config(state, spec))
+
+    def _m_VirtualMachine_CreateSnapshot_Task(self, mo, name, description, memory, quiesce):
+        state = self._vm(mo)
+
+        def apply():
+            snapshot_id = self._next_id()
+            snapshot = {
+                'mo': vim.vm.Snapshot(f'snapshot-{snapshot_id}', self), 'id': snapshot_id, 'name': name,
+                'description': description or '', 'created': datetime.now(timezone.utc), 'vm': mo,
+            }
+            state['snapshots'].append(snapshot)
+            self._snapshots[snapshot['mo']._moId] = snapshot
+            return snapshot['mo']
+        return self._new_task(mo, 'CreateSnapshot_Task', apply)
+
+    def _m_VirtualMachine_Destroy_Task(self, mo):
+        state = self._vm(mo)
+
+        def apply():
+            if state['power'] != POWERED_OFF:
+                raise vim.fault.InvalidPowerState(msg='VM must be powered off', existingState=state['power'])
+            self._vms.pop(mo._moId, None)
+            self._vm_by_uuid.pop(state['uuid'], None)
+            self._objects.pop(mo._moId, None)
+        return self._new_task(mo, 'Destroy_Task', apply)
+
+    # --- VirtualMachineSnapshot ---
+
+    def _snapshot(self, mo):
+        snapshot = self._snapshots.get(mo._moId)
+        if snapshot is None:
+            raise vmodl.fault.ManagedObjectNotFound(msg=f'Snapshot {mo._moId} does not exist', obj=mo)
+        return snapshot
+
+    def _m_VirtualMachineSnapshot_RevertToSnapshot_Task(self, mo, host=None, suppressPowerOn=None):
+        snapshot = self._snapshot(mo)
+        return self._new_task(snapshot['vm'], 'RevertToSnapshot_Task', lambda: None)
+
+    def _m_VirtualMachineSnapshot_RemoveSnapshot_Task(self, mo, removeChildren, consolidate=None):
+        snapshot = self._snapshot(mo)
+
+        def apply():
+            state = self._vm(snapshot['vm'])
+            state['snapshots'] = [s for s in state['snapshots'] if s['mo']._moId != mo._moId]
+            self._snapshots.pop(mo._moId, None)
+        return self._new_task(snapshot['vm'], 'RemoveSnapshot_Task', apply)
@@ -3,6 +3,7 @@ from odoo import http, _
 from odoo.http import request
 from odoo.addons.portal.controllers.portal import CustomerPortal, pager as portal_pager
 from odoo.exceptions import AccessError, MissingError
+from ..services.deadline import portal_deadline
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -162,8 +163,9 @@ class PortalVM(CustomerPortal):
 
         try:
             # Получаем URL консоли
-            service = vm._get_hypervisor_service()
-            console_url = service.get_console_url(vm.hypervisor_node_name, vm.hypervisor_vm_ref)
+            with portal_deadline(request.env):
+                service = vm._get_hypervisor_service()
+                console_url = service.get_console_url(vm.hypervisor_node_name, vm.hypervisor_vm_ref)
 
             return request.render("vm_rental.portal_vm_console", {
                 'vm': vm,
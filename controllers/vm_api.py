@@ -2,6 +2,7 @@
 from odoo import http, fields
 from odoo.http import request
 from odoo.exceptions import AccessError, MissingError
+from ..services.deadline import portal_deadline
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -88,12 +89,14 @@ class VMAPIController(http.Controller):
             return {"error": f"Cannot perform this action on VM in '{vm.state}' state.", "success": False}
 
         try:
-            # Вызываем универсальный сервис
-            service = vm._get_hypervisor_service()
+            # Вызовы гипервизора ограничены сроком HTTP-запроса
+            with portal_deadline(request.env):
+                # Вызываем универсальный сервис
+                service = vm._get_hypervisor_service()
 
-            # Вызываем нужный метод сервиса
-            hypervisor_method = getattr(service, action)
-            success = hypervisor_method(vm.hypervisor_node_name, vm.hypervisor_vm_ref)
+                # Вызываем нужный метод сервиса
+                hypervisor_method = getattr(service, action)
+                success = hypervisor_method(vm.hypervisor_node_name, vm.hypervisor_vm_ref)
 
             if success:
                 if state_after:
@@ -148,6 +151,64 @@ class VMAPIController(http.Controller):
     def reboot_vm(self, vm_id):
         return self._vm_action(vm_id, 'reboot_vm', None, 'Active')
 
+    # Групповые действия портала: действие -> текст нового состояния
+    PORTAL_BULK_ACTIONS = {'start': 'Active', 'stop': 'Stopped', 'suspend': 'Suspended'}
+    PORTAL_BULK_LIMIT = 50
+
+    @http.route('/vm/bulk/<string:action>', type='json', auth='user', methods=['POST'])
+    def bulk_vm_action(self, action, vm_ids=None):
+        """
+        Групповое start/stop/suspend: один вызов гипервизора на сервер для всех VM.
+        Каждая VM проверяется как в _vm_action, результат возвращается по каждой VM.
+        """
+        if action not in self.PORTAL_BULK_ACTIONS:
+            return {"success": False, "error": f"Unsupported bulk action '{action}'."}
+        if not isinstance(vm_ids, list) or not vm_ids:
+            return {"success": False, "error": "No VMs selected."}
+        if len(vm_ids) > self.PORTAL_BULK_LIMIT:
+            return {"success": False, "error": f"At most {self.PORTAL_BULK_LIMIT} VMs per request."}
+
+        results = {}
+        allowed = request.env['vm_rental.machine']
+        is_portal = request.env.user.has_group('base.group_portal')
+        for vm_id in vm_ids:
+            vm = self._check_portal_vm_access(vm_id, required_operations=['read', 'write', 'state_change'])
+            if not vm or not vm.exists():
+                results[str(vm_id)] = {"success": False, "error": "Access denied or VM not found."}
+            elif is_portal and vm.state in ['pending', 'failed', 'terminated', 'archived']:
+                results[str(vm_id)] = {"success": False,
+                                       "error": f"Cannot perform this action on VM in '{vm.state}' state."}
+            else:
+                allowed |= vm
+
+        try:
+            # Вызовы гипервизора ограничены сроком HTTP-запроса
+            with portal_deadline(request.env):
+                errors = allowed.sudo()._bulk_power_action(action)
+        except Exception as e:
+            _logger.error(f"Bulk VM action {action} failed for VMs {allowed.ids}: {e}")
+            errors = {vm.id: str(e) for vm in allowed}
+
+        for vm in allowed:
+            error = errors.get(vm.id)
+            request.env['vm_rental.audit_log'].sudo().log_action(
+                vm_id=vm.id,
+                action=action,
+                success=error is None,
+                error_message=error,
+                metadata={'user': request.env.user.name, 'portal_action': True, 'bulk': True}
+            )
+            if error is None:
+                results[str(vm.id)] = {
+                    "success": True,
+                    "new_state": vm.state,
+                    "state_text": self.PORTAL_BULK_ACTIONS[action],
+                }
+            else:
+                results[str(vm.id)] = {"success": False, "error": "Operation failed. Please try again later."}
+
+        return {"success": all(r['success'] for r in results.values()), "results": results}
+
     @http.route('/vm/<int:vm_id>/snapshot/create', type='json', auth='user', methods=['POST'])
     def create_vm_snapshot(self, vm_id, name, description=''):
         """ОБНОВЛЕННЫЙ метод создания снапшотов с улучшенной проверкой прав"""
@@ -161,11 +222,16 @@ class VMAPIController(http.Controller):
         if vm.state not in ['active', 'stopped']:
             return {'success': False, 'error': f'Cannot create snapshot for VM in {vm.state} state'}
 
+        # Возможность заявлена драйвером - не обращаемся к гипервизору, если снапшоты не поддерживаются
+        if not vm._can_snapshot():
+            return {'success': False, 'error': 'Snapshots are not supported for this VM type'}
+
         snap_name = f"snap_{fields.Datetime.now().strftime('%Y%m%d%H%M%S')}"
 
         try:
-            service = vm._get_hypervisor_service()
-            result = service.create_snapshot(vm.hypervisor_node_name, vm.hypervisor_vm_ref, snap_name, description)
+            with portal_deadline(request.env):
+                service = vm._get_hypervisor_service()
+                result = service.create_snapshot(vm.hypervisor_node_name, vm.hypervisor_vm_ref, snap_name, description)
 
             if result:
                 # Используем sudo() для создания записи снапшота
@@ -223,8 +289,9 @@ class VMAPIController(http.Controller):
             return {'success': False, 'error': 'Snapshot not found or access denied'}
 
         try:
-            service = vm._get_hypervisor_service()
-            result = service.rollback_snapshot(vm.hypervisor_node_name, vm.hypervisor_vm_ref, proxmox_name)
+            with portal_deadline(request.env):
+                service = vm._get_hypervisor_service()
+                result = service.rollback_snapshot(vm.hypervisor_node_name, vm.hypervisor_vm_ref, proxmox_name)
 
             if result:
                 # Логируем откат снапшота
@@ -262,8 +329,9 @@ class VMAPIController(http.Controller):
 
         try:
             # Вызываем универсальный сервис и поля
-            service = vm._get_hypervisor_service()
-            result = service.delete_snapshot(vm.hypervisor_node_name, vm.hypervisor_vm_ref, proxmox_name)
+            with portal_deadline(request.env):
+                service = vm._get_hypervisor_service()
+                result = service.delete_snapshot(vm.hypervisor_node_name, vm.hypervisor_vm_ref, proxmox_name)
 
             if result:
                 # Логируем удаление снапшота
@@ -2,7 +2,15 @@
 from . import vm_traits
 from . import vm_wizard
 from . import hypervisor_server
+from . import hypervisor_server_breaker
 from . import hypervisor_resources
+from . import hypervisor_task
+from . import vm_provision_job
+from . import hypervisor_vmid
+from . import hypervisor_placement
+from . import hypervisor_capacity
+from . import hypervisor_template_replica
+from . import vm_warm_pool
 from . import product_attribute
 from . import vm_template
 from . import product_template
@@ -0,0 +1,128 @@
+# vm_rental/models/hypervisor_capacity.py
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from odoo import models, fields, api
+from ..services.drivers import CAP_CAPACITY
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+
+class HypervisorCapacitySnapshot(models.Model):
+    """
+    Снимок емкости ноды или хранилища (история для графиков трендов).
+
+    Cron собирает емкость сервера одним запросом get_capacity(), пишет по строке
+    на каждую известную Odoo ноду и хранилище и обновляет последние значения
+    на самих записях hypervisor.node / hypervisor.storage. История прореживается:
+    старше RAW_RETENTION_DAYS остается один снимок в час, старше HISTORY_DAYS удаляется.
+    """
+    _name = 'hypervisor.capacity.snapshot'
+    _description = 'Hypervisor Capacity Snapshot'
+    _order = 'taken_at desc, id desc'
+    _rec_name = 'taken_at'
+
+    RAW_RETENTION_DAYS = 2
+    HISTORY_DAYS = 90
+
+    server_id = fields.Many2one('hypervisor.server', string="Server", required=True, ondelete='cascade',
+                                index=True, readonly=True)
+    node_id = fields.Many2one('hypervisor.node', string="Node", ondelete='cascade', index=True, readonly=True)
+    storage_id = fields.Many2one('hypervisor.storage', string="Storage", ondelete='cascade', index=True,
+                                 readonly=True)
+    taken_at = fields.Datetime(string="Taken At", required=True, index=True, readonly=True)
+
+    cpu_total = fields.Integer(string="CPU Cores", group_operator='sum', readonly=True)
+    cpu_allocated = fields.Integer(string="Allocated vCPUs", group_operator='sum', readonly=True)
+    cpu_load = fields.Float(string="CPU Load (%)", digits=(5, 1), group_operator='avg', readonly=True)
+    memory_total = fields.Integer(string="Memory (MB)", group_operator='sum', readonly=True)
+    memory_used = fields.Integer(string="Used Memory (MB)", group_operator='sum', readonly=True)
+    memory_allocated = fields.Integer(string="Allocated Memory (MB)", group_operator='sum', readonly=True)
+    guest_count = fields.Integer(string="Guests", group_operator='sum', readonly=True)
+    disk_total = fields.Float(string="Disk (GB)", digits=(12, 1), group_operator='sum', readonly=True)
+    disk_used = fields.Float(string="Used Disk (GB)", digits=(12, 1), group_operator='sum', readonly=True)
+
+    @api.model
+    def _cron_collect(self):
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        for server in self.env['hypervisor.server'].search([]):
+            if not server.has_capability(CAP_CAPACITY):
+                continue
+            try:
+                with self.env.cr.savepoint():
+                    self._collect(server)
+            except Exception as e:
+                _logger.warning(f"Could not collect capacity of server {server.name}: {e}")
+            if auto_commit:
+                self.env.cr.commit()
+        self._compact_history()
+
+    @api.model
+    def _collect(self, server, capacity=None):
+        """Записывает снимок емкости сервера и последние значения на ноды и хранилища"""
+        if capacity is None:
+            capacity = server._get_service_manager().get_capacity()
+        now = fields.Datetime.now()
+        nodes = {node.name: node for node in self.env['hypervisor.node'].search([('server_id', '=', server.id)])}
+        storages = {storage.name: storage
+                    for storage in self.env['hypervisor.storage'].search([('server_id', '=', server.id)])}
+
+        vals_list = []
+        for live in capacity.get('nodes', []):
+            node = nodes.get(live['name'])
+            if not node:
+                continue
+            values = {
+                'cpu_total': live.get('maxcpu', 0),
+                'cpu_allocated': live.get('allocated_cpu', 0),
+                'cpu_load': round(100.0 * (live.get('cpu') or 0), 1),
+                'memory_total': int(live.get('maxmem', 0) / 2 ** 20),
+                'memory_used': int(live.get('mem', 0) / 2 ** 20),
+                'memory_allocated': int(live.get('allocated_mem', 0) / 2 ** 20),
+                'guest_count': live.get('guests', 0),
+            }
+            node.write(dict(values, node_status=live.get('status') or False, capacity_updated_at=now))
+            vals_list.append(dict(values, server_id=server.id, node_id=node.id, taken_at=now))
+
+        seen = set()
+        for live in capacity.get('storages', []):
+            storage = storages.get(live['name'])
+            # Общее хранилище приходит по разу на каждую ноду
+            if not storage or storage.id in seen:
+                continue
+            seen.add(storage.id)
+            values = {
+                'disk_total': round(live.get('maxdisk', 0) / 2 ** 30, 1),
+                'disk_used': round(live.get('disk', 0) / 2 ** 30, 1),
+            }
+            storage.write(dict(values, shared=bool(live.get('shared')), capacity_updated_at=now))
+            vals_list.append(dict(values, server_id=server.id, storage_id=storage.id, taken_at=now))
+
+        snapshots = self.create(vals_list)
+        _logger.info(f"Capacity of server {server.name}: {len(snapshots)} snapshots recorded")
+        return snapshots
+
+    @api.model
+    def _compact_history(self):
+        """Старые снимки: один в час на ноду/хранилище, после HISTORY_DAYS - удаление"""
+        now = fields.Datetime.now()
+        self.env.cr.execute(f"DELETE FROM {self._table} WHERE taken_at < %s",
+                            (now - timedelta(days=self.HISTORY_DAYS),))
+        expired = self.env.cr.rowcount
+        self.env.cr.execute(f"""
+            DELETE FROM {self._table}
+             WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, row_number() OVER (
+                               PARTITION BY server_id, node_id, storage_id, date_trunc('hour', taken_at)
+                               ORDER BY taken_at) AS position
+                      FROM {self._table}
+                     WHERE taken_at < %s
+                ) ranked
+                WHERE position > 1)
+        """, (now - timedelta(days=self.RAW_RETENTION_DAYS),))
+        thinned = self.env.cr.rowcount
+        if expired or thinned:
+            self.invalidate_model()
+            _logger.info(f"Capacity history compacted: {expired} expired, {thinned} thinned to hourly")
@@ -0,0 +1,209 @@
+# vm_rental/models/hypervisor_placement.py
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class HypervisorPlacement(models.Model):
+    """
+    Решение о размещении VM: нода и хранилище, выбранные при провижининге.
+
+    Кандидаты (пары нода/хранилище сервера) оцениваются по текущей емкости из одного
+    запроса get_capacity(): свободные vCPU и память с учетом коэффициентов переподписки
+    сервера, свободное место хранилища, тип хранилища, доступность шаблона с ноды
+    и число идущих провижинингов.
+    Политика сервера 'pack' заполняет самые загруженные ноды (bin packing),
+    'spread' - наименее загруженные. Входные данные и оценки всех кандидатов
+    сохраняются в записи решения для аудита.
+    """
+    _name = 'hypervisor.placement'
+    _description = 'VM Placement Decision'
+    _order = 'id desc'
+    _rec_name = 'vm_id'
+
+    # Штраф за каждый идущий провижининг на ноде или хранилище кандидата
+    LOAD_PENALTY = 0.05
+    # Преимущество ноды и хранилища, заданных в VM (при прочих равных)
+    PREFERRED_BONUS = 0.01
+    # Хранилища, на которые можно клонировать гостя данного типа шаблона
+    GUEST_CONTENT = {'qemu': 'images', 'lxc': 'rootdir'}
+
+    vm_id = fields.Many2one('vm_rental.machine', string="VM", required=True, ondelete='cascade', index=True,
+                            readonly=True)
+    server_id = fields.Many2one('hypervisor.server', string="Server", required=True, ondelete='cascade',
+                                index=True, readonly=True)
+    policy = fields.Selection([
+        ('pack', 'Bin Packing'),
+        ('spread', 'Spread'),
+    ], string="Policy", required=True, readonly=True)
+    state = fields.Selection([
+        ('placed', 'Placed'),
+        ('no_capacity', 'No Capacity'),
+    ], string="Result", required=True, readonly=True)
+    node_id = fields.Many2one('hypervisor.node', string="Node", ondelete='set null', readonly=True)
+    storage_id = fields.Many2one('hypervisor.storage', string="Storage", ondelete='set null', readonly=True)
+    score = fields.Float(string="Score", digits=(6, 4), readonly=True)
+    cores = fields.Integer(string="CPU Cores", readonly=True)
+    memory = fields.Integer(string="Memory (MB)", readonly=True)
+    disk = fields.Integer(string="Disk (GB)", readonly=True)
+    candidate_count = fields.Integer(string="Candidates", readonly=True)
+    rejected_count = fields.Integer(string="Rejected", readonly=True)
+    inputs = fields.Text(string="Inputs", readonly=True,
+                         help="Capacity, load and score of every candidate at decision time (JSON).")
+
+    @api.model
+    def place(self, vm, service):
+        """
+        Выбирает ноду и хранилище для VM по политике ее сервера и записывает их в VM.
+        Возвращает решение; UserError, если ни один кандидат не вмещает VM.
+        """
+        server = vm.hypervisor_server_id
+        capacity = service.get_capacity()
+        candidates = self._candidates(vm, capacity)
+
+        best = max((c for c in candidates if c['fits']), key=lambda c: c['score'], default=None)
+        decision = self.create({
+            'vm_id': vm.id,
+            'server_id': server.id,
+            'policy': server.placement_policy,
+            'state': 'placed' if best else 'no_capacity',
+            'node_id': best['node_id'] if best else False,
+            'storage_id': best['storage_id'] if best else False,
+            'score': best['score'] if best else 0.0,
+            'cores': vm.cores,
+            'memory': vm.memory,
+            'disk': vm.disk,
+            'candidate_count': len(candidates),
+            'rejected_count': len([c for c in candidates if not c['fits']]),
+            'inputs': json.dumps({
+                'overcommit': {
+                    'cpu': server.cpu_overcommit_ratio,
+                    'memory': server.memory_overcommit_ratio,
+                    'disk': server.disk_overcommit_ratio,
+                },
+                'storage_type': vm.hypervisor_storage_id.storage_type or None,
+                'candidates': [{k: v for k, v in c.items() if k not in ('node_id', 'storage_id')}
+                               for c in candidates],
+            }, indent=1),
+        })
+
+        if not best:
+            _logger.warning(f"Placement of VM {vm.name}: no capacity on server {server.name}")
+            raise UserError(_("No node of server %s has capacity for %s cores, %s MB RAM and %s GB disk")
+                            % (server.name, vm.cores, vm.memory, vm.disk))
+
+        if (best['node_id'], best['storage_id']) != (vm.hypervisor_node_id.id, vm.hypervisor_storage_id.id):
+            vm.write({'hypervisor_node_id': best['node_id'], 'hypervisor_storage_id': best['storage_id']})
+        _logger.info(f"Placement of VM {vm.name}: {best['node']}/{best['storage']} "
+                     f"({server.placement_policy}, score {best['score']}, {len(candidates)} candidates)")
+        return decision
+
+    @api.model
+    def _candidates(self, vm, capacity):
+        """Пары нода/хранилище сервера с их емкостью, нагрузкой и оценкой"""
+        server = vm.hypervisor_server_id
+        nodes = {node.name: node for node in self.env['hypervisor.node'].search([('server_id', '=', server.id)])}
+        storages = {storage.name: storage
+                    for storage in self.env['hypervisor.storage'].search([('server_id', '=', server.id)])}
+        live_nodes = {node['name']: node for node in capacity.get('nodes', [])}
+        node_load, storage_load = self._provisioning_load(vm)
+
+        template = vm.hypervisor_template_id
+        content = self.GUEST_CONTENT.get(template.template_type or 'qemu')
+        storage_type = vm.hypervisor_storage_id.storage_type
+        cpu_needed = vm.cores
+        mem_needed = vm.memory * 2 ** 20
+        disk_needed = vm.disk * 2 ** 30
+
+        candidates = []
+        for live_storage in capacity.get('storages', []):
+            node = nodes.get(live_storage['node'])
+            storage = storages.get(live_storage['name'])
+            live_node = live_nodes.get(live_storage['node'])
+            if not (node and storage and live_node):
+                continue
+            if storage.node_ids and node not in storage.node_ids:
+                continue
+            if content and content not in (live_storage.get('content') or '').split(','):
+                continue
+
+            cpu_total = live_node['maxcpu'] * server.cpu_overcommit_ratio
+            mem_total = live_node['maxmem'] * server.memory_overcommit_ratio
+            disk_total = live_storage['maxdisk'] * server.disk_overcommit_ratio
+            usage = {
+                'cpu': self._usage(live_node.get('allocated_cpu', 0) + cpu_needed, cpu_total),
+                'memory': self._usage(live_node.get('allocated_mem', 0) + mem_needed, mem_total),
+                'disk': self._usage(live_storage['disk'] + disk_needed, disk_total),
+            }
+            load = node_load.get(node.id, 0) + storage_load.get(storage.id, 0)
+            candidate = {
+                'node': node.name,
+                'storage': storage.name,
+                'node_id': node.id,
+                'storage_id': storage.id,
+                'free_cpu': round(cpu_total - live_node.get('allocated_cpu', 0), 1),
+                'free_memory_mb': int((mem_total - live_node.get('allocated_mem', 0)) / 2 ** 20),
+                'free_disk_gb': int((disk_total - live_storage['disk']) / 2 ** 30),
+                'usage_after': {key: round(value, 4) for key, value in usage.items()},
+                'provisioning': load,
+                'fits': False,
+                'score': 0.0,
+            }
+            candidates.append(candidate)
+
+            if live_node.get('status') != 'online':
+                candidate['reason'] = 'node offline'
+            elif template and not template._reachable_from(node, storage):
+                candidate['reason'] = f'template not reachable from {template.node_id.name}'
+            elif storage_type and storage.storage_type != storage_type:
+                candidate['reason'] = f'storage type {storage.storage_type}'
+            elif max(usage.values()) > 1.0:
+                candidate['reason'] = 'no capacity: ' + ', '.join(k for k, v in usage.items() if v > 1.0)
+            else:
+                candidate['fits'] = True
+                candidate['score'] = round(self._score(server.placement_policy, usage, load,
+                                                       preferred=(node == vm.hypervisor_node_id
+                                                                  and storage == vm.hypervisor_storage_id)), 4)
+        return candidates
+
+    @api.model
+    def _score(self, policy, usage, load, preferred=False):
+        """
+        Оценка кандидата по загрузке доминирующего ресурса после размещения:
+        pack предпочитает самые заполненные ноды, spread - самые свободные.
+        """
+        utilisation = max(usage.values())
+        score = utilisation if policy == 'pack' else 1.0 - utilisation
+        score -= self.LOAD_PENALTY * load
+        if preferred:
+            score += self.PREFERRED_BONUS
+        return score
+
+    @staticmethod
+    def _usage(used, total):
+        return used / total if total > 0 else float('inf')
+
+    @api.model
+    def _provisioning_load(self, vm):
+        """
+        Идущие провижининги других VM сервера по нодам и хранилищам. Учитываются только
+        размещенные задания (provisioning): у еще не размещенных нода и хранилище VM -
+        значения продукта, а не итоговые.
+        """
+        jobs = self.env['vm_rental.provision_job'].sudo().search([
+            ('server_id', '=', vm.hypervisor_server_id.id),
+            ('state', '=', 'provisioning'),
+            ('vm_id', '!=', vm.id),
+        ])
+        node_load, storage_load = {}, {}
+        for job in jobs:
+            node = job.vm_id.hypervisor_node_id
+            if node:
+                node_load[node.id] = node_load.get(node.id, 0) + 1
+            if job.storage_id:
+                storage_load[job.storage_id.id] = storage_load.get(job.storage_id.id, 0) + 1
+        return node_load, storage_load
@@ -1,6 +1,8 @@
 # vm_rental/models/hypervisor_resources.py
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api, _
+from ..services.base_service import HypervisorOperationError
+from ..services.drivers import CAP_LINKED_CLONES, CAP_VMIDS, CAP_ASYNC_PROVISIONING
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -23,10 +25,28 @@ class HypervisorNode(models.Model):
         string="Storages"
     )
 
+    # Последний снимок емкости (hypervisor.capacity.snapshot)
+    node_status = fields.Char(string="Status", readonly=True)
+    cpu_total = fields.Integer(string="CPU Cores", readonly=True)
+    cpu_allocated = fields.Integer(string="Allocated vCPUs", readonly=True)
+    cpu_load = fields.Float(string="CPU Load (%)", digits=(5, 1), readonly=True)
+    memory_total = fields.Integer(string="Memory (MB)", readonly=True)
+    memory_used = fields.Integer(string="Used Memory (MB)", readonly=True)
+    memory_allocated = fields.Integer(string="Allocated Memory (MB)", readonly=True)
+    memory_usage = fields.Float(string="Memory Usage (%)", digits=(5, 1), compute='_compute_memory_usage',
+                                store=True)
+    guest_count = fields.Integer(string="Guests", readonly=True)
+    capacity_updated_at = fields.Datetime(string="Capacity Updated", readonly=True)
+
     _sql_constraints = [
         ('server_name_uniq', 'unique(server_id, name)', 'Node name must be unique per server!')
     ]
 
+    @api.depends('memory_total', 'memory_used')
+    def _compute_memory_usage(self):
+        for node in self:
+            node.memory_usage = 100.0 * node.memory_used / node.memory_total if node.memory_total else 0.0
+
 
 class HypervisorStorage(models.Model):
     _name = 'hypervisor.storage'
@@ -56,10 +76,31 @@ class HypervisorStorage(models.Model):
 
     pricing_ids = fields.One2many('hypervisor.storage.pricing', 'storage_id', string="Pricing")
 
+    shared = fields.Boolean(string="Shared", readonly=True,
+                            help="Storage is reachable from every node of the cluster (updated with capacity).")
+
+    # Клонирование нагружает хранилище - ограничиваем параллельный провижининг на него
+    max_parallel_provisioning = fields.Integer(string="Max Parallel Provisioning", default=2,
+                                               help="Maximum number of VMs provisioned to this storage at the same "
+                                                    "time by the provisioning queue (0 - unlimited).")
+
+    # Последний снимок емкости (hypervisor.capacity.snapshot)
+    disk_total = fields.Float(string="Disk (GB)", digits=(12, 1), readonly=True)
+    disk_used = fields.Float(string="Used Disk (GB)", digits=(12, 1), readonly=True)
+    disk_free = fields.Float(string="Free Disk (GB)", digits=(12, 1), compute='_compute_disk_usage', store=True)
+    disk_usage = fields.Float(string="Disk Usage (%)", digits=(5, 1), compute='_compute_disk_usage', store=True)
+    capacity_updated_at = fields.Datetime(string="Capacity Updated", readonly=True)
+
     _sql_constraints = [
         ('server_name_uniq', 'unique(server_id, name)', 'Storage name must be unique per server!')
     ]
 
+    @api.depends('disk_total', 'disk_used')
+    def _compute_disk_usage(self):
+        for storage in self:
+            storage.disk_free = max(storage.disk_total - storage.disk_used, 0.0)
+            storage.disk_usage = 100.0 * storage.disk_used / storage.disk_total if storage.disk_total else 0.0
+
 
 class HypervisorTemplate(models.Model):
     _name = 'hypervisor.template'
@@ -77,6 +118,29 @@ class HypervisorTemplate(models.Model):
         ('lxc', 'LXC (Container)')
     ], string="Template Type", required=True, default='qemu')
 
+    clone_mode = fields.Selection([
+        ('full', 'Full Clone'),
+        ('linked', 'Linked Clone'),
+    ], string="Clone Mode", required=True, default='full',
+        help="Linked clones share the template disk and are ready in seconds. They are used only when the "
+             "target storage holds the template disks and supports linked clones, otherwise a full clone is made.")
+
+    # Где лежит сам шаблон и его реплики на других хранилищах (hypervisor.template.replica)
+    node_id = fields.Many2one('hypervisor.node', string="Node", ondelete='set null', readonly=True)
+    storage_id = fields.Many2one('hypervisor.storage', string="Storage", ondelete='set null', readonly=True)
+    config_digest = fields.Char(string="Config Digest", readonly=True)
+    replica_storage_ids = fields.Many2many(
+        comodel_name='hypervisor.storage',
+        relation='hypervisor_template_replica_storage_rel',
+        column1='template_id',
+        column2='storage_id',
+        string="Replicate To",
+        domain="[('server_id', '=', server_id)]",
+        help="Storages that keep their own copy of this template, so VMs placed there are cloned locally "
+             "(and linked, when the template allows it) instead of copying the disk from the template storage."
+    )
+    replica_ids = fields.One2many('hypervisor.template.replica', 'template_id', string="Replicas")
+
     _sql_constraints = [
         ('server_vmid_uniq', 'unique(server_id, vmid)', 'Template ID/VolID must be unique per server!')
     ]
@@ -105,6 +169,55 @@ class HypervisorTemplate(models.Model):
             # Возвращаем пустой recordset если все шаблоны уже существуют
             return self.browse([])
 
+    def _wants_linked_clone(self, requested='template'):
+        """Запрошен ли связанный клон: requested из VM/продукта, 'template' - по настройке шаблона"""
+        self.ensure_one()
+        return (self.clone_mode if requested in (None, 'template') else requested) == 'linked' \
+            and self.server_id.has_capability(CAP_LINKED_CLONES)
+
+    def _supports_replicas(self):
+        self.ensure_one()
+        return self.template_type == 'qemu' and self.server_id.has_capability(CAP_VMIDS) \
+            and self.server_id.has_capability(CAP_ASYNC_PROVISIONING)
+
+    def _clone_source(self, node, storage):
+        """
+        Откуда клонировать VM на node/storage: (нода, VMID) готовой реплики на этом хранилище,
+        если она доступна с целевой ноды, иначе сам шаблон.
+        """
+        self.ensure_one()
+        for replica in self.replica_ids:
+            if replica.state == 'ready' and replica.storage_id.name == storage \
+                    and (replica.storage_id.shared or replica.node == node):
+                return replica.node, replica.vmid
+        return self.node_id.name or node, self.vmid
+
+    def _reachable_from(self, node, storage):
+        """
+        Можно ли клонировать шаблон в VM на node/storage (записи): клон на другую ноду возможен
+        только с общего хранилища, поэтому подходит нода шаблона, шаблон на общем хранилище
+        или готовая реплика на storage, доступная с этой ноды. Нода шаблона неизвестна - не ограничиваем.
+        """
+        self.ensure_one()
+        if self.template_type != 'qemu' or not self.node_id or self.node_id == node or self.storage_id.shared:
+            return True
+        return any(replica.state == 'ready' and replica.storage_id == storage
+                   and (storage.shared or replica.node == node.name) for replica in self.replica_ids)
+
+    def _resolve_clone_mode(self, service, requested, node, storage, cores=None, memory=None, disk=None):
+        """Режим клонирования шаблона: 'linked', если связанный клон запрошен и возможен, иначе 'full'"""
+        self.ensure_one()
+        if not self._wants_linked_clone(requested):
+            return 'full'
+        source_node, source_vmid = self._clone_source(node, storage)
+        try:
+            possible = service.linked_clone_possible(source_node, source_vmid, storage,
+                                                     cores=cores, memory=memory, disk=disk)
+        except HypervisorOperationError as e:
+            _logger.warning(f"Could not check linked clone support for template {self.name}: {e}")
+            possible = False
+        return 'linked' if possible else 'full'
+
     def name_get(self):
         result = []
         for rec in self:
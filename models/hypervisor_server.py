@@ -1,9 +1,13 @@
 # vm_rental/models/hypervisor_server.py
 # -*- coding: utf-8 -*-
-from odoo.tools import ormcache
 from datetime import datetime, timedelta
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError, ValidationError
+from ..services.connection_pool import connection_pool
+from ..services.retry_policy import call_stats
+from ..services.circuit_breaker import circuit_breaker
+from ..services.base_service import HypervisorUnavailableError
+from ..services.drivers import driver_registry, CAP_VMIDS, CAP_CAPACITY
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -14,7 +18,7 @@ class HypervisorServer(models.Model):
 
     # ... все поля модели до метода test_and_fetch_resources без изменений ...
     name = fields.Char(string="Server Name", required=True)
-    hypervisor_type = fields.Selection([('proxmox', 'Proxmox VE'), ('vmware', 'VMware vCenter')], string="Hypervisor Type", required=True, default='proxmox')
+    hypervisor_type = fields.Selection(selection='_selection_hypervisor_type', string="Hypervisor Type", required=True, default='proxmox')
     host = fields.Char(string="Hostname or IP", required=True)
     verify_ssl = fields.Boolean(string="Verify SSL Certificate", default=True)
     user = fields.Char(string="Proxmox User")
@@ -22,7 +26,7 @@ class HypervisorServer(models.Model):
     token_value = fields.Char(string="API Token Value")
     vmware_user = fields.Char(string="vCenter User")
     vmware_password = fields.Char(string="vCenter Password")
-    status = fields.Selection([('not_tested', 'Not Tested'), ('connecting', 'Connecting...'), ('connected', 'Connected'), ('failed', 'Failed')], string="Status", default='not_tested', readonly=True)
+    status = fields.Selection([('not_tested', 'Not Tested'), ('connecting', 'Connecting...'), ('connected', 'Connected'), ('failed', 'Failed'), ('unavailable', 'Unavailable')], string="Status", default='not_tested', readonly=True)
     status_message = fields.Text(string="Status Message", readonly=True)
     node_ids = fields.One2many('hypervisor.node', 'server_id', string="Nodes/Clusters")
     storage_ids = fields.One2many('hypervisor.storage', 'server_id', string="Storages/Datastores")
@@ -31,6 +35,103 @@ class HypervisorServer(models.Model):
     current_pricing_id = fields.Many2one('hypervisor.server.pricing', string="Current Pricing",
                                          compute='_compute_current_pricing', store=False)
 
+    # Таймауты вызовов API
+    connect_timeout = fields.Integer(string="Connect Timeout (seconds)", default=5,
+                                     help="Maximum time to establish a TCP/TLS connection to the hypervisor.")
+    read_timeout = fields.Integer(string="Read Timeout (seconds)", default=30,
+                                  help="Maximum time to wait for a single API response.")
+    operation_timeout = fields.Integer(string="Operation Timeout (seconds)", default=120,
+                                       help="Total time budget of one service call, including retries.")
+    max_concurrency = fields.Integer(string="Max Parallel Requests", default=4,
+                                     help="Maximum number of concurrent API requests per worker when reading "
+                                          "several nodes or storages at once.")
+    max_parallel_provisioning = fields.Integer(string="Max Parallel Provisioning", default=4,
+                                               help="Maximum number of VMs provisioned on this server at the same "
+                                                    "time by the provisioning queue (0 - unlimited).")
+
+    # Локальное выделение VMID (hypervisor.vmid.reservation) вместо cluster/nextid
+    vmid_range_start = fields.Integer(string="VMID Range Start", default=100000,
+                                      help="First VM ID that Odoo may assign to new VMs on this server.")
+    vmid_range_end = fields.Integer(string="VMID Range End", default=199999,
+                                    help="Last VM ID that Odoo may assign to new VMs on this server.")
+    vmid_reconciled_at = fields.Datetime(string="VMIDs Reconciled", readonly=True,
+                                         help="Last time reservations were checked against the IDs in use "
+                                              "on the hypervisor.")
+    supports_vmids = fields.Boolean(compute='_compute_supports_vmids')
+
+    # Размещение VM (hypervisor.placement): нода и хранилище выбираются при провижининге
+    placement_policy = fields.Selection([
+        ('static', 'Product Defaults'),
+        ('pack', 'Bin Packing'),
+        ('spread', 'Spread'),
+    ], string="Placement Policy", default='static', required=True,
+        help="Product Defaults - VMs use the node and storage of their product. Bin Packing fills the most "
+             "loaded node that still fits the VM, Spread picks the least loaded one.")
+    cpu_overcommit_ratio = fields.Float(string="CPU Overcommit Ratio", default=4.0,
+                                        help="vCPUs that may be allocated per physical CPU of a node.")
+    memory_overcommit_ratio = fields.Float(string="Memory Overcommit Ratio", default=1.0,
+                                           help="Guest memory that may be allocated per byte of node RAM.")
+    disk_overcommit_ratio = fields.Float(string="Disk Overcommit Ratio", default=1.0,
+                                         help="Disk that may be used per byte of storage capacity "
+                                              "(above 1 for thin-provisioned storages).")
+    supports_placement = fields.Boolean(compute='_compute_supports_placement')
+
+    # Время провижининга за 30 дней по журналу аудита (vm_rental.audit_log.provisioning_stats)
+    provision_time_p50 = fields.Float(string="Time to Ready p50 (s)", compute='_compute_provision_times',
+                                      digits=(10, 1))
+    provision_time_p95 = fields.Float(string="Time to Ready p95 (s)", compute='_compute_provision_times',
+                                      digits=(10, 1))
+    provision_bottleneck = fields.Char(string="Slowest Stage", compute='_compute_provision_times',
+                                       help="Provisioning stage with the highest median duration.")
+
+    # Circuit breaker: при недоступности хоста вызовы отклоняются сразу
+    breaker_threshold = fields.Integer(string="Failures Before Opening", default=3,
+                                       help="Consecutive connection failures after which calls to this server "
+                                            "are rejected immediately.")
+    breaker_open_seconds = fields.Integer(string="Open Duration (seconds)", default=30,
+                                          help="How long calls are rejected before a trial request is allowed.")
+    breaker_state = fields.Selection([
+        ('closed', 'Closed'),
+        ('open', 'Open'),
+        ('half_open', 'Half-Open'),
+    ], string="Circuit Breaker", compute='_compute_breaker')
+    breaker_retry_at = fields.Datetime(string="Next Attempt", compute='_compute_breaker')
+    breaker_last_error = fields.Text(string="Last Connection Error", compute='_compute_breaker')
+
+    def _compute_breaker(self):
+        breakers = self.env['hypervisor.server.breaker'].sudo().search([('server_id', 'in', self.ids)])
+        by_server = {b.server_id.id: b for b in breakers}
+        for server in self:
+            breaker = by_server.get(server.id)
+            server.breaker_state = breaker.state if breaker else 'closed'
+            server.breaker_retry_at = breaker.retry_at if breaker and breaker.state != 'closed' else False
+            server.breaker_last_error = breaker.last_error if breaker else False
+
+    @api.depends('hypervisor_type')
+    def _compute_supports_vmids(self):
+        for server in self:
+            server.supports_vmids = driver_registry.supports(server.hypervisor_type, CAP_VMIDS)
+
+    @api.depends('hypervisor_type')
+    def _compute_supports_placement(self):
+        for server in self:
+            server.supports_placement = driver_registry.supports(server.hypervisor_type, CAP_CAPACITY)
+
+    def _compute_provision_times(self):
+        AuditLog = self.env['vm_rental.audit_log'].sudo()
+        stage_names = dict(AuditLog._fields['stage'].selection)
+        by_server = {}
+        for row in AuditLog.provisioning_stats('hypervisor_server_id'):
+            by_server.setdefault(row['hypervisor_server_id'], {})[row['stage']] = row
+        for server in self:
+            stats = by_server.get(server.id, {})
+            ready = stats.get('done')
+            server.provision_time_p50 = ready['p50'] if ready else 0.0
+            server.provision_time_p95 = ready['p95'] if ready else 0.0
+            stages = [row for stage, row in stats.items() if stage and stage != 'done']
+            slowest = max(stages, key=lambda row: row['p50'], default=None)
+            server.provision_bottleneck = stage_names.get(slowest['stage']) if slowest else False
+
     @api.depends('pricing_ids.active', 'pricing_ids.date_start', 'pricing_ids.date_end')
     def _compute_current_pricing(self):
         """Вычисляет текущий активный план ценообразования"""
@@ -43,15 +144,33 @@ class HypervisorServer(models.Model):
             ], order='priority', limit=1)
             server.current_pricing_id = pricing
 
+    @api.model
+    def _selection_hypervisor_type(self):
+        # Типы гипервизоров - из реестра драйверов (включая зарегистрированные другими модулями)
+        return driver_registry.selection()
+
+    def _get_service_class(self):
+        self.ensure_one()
+        try:
+            return driver_registry.load(self.hypervisor_type)
+        except KeyError:
+            raise UserError(_(f"No service manager found for hypervisor type '{self.hypervisor_type}'."))
+
+    def has_capability(self, capability):
+        """Заявленная драйвером возможность (services/drivers.py CAP_*), без обращения к API"""
+        self.ensure_one()
+        return driver_registry.supports(self.hypervisor_type, capability)
+
     def _get_service_manager(self):
+        """Сервис гипервизора поверх сессии из пула подключений воркера"""
         self.ensure_one()
-        if self.hypervisor_type == 'proxmox':
-            from ..services.proxmox_service import ProxmoxService
-            return ProxmoxService(self)
-        elif self.hypervisor_type == 'vmware':
-            from ..services.vmware_service import VmwareService
-            return VmwareService(self)
-        raise UserError(_(f"No service manager found for hypervisor type '{self.hypervisor_type}'."))
+        # Пока circuit breaker разомкнут, не тратим время на подключение
+        allowed, retry_in = circuit_breaker.check((self.env.cr.dbname, self.id))
+        if not allowed:
+            raise HypervisorUnavailableError(
+                _("Hypervisor server '%s' is temporarily unavailable, next attempt in %s s.")
+                % (self.name, int(retry_in) + 1))
+        return connection_pool.get_service(self, self._get_service_class())
 
     # vm_rental/models/hypervisor_server.py
     # ИСПРАВЛЕННЫЙ метод test_and_fetch_resources
@@ -69,8 +188,11 @@ class HypervisorServer(models.Model):
             Storage = self.env['hypervisor.storage']
             Template = self.env['hypervisor.template']
 
+            # Вся инвентаризация сервера одним проходом (у Proxmox - один снимок /cluster/resources)
+            inventory = service.get_cluster_inventory()
+
             # 1. Синхронизация Нод (с batch операциями)
-            api_nodes_data = service.list_nodes()
+            api_nodes_data = inventory['nodes']
             api_node_names = {n['name'] for n in api_nodes_data}
 
             odoo_nodes = self.node_ids
@@ -91,19 +213,18 @@ class HypervisorServer(models.Model):
 
             # Принудительно обновляем кэш
             self.invalidate_recordset(['node_ids'])
+            node_ids_by_name = {n.name: n.id for n in self.node_ids}
 
             # 2. Синхронизация Хранилищ (оптимизированная)
             all_odoo_storages = {s.name: s for s in self.storage_ids}
             api_storages_map = {}
 
             # Собираем все данные о хранилищах за один проход
-            for node in self.node_ids:
-                storages_on_node = service.list_storages(node.name)
-                for storage_data in storages_on_node:
-                    s_name = storage_data['name']
-                    if s_name not in api_storages_map:
-                        api_storages_map[s_name] = set()
-                    api_storages_map[s_name].add(node.id)  # Используем ID для оптимизации
+            for storage_data in inventory['storages']:
+                node_id = node_ids_by_name.get(storage_data.get('node'))
+                if not node_id:
+                    continue
+                api_storages_map.setdefault(storage_data['name'], set()).add(node_id)
 
             # Batch операции для хранилищ
             storages_to_create = []
@@ -133,18 +254,16 @@ class HypervisorServer(models.Model):
                 Storage.browse(storages_to_remove_ids).unlink()
 
             # 3. ИСПРАВЛЕННАЯ Синхронизация Шаблонов
-            api_templates_data = []
-            for node in self.node_ids:
-                try:
-                    templates_on_node = service.list_os_templates(node.name)
-                    api_templates_data.extend(templates_on_node)
-                except Exception as e:
-                    _logger.warning(f"Could not fetch templates from node {node.name}: {e}")
-                    continue
+            api_templates_data = inventory['templates']
 
             # ИСПРАВЛЕНИЕ: Используем составной ключ (server_id, vmid) для уникальности
             api_template_map = {}
+            # Реплики шаблонов тоже шаблоны на гипервизоре, но ведутся в hypervisor.template.replica
+            replica_vmids = set(self.env['hypervisor.template.replica'].search(
+                [('server_id', '=', self.id)]).mapped('vmid'))
             for t in api_templates_data:
+                if str(t.get('vmid')) in replica_vmids:
+                    continue
                 # Создаем уникальный ключ: server_id + vmid
                 unique_key = f"{self.id}_{t['vmid']}"
                 # Если vmid уже есть для этого сервера, пропускаем дубликат
@@ -172,8 +291,15 @@ class HypervisorServer(models.Model):
                         'name': template_data.get('name', f"Template {vmid}"),
                         'vmid': str(vmid),  # Приводим к строке для безопасности
                         'server_id': self.id,
-                        'template_type': template_data.get('template_type', 'qemu')
+                        'template_type': template_data.get('template_type', 'qemu'),
+                        'node_id': node_ids_by_name.get(template_data.get('node'), False),
                     })
+                else:
+                    # Шаблон мог переехать на другую ноду - размещение клонирует только туда, где он доступен
+                    node_id = node_ids_by_name.get(template_data.get('node'))
+                    template = odoo_template_map[unique_key]
+                    if node_id and template.node_id.id != node_id:
+                        template.node_id = node_id
 
             if templates_to_create:
                 try:
@@ -209,6 +335,31 @@ class HypervisorServer(models.Model):
 
         return True
 
+    @api.constrains('connect_timeout', 'read_timeout', 'operation_timeout', 'max_concurrency')
+    def _check_timeouts(self):
+        for server in self:
+            if min(server.connect_timeout, server.read_timeout, server.operation_timeout) <= 0:
+                raise ValidationError(_("Timeouts must be positive"))
+            if server.max_concurrency <= 0:
+                raise ValidationError(_("Max parallel requests must be positive"))
+            if server.operation_timeout < server.read_timeout:
+                raise ValidationError(_("Operation timeout cannot be shorter than the read timeout"))
+
+    @api.constrains('vmid_range_start', 'vmid_range_end')
+    def _check_vmid_range(self):
+        for server in self:
+            if server.vmid_range_start < 100 or server.vmid_range_end < server.vmid_range_start:
+                raise ValidationError(_("VMID range must start at 100 or above and not end before it starts"))
+
+    @api.constrains('placement_policy', 'cpu_overcommit_ratio', 'memory_overcommit_ratio', 'disk_overcommit_ratio')
+    def _check_placement(self):
+        for server in self:
+            if min(server.cpu_overcommit_ratio, server.memory_overcommit_ratio, server.disk_overcommit_ratio) <= 0:
+                raise ValidationError(_("Overcommit ratios must be positive"))
+            if server.placement_policy != 'static' and not server.supports_placement:
+                raise ValidationError(_("Capacity-based placement is not supported for %s servers")
+                                      % server.hypervisor_type)
+
     @api.constrains('host')
     def _check_host(self):
         """Проверка валидности хоста"""
@@ -221,23 +372,45 @@ class HypervisorServer(models.Model):
             if not (ip_pattern.match(server.host) or hostname_pattern.match(server.host)):
                 raise ValidationError(_("Invalid hostname or IP address format"))
 
-    @ormcache('self.id')
-    def _get_cached_service_manager(self):
-        """Кешированная версия сервис-менеджера"""
-        return self._get_service_manager()
-    
     def clear_service_cache(self):
-        """Очистка кеша при изменении конфигурации"""
-        self._get_cached_service_manager.clear_cache(self)
+        """Закрывает сессии сервера в пуле подключений текущего воркера"""
+        for record in self:
+            connection_pool.invalidate(self.env.cr.dbname, record.id)
+
+    def action_reset_breaker(self):
+        """Ручное замыкание circuit breaker (например, после восстановления хоста)"""
+        for server in self:
+            circuit_breaker.reset((self.env.cr.dbname, server.id))
+        self.invalidate_recordset(['breaker_state', 'breaker_retry_at', 'breaker_last_error'])
+        return True
+
+    def action_reconcile_vmids(self):
+        """Сверка резервов VMID с номерами, занятыми на гипервизоре"""
+        reservations = self.env['hypervisor.vmid.reservation'].sudo()
+        for server in self.filtered('supports_vmids'):
+            reservations._reconcile(server)
+        return True
+
+    def get_call_stats(self):
+        """Счетчики вызовов API сервера (success/failure/retry) в текущем воркере"""
+        self.ensure_one()
+        return call_stats.get((self.env.cr.dbname, self.id))
 
     def write(self, vals):
-        # Очищаем кеш при изменении критических полей
-        critical_fields = {'host', 'user', 'token_name', 'token_value', 'vmware_user', 'vmware_password'}
+        # Сбрасываем пул при изменении критических полей
+        critical_fields = {'hypervisor_type', 'host', 'verify_ssl', 'user', 'token_name', 'token_value',
+                           'vmware_user', 'vmware_password', 'connect_timeout', 'read_timeout'}
         if any(field in vals for field in critical_fields):
-            for record in self:
-                record.clear_service_cache()
+            self.clear_service_cache()
+        if 'vmid_range_start' in vals or 'vmid_range_end' in vals:
+            # Новый диапазон сверяется с гипервизором перед первым выделением
+            vals = dict(vals, vmid_reconciled_at=False)
         return super().write(vals)
 
+    def unlink(self):
+        self.clear_service_cache()
+        return super().unlink()
+
     # vm_rental/models/hypervisor_server.py
     # НОВЫЙ метод для очистки дубликатов
 
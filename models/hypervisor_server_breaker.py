@@ -0,0 +1,31 @@
+# vm_rental/models/hypervisor_server_breaker.py
+# -*- coding: utf-8 -*-
+from odoo import models, fields
+
+
+class HypervisorServerBreaker(models.Model):
+    """
+    Состояние circuit breaker сервера гипервизора, общее для всех воркеров.
+    Записи изменяются сервисным слоем напрямую SQL-запросами в отдельном
+    курсоре (см. services/circuit_breaker.py); модель нужна для схемы и просмотра.
+    """
+    _name = 'hypervisor.server.breaker'
+    _description = 'Hypervisor Server Circuit Breaker'
+    _rec_name = 'server_id'
+
+    server_id = fields.Many2one('hypervisor.server', string="Server", required=True, ondelete='cascade',
+                                readonly=True)
+    state = fields.Selection([
+        ('closed', 'Closed'),
+        ('open', 'Open'),
+        ('half_open', 'Half-Open'),
+    ], string="State", default='closed', required=True, readonly=True)
+    failure_count = fields.Integer(string="Consecutive Failures", default=0, readonly=True)
+    last_error = fields.Text(string="Last Error", readonly=True)
+    last_failure_at = fields.Datetime(string="Last Failure", readonly=True)
+    opened_at = fields.Datetime(string="Opened At", readonly=True)
+    retry_at = fields.Datetime(string="Next Attempt", readonly=True)
+
+    _sql_constraints = [
+        ('server_unique', 'unique(server_id)', 'Only one circuit breaker per hypervisor server is allowed.'),
+    ]
@@ -0,0 +1,224 @@
+# vm_rental/models/hypervisor_task.py
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from odoo import models, fields, api, _
+import logging
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class HypervisorTask(models.Model):
+    """
+    Асинхронная задача гипервизора (Proxmox UPID), отслеживаемая без блокировки
+    HTTP-воркеров. По завершении задачи вызывается следующий шаг цепочки:
+    метод `callback` записи `res_model`/`res_id`, который получает эту задачу.
+    Если callback падает, вызывается `_on_task_callback_failed(task, error)` записи (если есть).
+    """
+    _name = 'hypervisor.task'
+    _description = 'Hypervisor Task'
+    _order = 'create_date desc, id desc'
+    _rec_name = 'upid'
+
+    # Интервалы опроса с экспоненциальной задержкой, сек.
+    POLL_BASE_DELAY = 2
+    POLL_MAX_DELAY = 60
+    # Задача, статус которой гипервизор не возвращает (потерян UPID, нода перезагружена,
+    # журнал задач ротирован), считается проваленной через LOST_TASK_TIMEOUT;
+    # любая незавершенная задача - через MAX_TASK_AGE, сек.
+    LOST_TASK_TIMEOUT = 15 * 60
+    MAX_TASK_AGE = 6 * 60 * 60
+
+    upid = fields.Char(string="Task ID (UPID)", required=True, readonly=True, index=True)
+    server_id = fields.Many2one('hypervisor.server', string="Server", required=True, ondelete='cascade',
+                                index=True, readonly=True)
+    node = fields.Char(string="Node", readonly=True)
+    vm_id = fields.Many2one('vm_rental.machine', string="VM", ondelete='set null', index=True, readonly=True)
+    operation = fields.Selection([
+        ('clone', 'Clone'),
+        ('config', 'Configure'),
+        ('resize', 'Resize Disk'),
+        ('start', 'Start'),
+        ('stop', 'Stop'),
+        ('reboot', 'Reboot'),
+        ('suspend', 'Suspend'),
+        ('delete', 'Delete'),
+        ('snapshot', 'Snapshot'),
+        ('other', 'Other'),
+    ], string="Operation", required=True, default='other', readonly=True)
+    state = fields.Selection([
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string="State", default='running', required=True, index=True, readonly=True)
+    exitstatus = fields.Char(string="Exit Status", readonly=True)
+    error_message = fields.Text(string="Error Message", readonly=True)
+
+    # Следующий шаг цепочки
+    res_model = fields.Char(string="Callback Model", readonly=True)
+    res_id = fields.Integer(string="Callback Record ID", readonly=True)
+    callback = fields.Char(string="Callback Method", readonly=True)
+
+    # Планирование опроса
+    poll_count = fields.Integer(string="Polls", default=0, readonly=True)
+    next_poll_at = fields.Datetime(string="Next Poll", default=fields.Datetime.now, index=True, readonly=True)
+    started_at = fields.Datetime(string="Started", default=fields.Datetime.now, readonly=True)
+    finished_at = fields.Datetime(string="Finished", readonly=True)
+    duration = fields.Float(string="Duration (seconds)", compute='_compute_duration', digits=(10, 1))
+
+    @api.depends('started_at', 'finished_at')
+    def _compute_duration(self):
+        for task in self:
+            if task.started_at and task.finished_at:
+                task.duration = (task.finished_at - task.started_at).total_seconds()
+            else:
+                task.duration = 0.0
+
+    # === Регистрация задач ===
+
+    @api.model
+    def track(self, server, upid, operation='other', node=None, vm=None, record=None, callback=None):
+        """
+        Регистрирует UPID для фонового отслеживания.
+
+        Args:
+            server: запись hypervisor.server
+            upid: идентификатор задачи гипервизора
+            operation: тип операции (см. поле operation)
+            node: нода, на которой выполняется задача
+            vm: запись vm_rental.machine (опционально)
+            record: запись, у которой будет вызван callback (по умолчанию vm)
+            callback: имя метода record, вызываемого с этой задачей по завершении
+        """
+        record = record if record is not None else vm
+        task = self.create({
+            'upid': upid,
+            'server_id': server.id,
+            'node': node or self._node_from_upid(upid),
+            'vm_id': vm.id if vm else False,
+            'operation': operation,
+            'res_model': record._name if record and callback else False,
+            'res_id': record.id if record and callback else False,
+            'callback': callback or False,
+        })
+        self._trigger_poller()
+        return task
+
+    @api.model
+    def _node_from_upid(self, upid):
+        """UPID:<node>:<pid>:<pstart>:<starttime>:<type>:<id>:<user>:"""
+        parts = str(upid or '').split(':')
+        return parts[1] if len(parts) > 2 and parts[0] == 'UPID' else False
+
+    @api.model
+    def _trigger_poller(self):
+        cron = self.env.ref('vm_rental.cron_poll_hypervisor_tasks', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+
+    # === Опрос ===
+
+    @api.model
+    def _cron_poll_tasks(self, max_runtime=50):
+        """
+        Опрашивает все незавершенные задачи пачками (по одному запросу на сервер)
+        в течение max_runtime секунд, соблюдая индивидуальные задержки задач.
+        """
+        deadline = time.monotonic() + max_runtime
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+
+        while True:
+            due_tasks = self.search([
+                ('state', '=', 'running'),
+                ('next_poll_at', '<=', fields.Datetime.now()),
+            ])
+            if due_tasks:
+                due_tasks._poll()
+                if auto_commit:
+                    self.env.cr.commit()
+
+            next_task = self.search([('state', '=', 'running')], order='next_poll_at', limit=1)
+            if not next_task:
+                break
+            wait = max((next_task.next_poll_at - fields.Datetime.now()).total_seconds(), 0)
+            if time.monotonic() + wait >= deadline:
+                break
+            time.sleep(max(wait, 1))
+
+    def _poll(self):
+        """Проверяет статусы задач, группируя их по серверу"""
+        for server in self.mapped('server_id'):
+            tasks = self.filtered(lambda t: t.server_id == server)
+            try:
+                service = server._get_service_manager()
+                statuses = service.get_task_statuses([(t.node, t.upid) for t in tasks])
+            except Exception as e:
+                _logger.warning(f"Could not poll tasks on server {server.name}: {e}")
+                # Недоступность сервера не означает потерю задачи - только общий предел возраста
+                tasks._schedule_or_expire(status_lost=False)
+                continue
+
+            for task in tasks:
+                status = statuses.get(task.upid)
+                if not status or status.get('status') == 'running':
+                    task._schedule_or_expire(status_lost=not status)
+                    continue
+                exitstatus = status.get('exitstatus') or ''
+                task._mark_finished(exitstatus)
+
+    def _schedule_or_expire(self, status_lost=False):
+        """Планирует следующий опрос или завершает задачу с ошибкой по таймауту"""
+        now = fields.Datetime.now()
+        for task in self:
+            age = (now - (task.started_at or task.create_date)).total_seconds()
+            if age > self.MAX_TASK_AGE:
+                task._mark_finished(f"timeout: task did not finish in {int(age)} seconds")
+            elif status_lost and age > self.LOST_TASK_TIMEOUT:
+                task._mark_finished(f"timeout: task status unavailable for {int(age)} seconds")
+            else:
+                task._schedule_next_poll()
+
+    def _schedule_next_poll(self):
+        for task in self:
+            delay = min(self.POLL_BASE_DELAY * (2 ** task.poll_count), self.POLL_MAX_DELAY)
+            task.write({
+                'poll_count': task.poll_count + 1,
+                'next_poll_at': fields.Datetime.now() + timedelta(seconds=delay),
+            })
+
+    def _mark_finished(self, exitstatus):
+        """Фиксирует результат задачи и запускает следующий шаг цепочки"""
+        self.ensure_one()
+        success = exitstatus == 'OK' or exitstatus.startswith('WARNINGS')
+        self.write({
+            'state': 'done' if success else 'failed',
+            'exitstatus': exitstatus,
+            'error_message': False if success else exitstatus or _("Unknown task error"),
+            'finished_at': fields.Datetime.now(),
+        })
+        _logger.info(f"Hypervisor task {self.upid} ({self.operation}) finished: {exitstatus}")
+        self._run_callback()
+
+    def _run_callback(self):
+        self.ensure_one()
+        if not (self.callback and self.res_model and self.res_id):
+            return
+        record = self.env[self.res_model].browse(self.res_id).exists()
+        if not record:
+            return
+        try:
+            with self.env.cr.savepoint():
+                getattr(record, self.callback)(self)
+        except Exception as e:
+            _logger.error(f"Callback {self.res_model}.{self.callback} failed for task {self.upid}: {e}",
+                          exc_info=True)
+            self.write({'error_message': _("Follow-up step failed: %s") % e})
+            # Запись не должна зависнуть в промежуточном состоянии: у нее свой обработчик сбоя
+            if hasattr(record, '_on_task_callback_failed'):
+                try:
+                    with self.env.cr.savepoint():
+                        record._on_task_callback_failed(self, e)
+                except Exception as fail_error:
+                    _logger.error(f"Failure handler of {self.res_model} {self.res_id} failed for task "
+                                  f"{self.upid}: {fail_error}", exc_info=True)
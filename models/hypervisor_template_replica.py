@@ -0,0 +1,232 @@
+# vm_rental/models/hypervisor_template_replica.py
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+import logging
+import re
+import threading
+
+_logger = logging.getLogger(__name__)
+
+
+class HypervisorTemplateReplica(models.Model):
+    """
+    Копия шаблона на другом хранилище (тоже шаблон на гипервизоре).
+
+    VM, размещенная на хранилище с готовой репликой, клонируется из реплики: диск не
+    копируется между хранилищами, а связанный клон становится возможным. Реплика
+    создается полным клоном шаблона на ноде шаблона и превращается в шаблон; при
+    изменении конфигурации шаблона (digest) старые реплики помечаются устаревшими,
+    создаются новые, а устаревшие удаляются, когда на них больше нет связанных клонов:
+    реплика снимается с учета только после успешной задачи удаления на гипервизоре.
+    """
+    _name = 'hypervisor.template.replica'
+    _description = 'Hypervisor Template Replica'
+    _order = 'template_id, storage_id, id desc'
+    _rec_name = 'vmid'
+
+    ACTIVE_STATES = ('cloning', 'converting', 'ready')
+
+    template_id = fields.Many2one('hypervisor.template', string="Template", required=True, ondelete='cascade',
+                                  index=True, readonly=True)
+    server_id = fields.Many2one(related='template_id.server_id', string="Server", store=True, index=True)
+    storage_id = fields.Many2one('hypervisor.storage', string="Storage", required=True, ondelete='cascade',
+                                 readonly=True)
+    node = fields.Char(string="Node", readonly=True)
+    vmid = fields.Char(string="VMID", required=True, readonly=True)
+    state = fields.Selection([
+        ('cloning', 'Cloning'),
+        ('converting', 'Converting'),
+        ('ready', 'Ready'),
+        ('stale', 'Stale'),
+        ('deleting', 'Deleting'),
+        ('failed', 'Failed'),
+    ], string="State", default='cloning', required=True, index=True, readonly=True)
+    source_digest = fields.Char(string="Template Digest", readonly=True,
+                                help="Configuration digest of the template this replica was copied from.")
+    replicated_at = fields.Datetime(string="Replicated At", readonly=True)
+    error_message = fields.Text(string="Error Message", readonly=True)
+
+    # === Завершение копирования ===
+
+    def _on_cloned(self, task):
+        """Копия диска готова - превращаем ее в шаблон"""
+        if self.state != 'cloning':
+            # Реплика устарела, пока копировалась: ее только удаляют, шаблоном она не становится
+            return
+        if task and task.state == 'failed':
+            self.write({'state': 'failed', 'error_message': task.exitstatus})
+            return
+        self.state = 'converting'
+        try:
+            service = self.server_id._get_service_manager()
+            upid = service.convert_to_template(self.node, self.vmid)
+        except Exception as e:
+            self.write({'state': 'failed', 'error_message': str(e)})
+            return
+        if upid:
+            self.env['hypervisor.task'].track(self.server_id, upid, 'other', node=self.node,
+                                              record=self, callback='_on_converted')
+        else:
+            self._on_converted(None)
+
+    def _on_converted(self, task):
+        if self.state != 'converting':
+            return
+        if task and task.state == 'failed':
+            self.write({'state': 'failed', 'error_message': task.exitstatus})
+            return
+        self.write({'state': 'ready', 'replicated_at': fields.Datetime.now(), 'error_message': False})
+        self.env['hypervisor.vmid.reservation'].sudo().mark_in_use(self.server_id, self.vmid)
+        _logger.info(f"Template {self.template_id.name}: replica {self.vmid} on {self.storage_id.name} is ready")
+
+    def _on_task_callback_failed(self, task, error):
+        self.write({'state': 'failed', 'error_message': str(error)})
+
+    def _in_use(self):
+        """
+        Есть ли в Odoo то, что еще держит реплику: ее незавершенная задача, связанные клоны
+        на ее хранилище и идущие клонирования (VM и гости теплых пулов этого шаблона).
+        """
+        self.ensure_one()
+        if self.env['hypervisor.task'].sudo().search([
+                ('res_model', '=', self._name), ('res_id', '=', self.id), ('state', '=', 'running')], limit=1):
+            # Реплика еще копируется или превращается в шаблон - ее конфигурация заблокирована
+            return True
+        vms = self.env['vm_rental.machine'].sudo().search([
+            ('hypervisor_template_id', '=', self.template_id.id),
+            ('hypervisor_storage_id', '=', self.storage_id.id),
+            ('state', 'not in', ('terminated', 'archived', 'failed')),
+            '|', ('provisioned_clone_mode', '=', 'linked'), ('state', '=', 'provisioning'),
+        ], limit=1)
+        guests = self.env['vm_rental.warm_pool.guest'].sudo().search([
+            ('pool_id.product_tmpl_id.hypervisor_template_id', '=', self.template_id.id),
+            ('pool_id.product_tmpl_id.hypervisor_storage_id', '=', self.storage_id.id),
+            '|', '&', ('clone_mode', '=', 'linked'), ('state', 'in', ('ready', 'claimed')),
+            ('state', '=', 'cloning'),
+        ], limit=1)
+        return bool(vms or guests)
+
+    def _destroy(self, service):
+        """
+        Удаляет реплики на гипервизоре. Proxmox принимает удаление сразу, а занятость
+        базового тома связанными клонами выясняется только в задаче удаления, поэтому
+        реплика снимается с учета в _on_deleted, а при ошибке задачи остается устаревшей.
+        """
+        for replica in self:
+            if replica._in_use():
+                _logger.info(f"Stale replica {replica.vmid} is still in use, deletion postponed")
+                continue
+            try:
+                upid = service.delete_vm(replica.node, replica.vmid)
+            except Exception as e:
+                if replica.state == 'stale':
+                    _logger.warning(f"Could not delete template replica {replica.vmid}: {e}")
+                    continue
+                # Неудачный клон мог не создаться вовсе; остатки покажет сверка VMID
+                _logger.warning(f"Could not delete failed template replica {replica.vmid}: {e}")
+                replica._on_deleted(None)
+                continue
+            replica.write({'state': 'deleting', 'error_message': False})
+            if upid:
+                self.env['hypervisor.task'].track(replica.server_id, upid, 'delete', node=replica.node,
+                                                  record=replica, callback='_on_deleted')
+            else:
+                replica._on_deleted(None)
+
+    def _on_deleted(self, task):
+        """Задача удаления завершена: реплика снимается с учета или остается устаревшей"""
+        if task and task.state == 'failed':
+            _logger.info(f"Template replica {self.vmid} was not deleted: {task.exitstatus}")
+            self.write({'state': 'stale', 'error_message': task.exitstatus})
+            return
+        self.env['hypervisor.vmid.reservation'].sudo().release(self.server_id, self.vmid)
+        self.unlink()
+
+
+class HypervisorTemplate(models.Model):
+    _inherit = 'hypervisor.template'
+
+    @api.model
+    def _cron_sync_replicas(self):
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        templates = self.search(['|', ('replica_storage_ids', '!=', False), ('replica_ids', '!=', False)])
+        for template in templates:
+            if not template._supports_replicas():
+                continue
+            try:
+                with self.env.cr.savepoint():
+                    template._sync_replicas()
+            except Exception as e:
+                _logger.warning(f"Could not sync replicas of template {template.name}: {e}")
+            # Запущенные клоны фиксируются сразу, чтобы не потерять их при ошибке следующего шаблона
+            if auto_commit:
+                self.env.cr.commit()
+
+    def action_sync_replicas(self):
+        for template in self:
+            if not template._supports_replicas():
+                raise UserError(_("Template replicas are not supported for template %s") % template.name)
+            template._sync_replicas()
+        return True
+
+    def _sync_replicas(self):
+        """
+        Приводит реплики шаблона к списку replica_storage_ids: создает недостающие,
+        пересоздает устаревшие (digest шаблона изменился) и удаляет лишние.
+        """
+        self.ensure_one()
+        server = self.server_id
+        service = server._get_service_manager()
+        info = service.get_template_info(self.vmid)
+        node = self.env['hypervisor.node'].search([('server_id', '=', server.id), ('name', '=', info['node'])],
+                                                  limit=1)
+        storage = self.env['hypervisor.storage'].search([('server_id', '=', server.id),
+                                                         ('name', 'in', info['storages'])], limit=1)
+        self.write({'node_id': node.id, 'storage_id': storage.id, 'config_digest': info['digest']})
+
+        Replica = self.env['hypervisor.template.replica']
+        outdated = self.replica_ids.filtered(
+            lambda r: r.state in Replica.ACTIVE_STATES
+            and (r.source_digest != info['digest'] or r.storage_id not in self.replica_storage_ids))
+        outdated.write({'state': 'stale'})
+        self.replica_ids.filtered(lambda r: r.state in ('stale', 'failed'))._destroy(service)
+
+        started = 0
+        for target in self.replica_storage_ids:
+            if target.name in info['storages']:
+                # Шаблон уже лежит на этом хранилище
+                continue
+            if not target.shared and target.node_ids and node not in target.node_ids:
+                _logger.warning(f"Template {self.name}: storage {target.name} is not available on node "
+                                f"{info['node']}, replica skipped")
+                continue
+            if self.replica_ids.filtered(lambda r: r.storage_id == target and r.state in Replica.ACTIVE_STATES):
+                continue
+            self._start_replica(service, info, target)
+            started += 1
+        if started:
+            _logger.info(f"Template {self.name}: {started} replicas cloning")
+
+    def _start_replica(self, service, info, storage):
+        """Запускает полный клон шаблона на хранилище storage"""
+        server = self.server_id
+        Reservation = self.env['hypervisor.vmid.reservation'].sudo()
+        vmid = str(Reservation.allocate(server))
+        name = re.sub(r'[^A-Za-z0-9-]+', '-', f'tpl-{self.vmid}-{storage.name}')
+        try:
+            upid = service.clone_vm(node=info['node'], vm_id=vmid, name=name, template_vmid=self.vmid,
+                                    storage=storage.name)
+        except Exception:
+            Reservation.release(server, vmid)
+            raise
+        replica = self.env['hypervisor.template.replica'].create({
+            'template_id': self.id,
+            'storage_id': storage.id,
+            'node': info['node'],
+            'vmid': vmid,
+            'source_digest': info['digest'],
+        })
+        self.env['hypervisor.task'].track(server, upid, 'clone', node=info['node'],
+                                          record=replica, callback='_on_cloned')
+        return replica
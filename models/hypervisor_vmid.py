@@ -0,0 +1,169 @@
+# vm_rental/models/hypervisor_vmid.py
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+
+class HypervisorVmidReservation(models.Model):
+    """
+    Резервирование VMID в диапазоне сервера (для гипервизоров, где VMID выбирает клиент).
+
+    VMID выделяется локально, без запроса cluster/nextid: наименьший номер диапазона,
+    для которого нет строки в этой таблице. Выделение идет в отдельной короткой
+    транзакции под advisory-блокировкой сервера, поэтому параллельные воркеры
+    провижининга никогда не получают один и тот же номер, а резерв виден всем
+    сразу, не дожидаясь конца провижининга.
+
+    Освобожденный после ошибки номер (released) не выдается повторно, пока
+    сверка с гипервизором (_reconcile) не подтвердит, что он действительно свободен.
+    """
+    _name = 'hypervisor.vmid.reservation'
+    _description = 'Hypervisor VMID Reservation'
+    _order = 'server_id, vmid'
+    _rec_name = 'vmid'
+
+    # Пространство ключей pg_advisory_xact_lock для выделения VMID сервера
+    LOCK_SPACE = 0x564D49  # 'VMI'
+    # Резерв без завершенного провижининга, сек., после которого сверка считает его брошенным
+    RESERVATION_TTL = 6 * 3600
+
+    server_id = fields.Many2one('hypervisor.server', string="Server", required=True, ondelete='cascade',
+                                index=True, readonly=True)
+    vmid = fields.Integer(string="VMID", required=True, readonly=True)
+    state = fields.Selection([
+        ('reserved', 'Reserved'),
+        ('in_use', 'In Use'),
+        ('external', 'Used Outside Odoo'),
+        ('released', 'Released'),
+    ], string="State", required=True, default='reserved', readonly=True)
+
+    _sql_constraints = [
+        ('server_vmid_unique', 'unique(server_id, vmid)', 'VMID is already reserved on this server.'),
+    ]
+
+    @contextmanager
+    def _allocation_cursor(self):
+        """Отдельная транзакция, фиксируемая сразу (в тестах - текущий курсор)"""
+        if getattr(threading.current_thread(), 'testing', False):
+            yield self.env.cr
+        else:
+            with self.pool.cursor() as cr:
+                # READ COMMITTED: после ожидания блокировки запрос должен видеть
+                # резерв, только что зафиксированный конкурентом
+                cr.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+                yield cr
+
+    def _lock_server(self, cr, server):
+        cr.execute("SELECT pg_advisory_xact_lock(%s, %s)", (self.LOCK_SPACE, server.id))
+
+    # === Выделение и освобождение ===
+
+    @api.model
+    def allocate(self, server):
+        """Резервирует свободный VMID из диапазона сервера и возвращает его"""
+        if not server.vmid_reconciled_at:
+            # Первое выделение на сервере: узнаем номера, уже занятые на гипервизоре
+            self._reconcile(server)
+
+        with self._allocation_cursor() as cr:
+            self._lock_server(cr, server)
+            cr.execute(f"""
+                SELECT candidate
+                  FROM generate_series(%s, %s) AS candidate
+                 WHERE NOT EXISTS (SELECT 1 FROM {self._table} r
+                                    WHERE r.server_id = %s AND r.vmid = candidate)
+                 LIMIT 1
+            """, (server.vmid_range_start, server.vmid_range_end, server.id))
+            row = cr.fetchone()
+            if not row:
+                raise UserError(_("No free VMID left in range %s-%s on server %s")
+                                % (server.vmid_range_start, server.vmid_range_end, server.name))
+            vmid = row[0]
+            cr.execute(f"""
+                INSERT INTO {self._table} (server_id, vmid, state, create_uid, create_date, write_uid, write_date)
+                VALUES (%s, %s, 'reserved', %s, now() AT TIME ZONE 'UTC', %s, now() AT TIME ZONE 'UTC')
+            """, (server.id, vmid, self.env.uid, self.env.uid))
+
+        _logger.info(f"VMID {vmid} reserved on server {server.name}")
+        return vmid
+
+    @api.model
+    def release(self, server, vmid):
+        """Освобождает резерв после неудачного провижининга (номер вернется в оборот после сверки)"""
+        self._set_state(server, vmid, 'released', from_states=('reserved',))
+
+    @api.model
+    def mark_in_use(self, server, vmid):
+        self._set_state(server, vmid, 'in_use')
+
+    @api.model
+    def _set_state(self, server, vmid, state, from_states=None):
+        try:
+            vmid = int(vmid)
+        except (TypeError, ValueError):
+            return
+        query = f"""
+            UPDATE {self._table} SET state = %s, write_uid = %s, write_date = now() AT TIME ZONE 'UTC'
+             WHERE server_id = %s AND vmid = %s
+        """
+        params = [state, self.env.uid, server.id, vmid]
+        if from_states:
+            query += " AND state IN %s"
+            params.append(tuple(from_states))
+        with self._allocation_cursor() as cr:
+            cr.execute(query, params)
+
+    # === Сверка с гипервизором ===
+
+    @api.model
+    def _reconcile(self, server):
+        """
+        Сверяет резервы с номерами, реально занятыми на гипервизоре (один запрос):
+        занятые номера диапазона помечаются in_use (VM Odoo) или external,
+        а external/released/in_use номера, которых больше нет, и брошенные резервы удаляются.
+        """
+        used = {int(vmid) for vmid in server._get_service_manager().list_used_vmids()}
+        used_in_range = sorted(v for v in used if server.vmid_range_start <= v <= server.vmid_range_end)
+        managed_refs = set(self.env['vm_rental.machine'].sudo().search([
+            ('hypervisor_server_id', '=', server.id),
+            ('state', 'not in', ('terminated', 'archived')),
+        ]).mapped('hypervisor_vm_ref'))
+
+        with self._allocation_cursor() as cr:
+            self._lock_server(cr, server)
+            for vmid in used_in_range:
+                state = 'in_use' if str(vmid) in managed_refs else 'external'
+                # Свежие резервы принадлежат идущему провижинингу - их не трогаем
+                cr.execute(f"""
+                    INSERT INTO {self._table} AS r (server_id, vmid, state, create_uid, create_date, write_uid, write_date)
+                    VALUES (%s, %s, %s, %s, now() AT TIME ZONE 'UTC', %s, now() AT TIME ZONE 'UTC')
+                    ON CONFLICT (server_id, vmid) DO UPDATE SET state = EXCLUDED.state, write_date = EXCLUDED.write_date
+                     WHERE r.state != 'reserved'
+                        OR r.create_date < (now() AT TIME ZONE 'UTC') - %s * interval '1 second'
+                """, (server.id, vmid, state, self.env.uid, self.env.uid, self.RESERVATION_TTL))
+            cr.execute(f"""
+                DELETE FROM {self._table}
+                 WHERE server_id = %s AND NOT (vmid = ANY(%s))
+                   AND (state != 'reserved'
+                        OR create_date < (now() AT TIME ZONE 'UTC') - %s * interval '1 second')
+            """, (server.id, list(used), self.RESERVATION_TTL))
+            freed = cr.rowcount
+
+        server.sudo().vmid_reconciled_at = fields.Datetime.now()
+        _logger.info(f"VMIDs of server {server.name} reconciled: {len(used_in_range)} in use in range, "
+                     f"{freed} reservations freed")
+
+    @api.model
+    def _cron_reconcile(self):
+        for server in self.env['hypervisor.server'].search([]):
+            if not server.supports_vmids:
+                continue
+            try:
+                self._reconcile(server)
+            except Exception as e:
+                _logger.warning(f"Could not reconcile VMIDs of server {server.name}: {e}")
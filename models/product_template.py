@@ -31,6 +31,13 @@ class ProductTemplate(models.Model):
                                             domain="[('server_id', '=?', hypervisor_server_id)]")
     hypervisor_template_id = fields.Many2one('hypervisor.template', string="Base Template",
                                              domain="[('server_id', '=?', hypervisor_server_id)]")
+    vm_clone_mode = fields.Selection([
+        ('template', 'As Template'),
+        ('full', 'Full Clone'),
+        ('linked', 'Linked Clone'),
+    ], string="Clone Mode", default='template',
+        help="How VMs of this product are cloned from the base template. Linked clones fall back to full "
+             "clones when the storage does not support them.")
 
     # Trial settings
     has_trial_period = fields.Boolean(string="Offer Trial Period")
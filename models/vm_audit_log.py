@@ -3,6 +3,17 @@
 from odoo import models, fields, api
 import json
 
+# Этапы провижининга VM; 'done' - VM готова (длительность записи - полное время провижининга)
+PROVISION_STAGES = [
+    ('placement', 'Placement'),
+    ('allocate_id', 'Allocate ID'),
+    ('clone', 'Clone'),
+    ('configure', 'Configure'),
+    ('resize', 'Resize Disk'),
+    ('start', 'Start'),
+    ('done', 'Ready'),
+]
+
 class VmAuditLog(models.Model):
     _name = 'vm_rental.audit_log'
     _description = 'VM Operation Audit Log'
@@ -23,15 +34,24 @@ class VmAuditLog(models.Model):
         ('extend', 'Period Extended'),
         ('terminate', 'Terminated'),
         ('user_group_update', 'User Group Updated'),
+        ('provision_stage', 'Provisioning Stage'),
+        ('provision', 'Provisioned'),
     ], string="Action", required=True, index=True)
     
     success = fields.Boolean(string="Success", default=True)
     error_message = fields.Text(string="Error Message")
-    duration = fields.Float(string="Duration (seconds)", digits=(10, 3))
+    duration = fields.Float(string="Duration (seconds)", digits=(10, 3), group_operator='avg')
     metadata = fields.Text(string="Metadata")
+
+    # Провижининг: этап и его размещение - для перцентилей по серверу, шаблону и хранилищу
+    stage = fields.Selection(PROVISION_STAGES, string="Stage", index=True)
+    started_at = fields.Datetime(string="Started")
+    hypervisor_server_id = fields.Many2one('hypervisor.server', string="Server", ondelete='set null', index=True)
+    hypervisor_template_id = fields.Many2one('hypervisor.template', string="Template", ondelete='set null')
+    hypervisor_storage_id = fields.Many2one('hypervisor.storage', string="Storage", ondelete='set null')
     
     @api.model
-    def log_action(self, vm_id, action, success=True, error_message=None, duration=None, metadata=None):
+    def log_action(self, vm_id, action, success=True, error_message=None, duration=None, metadata=None, **values):
         """Удобный метод для логирования действий"""
         vals = {
             'vm_id': vm_id,
@@ -39,8 +59,29 @@ class VmAuditLog(models.Model):
             'success': success,
             'error_message': error_message,
             'duration': duration,
+            **values,
         }
         if metadata:
             vals['metadata'] = json.dumps(metadata) if isinstance(metadata, dict) else metadata
         
         return self.create(vals)
+
+    @api.model
+    def provisioning_stats(self, group_by='hypervisor_server_id', days=30):
+        """
+        Перцентили длительности успешных этапов провижининга за days дней.
+        Возвращает [{group_by: id, 'stage', 'count', 'p50', 'p95'}]; этап 'done' - время до готовности VM.
+        """
+        if group_by not in ('hypervisor_server_id', 'hypervisor_template_id', 'hypervisor_storage_id'):
+            raise ValueError(f"Cannot group provisioning stats by {group_by}")
+        self.env.cr.execute(f"""
+            SELECT {group_by}, stage, count(*),
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY duration),
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY duration)
+              FROM {self._table}
+             WHERE action IN ('provision_stage', 'provision') AND success AND duration IS NOT NULL
+               AND create_date >= (now() AT TIME ZONE 'UTC') - %s * interval '1 day'
+             GROUP BY {group_by}, stage
+        """, (days,))
+        return [{group_by: group_id, 'stage': stage, 'count': count, 'p50': p50, 'p95': p95}
+                for group_id, stage, count, p50, p95 in self.env.cr.fetchall()]
@@ -0,0 +1,304 @@
+# vm_rental/models/vm_provision_job.py
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from odoo import models, fields, api, _
+from ..services.circuit_breaker import circuit_breaker
+from ..services.deadline import deadline_scope
+import logging
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class VmProvisionJob(models.Model):
+    """
+    Очередь провижининга VM. Задания забираются воркерами через
+    SELECT ... FOR UPDATE SKIP LOCKED, каждое выполняется и фиксируется
+    в своей транзакции, поэтому медленный клон не задерживает остальных,
+    а падение воркера не откатывает уже выполненные задания.
+
+    Число одновременных заданий ограничено на сервер и на хранилище;
+    асинхронный провижининг (цепочка hypervisor.task) занимает слот
+    до завершения последнего шага.
+    """
+    _name = 'vm_rental.provision_job'
+    _description = 'VM Provisioning Job'
+    _order = 'priority desc, id'
+    _rec_name = 'vm_id'
+
+    # Запас аренды сверх operation_timeout сервера, сек.: после истечения задание считается брошенным
+    LEASE_MARGIN = 300
+    # Пауза между попытками захвата, пока в очереди есть задания, ждущие слота, сек.
+    CLAIM_BACKOFF = 1
+    CLAIM_BACKOFF_MAX = 10
+    # Пространство ключей pg_try_advisory_xact_lock для захвата слотов сервера
+    CLAIM_LOCK_SPACE = 0x564D52  # 'VMR'
+    ACTIVE_STATES = ('running', 'provisioning')
+
+    vm_id = fields.Many2one('vm_rental.machine', string="VM", required=True, ondelete='cascade', index=True,
+                            readonly=True)
+    server_id = fields.Many2one('hypervisor.server', string="Server", required=True, ondelete='cascade',
+                                index=True, readonly=True)
+    storage_id = fields.Many2one('hypervisor.storage', string="Storage", ondelete='set null', readonly=True)
+    priority = fields.Integer(string="Priority", default=0, help="Jobs with a higher priority are claimed first.")
+    state = fields.Selection([
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('provisioning', 'Provisioning'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ], string="State", default='queued', required=True, index=True, readonly=True)
+    attempts = fields.Integer(string="Attempts", default=0, readonly=True)
+    max_attempts = fields.Integer(string="Max Attempts", default=3,
+                                  help="How many times a job abandoned by a crashed worker is requeued.")
+    next_run_at = fields.Datetime(string="Not Before", default=fields.Datetime.now, index=True, readonly=True)
+    lease_until = fields.Datetime(string="Lease Until", readonly=True)
+    started_at = fields.Datetime(string="Started", readonly=True)
+    finished_at = fields.Datetime(string="Finished", readonly=True)
+    duration = fields.Float(string="Duration (seconds)", compute='_compute_duration', digits=(10, 1))
+    error_message = fields.Text(string="Error Message", readonly=True)
+
+    @api.depends('started_at', 'finished_at')
+    def _compute_duration(self):
+        for job in self:
+            if job.started_at and job.finished_at:
+                job.duration = (job.finished_at - job.started_at).total_seconds()
+            else:
+                job.duration = 0.0
+
+    # === Постановка в очередь ===
+
+    @api.model
+    def enqueue(self, vms, priority=0):
+        """Ставит VM в очередь (не более одного активного задания на VM) и будит обработчик"""
+        active = self.search([('vm_id', 'in', vms.ids), ('state', 'in', ('queued',) + self.ACTIVE_STATES)])
+        queued_vm_ids = set(active.mapped('vm_id').ids)
+        jobs = self.create([{
+            'vm_id': vm.id,
+            'server_id': vm.hypervisor_server_id.id,
+            'storage_id': vm.hypervisor_storage_id.id,
+            'priority': priority,
+        } for vm in vms if vm.id not in queued_vm_ids and vm.hypervisor_server_id])
+        if jobs:
+            self._trigger_worker()
+        return jobs
+
+    @api.model
+    def _trigger_worker(self):
+        cron = self.env.ref('vm_rental.cron_process_provision_queue', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+
+    def action_cancel(self):
+        self.filtered(lambda j: j.state == 'queued').write({
+            'state': 'cancelled',
+            'finished_at': fields.Datetime.now(),
+        })
+
+    # === Обработка ===
+
+    @api.model
+    def _cron_process_queue(self, max_runtime=50, workers=None):
+        """
+        Обрабатывает очередь max_runtime секунд в нескольких потоках, у каждого
+        свой курсор. Число потоков - параметр vm_rental.provision_workers.
+        """
+        if workers is None:
+            workers = int(self.env['ir.config_parameter'].sudo().get_param('vm_rental.provision_workers', 2))
+        self._requeue_abandoned()
+        if getattr(threading.current_thread(), 'testing', False) or workers <= 1:
+            return self._process_queue(max_runtime)
+
+        threads = [
+            threading.Thread(target=self._worker_thread, args=(max_runtime,),
+                             name=f'vm_rental.provision_{n}', daemon=True)
+            for n in range(1, workers)
+        ]
+        for thread in threads:
+            thread.start()
+        processed = self._process_queue(max_runtime)
+        for thread in threads:
+            thread.join(max_runtime + self.LEASE_MARGIN)
+        return processed
+
+    def _worker_thread(self, max_runtime):
+        threading.current_thread().dbname = self.env.cr.dbname
+        try:
+            with self.pool.cursor() as cr:
+                env = api.Environment(cr, self.env.uid, self.env.context)
+                env[self._name]._process_queue(max_runtime)
+        except Exception as e:
+            _logger.error(f"Provisioning worker {threading.current_thread().name} failed: {e}", exc_info=True)
+
+    @api.model
+    def _process_queue(self, max_runtime):
+        """Забирает и выполняет задания по одному, пока очередь не пуста или не истекло время"""
+        deadline = time.monotonic() + max_runtime
+        processed = 0
+        backoff = self.CLAIM_BACKOFF
+        while time.monotonic() < deadline:
+            job = self._claim_next()
+            if not job:
+                if getattr(threading.current_thread(), 'testing', False) or not self._has_due_jobs():
+                    break
+                # Задания ждут слота или сервер захватывает другой воркер - повторяем позже
+                time.sleep(min(backoff, max(deadline - time.monotonic(), 0)))
+                backoff = min(backoff * 2, self.CLAIM_BACKOFF_MAX)
+                continue
+            backoff = self.CLAIM_BACKOFF
+            try:
+                job._run()
+            except Exception as e:
+                # Транзакция испорчена; задание вернется в очередь по истечении аренды
+                _logger.error(f"Provisioning job {job.id} crashed: {e}", exc_info=True)
+                if getattr(threading.current_thread(), 'testing', False):
+                    raise
+                self.env.cr.rollback()
+            processed += 1
+        return processed
+
+    @api.model
+    def _has_due_jobs(self):
+        return bool(self.search([('state', '=', 'queued'), ('next_run_at', '<=', fields.Datetime.now())], limit=1))
+
+    def _auto_commit(self):
+        if not getattr(threading.current_thread(), 'testing', False):
+            self.env.cr.commit()
+
+    @api.model
+    def _claim_next(self):
+        """
+        Захватывает одно задание с учетом лимитов сервера и хранилища.
+        Блокируется только выбранная строка (LIMIT 1 FOR UPDATE SKIP LOCKED): задания
+        серверов и хранилищ без свободных слотов отсекаются в самом запросе, чужие захваты
+        пропускаются без ожидания. Подсчет занятых слотов сервера сериализуется
+        транзакционной advisory-блокировкой; сервер, который сейчас захватывает другой
+        воркер (или с открытым circuit breaker), пропускается до следующей попытки.
+        """
+        cr = self.env.cr
+        self.env.flush_all()
+        skipped_servers = [0]
+        while True:
+            cr.execute("SAVEPOINT provision_claim")
+            cr.execute(f"""
+                SELECT job.id, job.server_id
+                  FROM {self._table} job
+                  JOIN hypervisor_server server ON server.id = job.server_id
+                  LEFT JOIN hypervisor_storage storage ON storage.id = job.storage_id
+                 WHERE job.state = 'queued' AND job.next_run_at <= %(now)s
+                   AND job.server_id NOT IN %(skipped)s
+                   AND (COALESCE(server.max_parallel_provisioning, 0) = 0
+                        OR server.max_parallel_provisioning > (
+                            SELECT count(*) FROM {self._table} busy
+                             WHERE busy.server_id = job.server_id AND busy.state IN %(active)s))
+                   AND (COALESCE(storage.max_parallel_provisioning, 0) = 0
+                        OR storage.max_parallel_provisioning > (
+                            SELECT count(*) FROM {self._table} busy
+                             WHERE busy.storage_id = job.storage_id AND busy.state IN %(active)s))
+                 ORDER BY job.priority DESC, job.id
+                 LIMIT 1
+                 FOR UPDATE OF job SKIP LOCKED
+            """, {'now': fields.Datetime.now(), 'skipped': tuple(skipped_servers), 'active': self.ACTIVE_STATES})
+            row = cr.fetchone()
+            if not row:
+                cr.execute("RELEASE SAVEPOINT provision_claim")
+                # Снимаем advisory-блокировки пропущенных серверов
+                self._auto_commit()
+                return self.browse()
+
+            job_id, server_id = row
+            allowed, _retry_in = circuit_breaker.check((cr.dbname, server_id))
+            locked = False
+            if allowed:
+                cr.execute("SELECT pg_try_advisory_xact_lock(%s, %s)", (self.CLAIM_LOCK_SPACE, server_id))
+                locked = cr.fetchone()[0]
+            if not locked:
+                # Откат к точке сохранения снимает блокировку строки - задание достанется другим
+                cr.execute("ROLLBACK TO SAVEPOINT provision_claim")
+                skipped_servers.append(server_id)
+                continue
+            cr.execute("RELEASE SAVEPOINT provision_claim")
+
+            job = self.browse(job_id)
+            job.write({
+                'state': 'running',
+                'attempts': job.attempts + 1,
+                'started_at': fields.Datetime.now(),
+                'lease_until': fields.Datetime.now() + timedelta(
+                    seconds=(job.server_id.operation_timeout or 0) + self.LEASE_MARGIN),
+                'error_message': False,
+            })
+            # Захват фиксируется сразу: остальные воркеры видят занятый слот
+            self._auto_commit()
+            return job
+
+    def _run(self):
+        """Выполняет провижининг VM задания и фиксирует результат в своей транзакции"""
+        self.ensure_one()
+        vm = self.vm_id
+        if vm.state != 'pending':
+            self.write({'state': 'cancelled', 'finished_at': fields.Datetime.now(),
+                        'error_message': _("VM is in state %s, not pending") % vm.state})
+            self._auto_commit()
+            return
+
+        _logger.info(f"Provisioning job {self.id}: VM {vm.name} on {self.server_id.name}")
+        try:
+            with deadline_scope(self.server_id.operation_timeout):
+                vm.action_provision_vm()
+        except Exception as e:
+            # action_provision_vm уже перевел VM в failed и оставил сообщение
+            _logger.error(f"Provisioning job {self.id} for VM {vm.name} failed: {e}")
+            self._mark_finished(str(e))
+        else:
+            if vm.state == 'provisioning':
+                # Дальнейшие шаги идут через hypervisor.task, слот остается занят
+                # (на хранилище, выбранном размещением)
+                self.write({'state': 'provisioning', 'lease_until': False,
+                            'storage_id': vm.hypervisor_storage_id.id})
+            else:
+                self._mark_finished()
+        self._auto_commit()
+
+    def _mark_finished(self, error=None):
+        self.write({
+            'state': 'failed' if error else 'done',
+            'finished_at': fields.Datetime.now(),
+            'lease_until': False,
+            'error_message': error or False,
+        })
+
+    @api.model
+    def _on_vm_provisioned(self, vm, error=None):
+        """Завершение асинхронного провижининга VM: освобождает слот и будит обработчик"""
+        jobs = self.search([('vm_id', '=', vm.id), ('state', 'in', self.ACTIVE_STATES)])
+        if jobs:
+            jobs._mark_finished(error)
+            self._trigger_worker()
+
+    @api.model
+    def _requeue_abandoned(self):
+        """
+        Задания воркеров, не вернувшихся до конца аренды, возвращаются в очередь;
+        асинхронные задания, VM которых уже вышла из provisioning, завершаются.
+        """
+        stale = self.search([('state', '=', 'provisioning'), ('vm_id.state', '!=', 'provisioning')])
+        for job in stale:
+            job._mark_finished(None if job.vm_id.state == 'active' else _("Provisioning did not complete"))
+
+        abandoned = self.search([('state', '=', 'running'), ('lease_until', '<', fields.Datetime.now())])
+        for job in abandoned:
+            if job.vm_id.state == 'pending' and job.attempts < job.max_attempts:
+                _logger.warning(f"Provisioning job {job.id} for VM {job.vm_id.name} was abandoned, requeueing")
+                job.write({
+                    'state': 'queued',
+                    'lease_until': False,
+                    'next_run_at': fields.Datetime.now(),
+                    'error_message': _("Worker did not finish within its lease, requeued"),
+                })
+            else:
+                job._mark_finished(_("Worker did not finish within its lease"))
+        if stale or abandoned:
+            self._auto_commit()
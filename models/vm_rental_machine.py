@@ -4,7 +4,10 @@ from odoo.tools import ormcache
 from dateutil.relativedelta import relativedelta
 from functools import wraps
 from .vm_traits import VmResourceTrait, VmOperationTrait
-import logging, uuid, time
+from .vm_audit_log import PROVISION_STAGES
+from ..services.deadline import deadline_scope
+from ..services.drivers import CAP_ASYNC_PROVISIONING, CAP_CONTAINERS, CAP_SNAPSHOTS, CAP_LXC_SNAPSHOTS, CAP_VMIDS
+import logging, uuid
 
 _logger = logging.getLogger(__name__)
 
@@ -44,6 +47,7 @@ class VmInstance(models.Model):
 
     state = fields.Selection([
         ('pending', 'Draft'),
+        ('provisioning', 'Provisioning'),
         ('active', 'Active'),
         ('stopped', 'Stopped'),
         ('suspended', 'Suspended'),
@@ -61,12 +65,30 @@ class VmInstance(models.Model):
     hypervisor_node_id = fields.Many2one('hypervisor.node', string="Node/Cluster")
     hypervisor_storage_id = fields.Many2one('hypervisor.storage', string="Storage/Datastore")
     hypervisor_template_id = fields.Many2one('hypervisor.template', string="Template")
+    clone_mode = fields.Selection([
+        ('template', 'As Template'),
+        ('full', 'Full Clone'),
+        ('linked', 'Linked Clone'),
+    ], string="Clone Mode", default='template')
+    provisioned_clone_mode = fields.Selection([
+        ('full', 'Full Clone'),
+        ('linked', 'Linked Clone'),
+    ], string="Cloned As", readonly=True, copy=False)
+    warm_pool_id = fields.Many2one('vm_rental.warm_pool', string="Warm Pool", readonly=True, copy=False,
+                                   ondelete='set null', index=True)
+    warm_guest_id = fields.Many2one('vm_rental.warm_pool.guest', string="Warm Pool Guest", readonly=True,
+                                    copy=False, ondelete='set null')
+    # Текущий (или последний, на котором произошла ошибка) этап провижининга
+    provision_stage = fields.Selection(PROVISION_STAGES, string="Provisioning Stage", readonly=True, copy=False)
+    provision_started_at = fields.Datetime(string="Provisioning Started", readonly=True, copy=False)
+    provision_stage_started_at = fields.Datetime(string="Stage Started", readonly=True, copy=False)
 
     is_trial = fields.Boolean(string="Is Trial Period", readonly=True, default=False)
 
     # Связанные записи
     sale_order_ids = fields.One2many('sale.order', 'vm_instance_id', string="Sale Orders")
     snapshot_ids = fields.One2many('vm.snapshot', 'vm_instance_id', string="Snapshots")
+    hypervisor_task_ids = fields.One2many('hypervisor.task', 'vm_id', string="Hypervisor Tasks")
     config_backup_ids = fields.One2many('vm_rental.config_backup', 'vm_id', string="Configuration Backups")
 
     company_id = fields.Many2one('res.company', string='Company', default=lambda self: self.env.company)
@@ -153,7 +175,18 @@ class VmInstance(models.Model):
         self.ensure_one()
         if not self.hypervisor_server_id:
             raise UserError(_("Hypervisor server is not configured for this VM."))
-        return self.hypervisor_server_id._get_service_manager()
+        service = self.hypervisor_server_id._get_service_manager()
+        # Известный тип гостя избавляет сервис от лишних запросов для его определения
+        service.set_vm_type_hint(self.hypervisor_vm_ref, self.vm_type)
+        return service
+
+    def _can_snapshot(self):
+        """Снапшоты гостя поддерживаются драйвером (проверка без обращения к API)"""
+        self.ensure_one()
+        server = self.hypervisor_server_id.sudo()
+        if not server or not server.has_capability(CAP_SNAPSHOTS):
+            return False
+        return self.vm_type != 'lxc' or server.has_capability(CAP_LXC_SNAPSHOTS)
 
     # === Computed Fields для кнопок ===
 
@@ -376,7 +409,10 @@ class VmInstance(models.Model):
 
     @api.model
     def auto_provision_pending_vms(self):
-        """Автоматически создает pending VMs (для cron)"""
+        """
+        Ставит pending VMs в очередь провижининга (для cron). Сам провижининг
+        выполняют воркеры vm_rental.provision_job параллельно, каждую VM в своей транзакции.
+        """
         pending_vms = self.search([
             ('state', '=', 'pending'),
             ('hypervisor_server_id', '!=', False),
@@ -385,25 +421,11 @@ class VmInstance(models.Model):
             ('hypervisor_template_id', '!=', False),
         ])
 
-        success_count = 0
-        error_count = 0
-
-        for vm in pending_vms:
-            try:
-                vm.action_provision_vm()
-                success_count += 1
-            except Exception as e:
-                _logger.error(f"Auto-provision failed for VM {vm.name}: {e}")
-                vm.message_post(
-                    body=_("Auto-provision failed: %s") % str(e),
-                    message_type='notification'
-                )
-                error_count += 1
-
-        if success_count or error_count:
-            _logger.info(f"Auto-provision completed: {success_count} success, {error_count} errors")
+        jobs = self.env['vm_rental.provision_job'].enqueue(pending_vms)
+        if jobs:
+            _logger.info(f"Auto-provision: {len(jobs)} VMs queued for provisioning")
 
-        return {'success': success_count, 'errors': error_count}
+        return {'queued': len(jobs)}
 
     @api.model
     def cleanup_terminated_vms(self, days_old=30):
@@ -636,15 +658,41 @@ class VmInstance(models.Model):
                     self.hypervisor_storage_id, self.hypervisor_template_id]):
             raise UserError(_("Please configure all hypervisor settings before provisioning"))
 
+        server = self.hypervisor_server_id
+        vm_id = None
+        self.write({
+            'provision_started_at': fields.Datetime.now(),
+            'provision_stage': False,
+            'provision_stage_started_at': False,
+        })
         try:
             service = self._get_hypervisor_service()
 
-            # Получаем следующий доступный ID
-            vm_id = service.get_next_vmid()
-            if not vm_id:
-                vm_id = str(int(time.time()))  # Fallback ID
+            if self.warm_guest_id:
+                # Гость уже склонирован теплым пулом
+                return self._provision_from_warm_guest(service)
+
+            if server.placement_policy != 'static':
+                # Нода и хранилище выбираются по текущей емкости сервера
+                self._enter_provision_stage('placement')
+                self.env['hypervisor.placement'].sudo().place(self, service)
+
+            self._enter_provision_stage('allocate_id')
+            if server.has_capability(CAP_VMIDS):
+                # VMID резервируется локально: параллельные задания не получат один номер
+                vm_id = str(self.env['hypervisor.vmid.reservation'].sudo().allocate(server))
+            else:
+                # ID назначает гипервизор при создании
+                vm_id = service.get_next_vmid()
+
+            linked = self._resolve_clone_mode(service) == 'linked'
 
-            # Создаем VM на гипервизоре
+            self._enter_provision_stage('clone')
+            if server.has_capability(CAP_ASYNC_PROVISIONING):
+                # Клонирование идет в фоне, дальнейшие шаги запускает hypervisor.task
+                return self._start_async_provisioning(service, vm_id, linked)
+
+            # Драйверы без фоновых задач (VMware) создают VM одним вызовом
             task_result = service.create_vm(
                 node=self.hypervisor_node_id.name,
                 vm_id=vm_id,
@@ -653,24 +701,18 @@ class VmInstance(models.Model):
                 cores=self.cores,
                 memory=self.memory,
                 disk=self.disk,
-                storage=self.hypervisor_storage_id.name
+                storage=self.hypervisor_storage_id.name,
+                linked=linked,
             )
 
             if task_result:
-                # Обновляем запись VM
                 self.write({
-                    'state': 'active',
-                    'hypervisor_vm_ref': vm_id,
+                    'hypervisor_vm_ref': vm_id if server.has_capability(CAP_VMIDS) else task_result,
                     'hypervisor_node_name': self.hypervisor_node_id.name,
-                    'start_date': fields.Date.today(),
-                    'end_date': fields.Date.today() + relativedelta(months=1),
+                    'vm_type': self._get_provisioned_vm_type(),
+                    'provisioned_clone_mode': 'linked' if linked else 'full',
                 })
-
-                self.message_post(
-                    body=_("VM successfully provisioned with ID: %s") % vm_id,
-                    message_type='notification'
-                )
-
+                self._finish_provisioning()
                 return True
             else:
                 self.write({'state': 'failed'})
@@ -678,12 +720,223 @@ class VmInstance(models.Model):
 
         except Exception as e:
             self.write({'state': 'failed'})
+            self._log_provision_failure(e)
+            if vm_id and server.has_capability(CAP_VMIDS):
+                self.env['hypervisor.vmid.reservation'].sudo().release(server, vm_id)
             self.message_post(
                 body=_("VM provisioning failed: %s") % str(e),
                 message_type='notification'
             )
             raise UserError(_("VM provisioning failed: %s") % str(e))
 
+    def _start_async_provisioning(self, service, vm_id, linked=False):
+        """Запускает клонирование и ставит задачу на отслеживание"""
+        self.ensure_one()
+        node = self.hypervisor_node_id.name
+        # Реплика шаблона на целевом хранилище избавляет от копирования диска между хранилищами
+        source_node, source_vmid = self.hypervisor_template_id._clone_source(node, self.hypervisor_storage_id.name)
+        upid = service.clone_vm(
+            node=node,
+            vm_id=vm_id,
+            name=self.name,
+            template_vmid=source_vmid,
+            storage=self.hypervisor_storage_id.name,
+            linked=linked,
+            source_node=source_node,
+        )
+        if not upid:
+            raise UserError(_("Hypervisor did not return a clone task"))
+
+        # Клон запущен: состояние и задача фиксируются первыми, иначе гость останется
+        # на гипервизоре без учета; дальнейшие ошибки провижининг не прерывают
+        self.write({
+            'state': 'provisioning',
+            'hypervisor_vm_ref': vm_id,
+            'hypervisor_node_name': node,
+            'vm_type': self._get_provisioned_vm_type(),
+            'provisioned_clone_mode': 'linked' if linked else 'full',
+        })
+        self.env['hypervisor.task'].track(
+            self.hypervisor_server_id, upid, 'clone', node=node, vm=self, callback='_on_provision_cloned'
+        )
+        try:
+            with self.env.cr.savepoint():
+                self.message_post(
+                    body=_("VM cloning started with ID: %s") % vm_id,
+                    message_type='notification'
+                )
+        except Exception as e:
+            _logger.warning(f"VM {self.name}: could not post clone notification: {e}")
+        return True
+
+    def _provision_from_warm_guest(self, service):
+        """Гость из теплого пула: переименование и ресурсы, затем диск и запуск (без клонирования)"""
+        self.ensure_one()
+        guest = self.warm_guest_id
+        self.write({
+            'state': 'provisioning',
+            'hypervisor_vm_ref': guest.vmid,
+            'hypervisor_node_name': guest.node,
+            'vm_type': self._get_provisioned_vm_type(),
+            'provisioned_clone_mode': guest.clone_mode,
+        })
+        self._enter_provision_stage('configure')
+        upid = service.configure_vm(guest.node, guest.vmid, self.cores, self.memory, name=self.name)
+        self.message_post(
+            body=_("VM bound to pre-provisioned guest %s from warm pool %s") % (guest.vmid, guest.pool_id.name),
+            message_type='notification'
+        )
+        self._chain_provision_step(upid, 'config', '_on_provision_configured')
+        return True
+
+    def _chain_provision_step(self, upid, operation, callback):
+        """Ставит следующий шаг в очередь или сразу вызывает его, если операция была синхронной"""
+        self.ensure_one()
+        if upid:
+            self.env['hypervisor.task'].track(
+                self.hypervisor_server_id, upid, operation,
+                node=self.hypervisor_node_name, vm=self, callback=callback
+            )
+        else:
+            getattr(self, callback)(self.env['hypervisor.task'])
+
+    def _on_provision_cloned(self, task):
+        """Клон готов - задаем CPU и память"""
+        if task and task.state == 'failed':
+            return self._fail_provisioning(_("Clone task failed: %s") % task.exitstatus)
+        self._enter_provision_stage('configure')
+        try:
+            service = self._get_hypervisor_service()
+            upid = service.configure_vm(self.hypervisor_node_name, self.hypervisor_vm_ref, self.cores, self.memory)
+        except Exception as e:
+            return self._fail_provisioning(str(e))
+        self._chain_provision_step(upid, 'config', '_on_provision_configured')
+
+    def _on_provision_configured(self, task):
+        """Конфигурация применена - увеличиваем диск"""
+        if task and task.state == 'failed':
+            return self._fail_provisioning(_("Configuration task failed: %s") % task.exitstatus)
+        self._enter_provision_stage('resize')
+        try:
+            service = self._get_hypervisor_service()
+            upid = service.resize_disk(self.hypervisor_node_name, self.hypervisor_vm_ref, self.disk)
+        except Exception as e:
+            return self._fail_provisioning(str(e))
+        self._chain_provision_step(upid, 'resize', '_on_provision_resized')
+
+    def _on_provision_resized(self, task):
+        if task and task.state == 'failed':
+            return self._fail_provisioning(_("Disk resize task failed: %s") % task.exitstatus)
+        if self.warm_guest_id:
+            # Заказ уже оплачен - гость из пула сразу запускается
+            self._enter_provision_stage('start')
+            try:
+                upid = self._get_hypervisor_service().start_vm(self.hypervisor_node_name, self.hypervisor_vm_ref)
+            except Exception as e:
+                return self._fail_provisioning(str(e))
+            return self._chain_provision_step(upid, 'start', '_on_provision_started')
+        self._finish_provisioning()
+
+    def _on_provision_started(self, task):
+        if task and task.state == 'failed':
+            return self._fail_provisioning(_("Start task failed: %s") % task.exitstatus)
+        self._finish_provisioning()
+
+    def _finish_provisioning(self):
+        self.ensure_one()
+        self._enter_provision_stage('done')
+        self._log_provision('provision', self.provision_started_at)
+        self.write({
+            'state': 'active',
+            'start_date': fields.Date.today(),
+            'end_date': fields.Date.today() + relativedelta(months=1),
+        })
+        if self.hypervisor_server_id.has_capability(CAP_VMIDS):
+            self.env['hypervisor.vmid.reservation'].sudo().mark_in_use(self.hypervisor_server_id,
+                                                                      self.hypervisor_vm_ref)
+        self.env['vm_rental.provision_job'].sudo()._on_vm_provisioned(self)
+        self.message_post(
+            body=_("VM successfully provisioned with ID: %s") % self.hypervisor_vm_ref,
+            message_type='notification'
+        )
+
+    def _on_task_callback_failed(self, task, error):
+        """Шаг цепочки упал с исключением - VM не должна навсегда остаться в provisioning"""
+        if self.state == 'provisioning':
+            self._fail_provisioning(_("Follow-up step failed: %s") % error)
+
+    def _fail_provisioning(self, error):
+        self.ensure_one()
+        _logger.error(f"Provisioning of VM {self.name} failed: {error}")
+        self.write({'state': 'failed'})
+        self._log_provision_failure(error)
+        if self.hypervisor_server_id.has_capability(CAP_VMIDS):
+            self.env['hypervisor.vmid.reservation'].sudo().release(self.hypervisor_server_id,
+                                                                  self.hypervisor_vm_ref)
+        self.env['vm_rental.provision_job'].sudo()._on_vm_provisioned(self, error=str(error))
+        self.message_post(
+            body=_("VM provisioning failed: %s") % error,
+            message_type='notification'
+        )
+
+    # === Этапы провижининга ===
+
+    def _enter_provision_stage(self, stage):
+        """Завершает текущий этап провижининга (запись в журнал аудита) и начинает следующий"""
+        self.ensure_one()
+        if self.provision_stage:
+            self._log_provision('provision_stage', self.provision_stage_started_at)
+        self.write({'provision_stage': stage, 'provision_stage_started_at': fields.Datetime.now()})
+
+    def _log_provision_failure(self, error):
+        """Этап, на котором провижининг прервался, и весь провижининг - в журнал как неудачные"""
+        self.ensure_one()
+        if self.provision_stage:
+            self._log_provision('provision_stage', self.provision_stage_started_at, error=error)
+        self._log_provision('provision', self.provision_started_at, error=error)
+
+    def _log_provision(self, action, started_at, error=None):
+        now = fields.Datetime.now()
+        self.env['vm_rental.audit_log'].sudo().log_action(
+            vm_id=self.id,
+            action=action,
+            success=error is None,
+            error_message=str(error) if error is not None else None,
+            duration=(now - started_at).total_seconds() if started_at else None,
+            metadata={'node': self.hypervisor_node_id.name, 'clone_mode': self.provisioned_clone_mode or None,
+                      'warm_pool': bool(self.warm_guest_id)},
+            stage=self.provision_stage or False,
+            started_at=started_at,
+            hypervisor_server_id=self.hypervisor_server_id.id,
+            hypervisor_template_id=self.hypervisor_template_id.id,
+            hypervisor_storage_id=self.hypervisor_storage_id.id,
+        )
+
+    def _resolve_clone_mode(self, service):
+        """
+        Режим клонирования для провижининга: связанный клон, если он запрошен (в VM или
+        шаблоне) и возможен на целевом хранилище, иначе полный.
+        """
+        self.ensure_one()
+        template = self.hypervisor_template_id
+        mode = template._resolve_clone_mode(service, self.clone_mode, self.hypervisor_node_id.name,
+                                            self.hypervisor_storage_id.name,
+                                            cores=self.cores, memory=self.memory, disk=self.disk)
+        if mode == 'full' and template._wants_linked_clone(self.clone_mode):
+            self.message_post(
+                body=_("Linked clone of template %s is not possible on storage %s with this disk size, "
+                       "using a full clone") % (template.name, self.hypervisor_storage_id.name),
+                message_type='notification'
+            )
+        return mode
+
+    def _get_provisioned_vm_type(self):
+        """Тип гостя, который получится при провижининге из выбранного шаблона"""
+        self.ensure_one()
+        if not self.hypervisor_server_id.has_capability(CAP_CONTAINERS):
+            return 'vm'
+        return self.hypervisor_template_id.template_type or 'qemu'
+
     def action_retry_provisioning(self):
         """Повторная попытка провижининга"""
         self.ensure_one()
@@ -716,6 +969,75 @@ class VmInstance(models.Model):
             )
             self.write({'state': 'terminated'})
 
+    def _group_by_hypervisor_server(self):
+        """VM, привязанные к гипервизору, сгруппированные по серверу: {server: recordset}"""
+        groups = {}
+        for vm in self:
+            if vm.hypervisor_server_id and vm.hypervisor_vm_ref:
+                groups[vm.hypervisor_server_id] = groups.get(vm.hypervisor_server_id, self.browse()) | vm
+        return groups
+
+    # Групповое действие -> (метод сервиса, состояние VM после успеха)
+    BULK_POWER_ACTIONS = {
+        'start': ('start_many', 'active'),
+        'stop': ('stop_many', 'stopped'),
+        'suspend': ('suspend_many', 'suspended'),
+        'delete': ('delete_many', 'terminated'),
+    }
+
+    def _bulk_power_action(self, action):
+        """
+        Групповое действие с VM: один вызов start_many/stop_many/suspend_many/delete_many
+        на каждый гипервизор вместо отдельного вызова на каждую VM. Состояние
+        записывается только успешным VM; удаление, как action_terminate_vm,
+        помечает VM terminated в любом случае.
+
+        Returns:
+            dict: id VM -> текст ошибки или None при успехе
+        """
+        method, new_state = self.BULK_POWER_ACTIONS[action]
+        errors = {}
+        for vm in self.filtered(lambda vm: not vm.hypervisor_server_id or not vm.hypervisor_vm_ref):
+            # Для удаления: гостя на гипервизоре нет - удалять нечего
+            errors[vm.id] = None if action == 'delete' else _("VM is not linked to a hypervisor")
+
+        for server, vms in self._group_by_hypervisor_server().items():
+            server_error = None
+            try:
+                # Зависший гипервизор не должен задерживать остальные серверы
+                with deadline_scope(server.operation_timeout):
+                    service = server._get_service_manager()
+                    for vm in vms:
+                        service.set_vm_type_hint(vm.hypervisor_vm_ref, vm.vm_type)
+                    results = getattr(service, method)(
+                        [(vm.hypervisor_node_name, vm.hypervisor_vm_ref) for vm in vms])
+            except Exception as e:
+                _logger.error(f"Bulk {action} of {len(vms)} VMs on {server.name} failed: {e}")
+                server_error = str(e)
+                results = {}
+            for vm in vms:
+                result = results.get(str(vm.hypervisor_vm_ref))
+                if result is None:
+                    errors[vm.id] = server_error or _("No result from hypervisor")
+                else:
+                    errors[vm.id] = None if result['success'] else result['error']
+
+        succeeded = self.filtered(lambda vm: errors[vm.id] is None)
+        if action != 'delete':
+            succeeded.write({'state': new_state})
+            return errors
+
+        self.write({'state': new_state})
+        for vm in self:
+            if errors[vm.id] is None:
+                vm.message_post(body=_("VM terminated and removed from hypervisor"), message_type='notification')
+            else:
+                vm.message_post(
+                    body=_("VM terminated in Odoo but may still exist on hypervisor: %s") % errors[vm.id],
+                    message_type='notification'
+                )
+        return errors
+
     def extend_period(self, months=1):
         """Продление периода подписки"""
         self.ensure_one()
@@ -749,6 +1071,7 @@ class VmInstance(models.Model):
             'hypervisor_node_id': product.hypervisor_node_id.id if product.hypervisor_node_id else False,
             'hypervisor_storage_id': product.hypervisor_storage_id.id if product.hypervisor_storage_id else False,
             'hypervisor_template_id': product.hypervisor_template_id.id if product.hypervisor_template_id else False,
+            'clone_mode': product.vm_clone_mode or 'template',
             'cores': vm_config.get('cores', 1),
             'memory': vm_config.get('memory', 1024),
             'disk': vm_config.get('disk', 10),
@@ -761,6 +1084,10 @@ class VmInstance(models.Model):
         # Привязываем к заказу
         order.write({'vm_instance_id': vm.id})
 
+        # Готовый гость из теплого пула - провижининг без клонирования, первым в очереди
+        if self.env['vm_rental.warm_pool'].sudo()._bind_warm_guest(vm, product.product_tmpl_id):
+            self.env['vm_rental.provision_job'].sudo().enqueue(vm, priority=10)
+
         _logger.info(f"Created VM {vm.name} for order {order.name}")
         return vm
 
@@ -773,19 +1100,19 @@ class VmInstance(models.Model):
             ('end_date', '<', today)
         ])
 
+        # Один групповой вызов на гипервизор вместо suspend_vm для каждой VM
+        errors = expired_vms._bulk_power_action('suspend')
+        template = self.env.ref('vm_rental.mail_vm_expired', raise_if_not_found=False)
         for vm in expired_vms:
-            try:
-                service = vm._get_hypervisor_service()
-                service.suspend_vm(vm.hypervisor_node_name, vm.hypervisor_vm_ref)
-                vm.write({'state': 'suspended'})
-
-                # Отправляем уведомление
-                template = self.env.ref('vm_rental.mail_vm_expired', raise_if_not_found=False)
-                if template:
+            if errors[vm.id]:
+                _logger.error(f"Failed to suspend expired VM {vm.name}: {errors[vm.id]}")
+                continue
+            # Отправляем уведомление
+            if template:
+                try:
                     template.send_mail(vm.id, force_send=True)
-
-            except Exception as e:
-                _logger.error(f"Failed to suspend expired VM {vm.name}: {e}")
+                except Exception as e:
+                    _logger.error(f"Failed to notify about expired VM {vm.name}: {e}")
 
     def action_linking_job(self):
         """Действие для создания задания привязки VM"""
@@ -799,46 +1126,58 @@ class VmInstance(models.Model):
         }
 
     def update_resources_from_hypervisor(self):
-        """Обновляет ресурсы VM из конфигурации гипервизора"""
-        self.ensure_one()
-
-        if not self.hypervisor_server_id or not self.hypervisor_vm_ref:
-            raise UserError(_("VM is not linked to hypervisor"))
-
-        try:
-            service = self._get_hypervisor_service()
-
-            if self.hypervisor_server_id.hypervisor_type == 'proxmox':
-                vm_config = service.get_vm_config(self.hypervisor_node_name, self.hypervisor_vm_ref)
-            else:  # VMware
-                vm_config = service.get_vm_config(self.hypervisor_vm_ref)
-
-            old_summary = self.get_vm_resource_summary()
-
-            self.write({
-                'cores': vm_config['cores'],
-                'memory': vm_config['memory'],
-                'disk': vm_config['disk'],
-            })
+        """
+        Обновляет ресурсы VM из конфигурации гипервизора.
+        Для нескольких VM - один get_vm_configs на сервер, а не запрос на каждую VM.
+        """
+        unlinked = self.filtered(lambda vm: not vm.hypervisor_server_id or not vm.hypervisor_vm_ref)
+        if unlinked:
+            raise UserError(_("VM is not linked to hypervisor: %s") % ', '.join(unlinked.mapped('name')))
 
-            new_summary = self.get_vm_resource_summary()
+        missing = self.browse()
+        new_summary = ''
+        for server, vms in self._group_by_hypervisor_server().items():
+            try:
+                service = server._get_service_manager()
+                configs = service.get_vm_configs([(vm.hypervisor_node_name, vm.hypervisor_vm_ref) for vm in vms])
+            except Exception as e:
+                _logger.error(f"Failed to update resources for VMs on {server.name}: {e}")
+                raise UserError(_("Failed to update VM resources: %s") % str(e))
+
+            for vm in vms:
+                vm_config = configs.get(str(vm.hypervisor_vm_ref))
+                if not vm_config:
+                    missing |= vm
+                    continue
+
+                old_summary = vm.get_vm_resource_summary()
+                vm.write({
+                    'cores': vm_config['cores'],
+                    'memory': vm_config['memory'],
+                    'disk': vm_config['disk'],
+                })
+                new_summary = vm.get_vm_resource_summary()
+                vm.message_post(
+                    body=_("VM resources updated from hypervisor: %s → %s") % (old_summary, new_summary),
+                    message_type='notification'
+                )
 
-            self.message_post(
-                body=_("VM resources updated from hypervisor: %s → %s") % (old_summary, new_summary),
-                message_type='notification'
-            )
+        if len(self) == 1:
+            if missing:
+                raise UserError(_("Failed to update VM resources: VM %s not found on hypervisor") % self.name)
+            message = _('VM resources synchronized from hypervisor: %s') % new_summary
+        else:
+            message = _('Resources of %d VMs synchronized from hypervisor') % (len(self) - len(missing))
+            if missing:
+                message += "\n" + _("Not found on hypervisor: %s") % ', '.join(missing.mapped('name'))
 
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': _('Resources Updated'),
-                    'message': _('VM resources synchronized from hypervisor: %s') % new_summary,
-                    'type': 'success',
-                    'sticky': False,
-                }
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Resources Updated'),
+                'message': message,
+                'type': 'warning' if missing else 'success',
+                'sticky': False,
             }
-
-        except Exception as e:
-            _logger.error(f"Failed to update resources for VM {self.name}: {e}")
-            raise UserError(_("Failed to update VM resources: %s") % str(e))
\ No newline at end of file
+        }
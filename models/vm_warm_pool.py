@@ -0,0 +1,246 @@
+# vm_rental/models/vm_warm_pool.py
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import ValidationError
+from ..services.drivers import CAP_ASYNC_PROVISIONING, CAP_VMIDS
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+
+class VmWarmPool(models.Model):
+    """
+    Теплый пул: заранее склонированные и остановленные гости продукта на ноде.
+
+    При подтверждении заказа VM получает готового гостя из пула (остается переименовать,
+    задать ресурсы и запустить) вместо клонирования шаблона. Пул пополняется в фоне
+    cron-задачей до target_size; попадания и промахи считаются по созданным VM.
+    """
+    _name = 'vm_rental.warm_pool'
+    _description = 'VM Warm Pool'
+    _order = 'product_tmpl_id, node_id'
+
+    name = fields.Char(string="Name", compute='_compute_name')
+    active = fields.Boolean(default=True)
+    product_tmpl_id = fields.Many2one('product.template', string="Product", required=True, ondelete='cascade',
+                                      domain="[('hypervisor_server_id', '!=', False)]", index=True)
+    server_id = fields.Many2one(related='product_tmpl_id.hypervisor_server_id', string="Server", store=True)
+    node_id = fields.Many2one('hypervisor.node', string="Node", required=True, ondelete='cascade',
+                              domain="[('server_id', '=', server_id)]")
+    target_size = fields.Integer(string="Target Size", default=2,
+                                 help="Number of stopped pre-cloned guests kept ready on the node.")
+    guest_ids = fields.One2many('vm_rental.warm_pool.guest', 'pool_id', string="Guests")
+
+    ready_count = fields.Integer(string="Ready", compute='_compute_guest_counts')
+    cloning_count = fields.Integer(string="Cloning", compute='_compute_guest_counts')
+    hit_count = fields.Integer(string="Hits", compute='_compute_metrics',
+                               help="VMs that were bound to a pre-cloned guest.")
+    miss_count = fields.Integer(string="Misses", compute='_compute_metrics',
+                                help="VMs of this product and node that had to be cloned because the pool was empty.")
+    hit_rate = fields.Float(string="Hit Rate (%)", compute='_compute_metrics', digits=(5, 1))
+    last_refill_at = fields.Datetime(string="Last Refill", readonly=True)
+
+    _sql_constraints = [
+        ('product_node_uniq', 'unique(product_tmpl_id, node_id)', 'There is already a warm pool for this product '
+                                                                   'on this node!'),
+    ]
+
+    @api.depends('product_tmpl_id.name', 'node_id.name')
+    def _compute_name(self):
+        for pool in self:
+            pool.name = f"{pool.product_tmpl_id.name or ''} / {pool.node_id.name or ''}"
+
+    def _compute_guest_counts(self):
+        groups = self.env['vm_rental.warm_pool.guest'].read_group(
+            [('pool_id', 'in', self.ids), ('state', 'in', ('cloning', 'ready'))],
+            ['pool_id', 'state'], ['pool_id', 'state'], lazy=False)
+        counts = {(group['pool_id'][0], group['state']): group['__count'] for group in groups}
+        for pool in self:
+            pool.ready_count = counts.get((pool.id, 'ready'), 0)
+            pool.cloning_count = counts.get((pool.id, 'cloning'), 0)
+
+    def _compute_metrics(self):
+        """Попадания - VM с гостем из пула, промахи - VM пула без него"""
+        VmInstance = self.env['vm_rental.machine'].sudo()
+        totals = {
+            group['warm_pool_id'][0]: group['__count']
+            for group in VmInstance.read_group([('warm_pool_id', 'in', self.ids)],
+                                               ['warm_pool_id'], ['warm_pool_id'], lazy=False)
+        }
+        hits = {
+            group['warm_pool_id'][0]: group['__count']
+            for group in VmInstance.read_group([('warm_pool_id', 'in', self.ids), ('warm_guest_id', '!=', False)],
+                                               ['warm_pool_id'], ['warm_pool_id'], lazy=False)
+        }
+        for pool in self:
+            total = totals.get(pool.id, 0)
+            pool.hit_count = hits.get(pool.id, 0)
+            pool.miss_count = total - pool.hit_count
+            pool.hit_rate = 100.0 * pool.hit_count / total if total else 0.0
+
+    @api.constrains('product_tmpl_id', 'node_id', 'target_size')
+    def _check_pool(self):
+        for pool in self:
+            if pool.target_size < 0:
+                raise ValidationError(_("Warm pool target size cannot be negative"))
+            server = pool.product_tmpl_id.hypervisor_server_id
+            if not (pool.product_tmpl_id.hypervisor_template_id and pool.product_tmpl_id.hypervisor_storage_id):
+                raise ValidationError(_("Product %s has no base template or storage") % pool.product_tmpl_id.name)
+            if pool.node_id.server_id != server:
+                raise ValidationError(_("Node %s does not belong to the product's server") % pool.node_id.name)
+            if not (server.has_capability(CAP_ASYNC_PROVISIONING) and server.has_capability(CAP_VMIDS)):
+                raise ValidationError(_("Warm pools are not supported for %s servers") % server.hypervisor_type)
+
+    # === Выдача гостя ===
+
+    @api.model
+    def _bind_warm_guest(self, vm, product_tmpl):
+        """
+        Привязывает к новой VM готового гостя из пула продукта на ее ноде.
+        Гость захватывается FOR UPDATE SKIP LOCKED - параллельные заказы не получат
+        одного и того же гостя. Возвращает гостя или пустой набор (промах).
+        """
+        pool = self.search([('product_tmpl_id', '=', product_tmpl.id), ('node_id', '=', vm.hypervisor_node_id.id)],
+                           limit=1)
+        if not pool:
+            return self.env['vm_rental.warm_pool.guest']
+
+        Guest = self.env['vm_rental.warm_pool.guest']
+        self.env.cr.execute(f"""
+            SELECT id FROM {Guest._table}
+             WHERE pool_id = %s AND state = 'ready'
+             ORDER BY id
+             LIMIT 1
+             FOR UPDATE SKIP LOCKED
+        """, (pool.id,))
+        row = self.env.cr.fetchone()
+        guest = Guest.browse(row[0]) if row else Guest
+
+        if guest:
+            guest.write({'state': 'claimed', 'vm_id': vm.id})
+            vm.write({'warm_pool_id': pool.id, 'warm_guest_id': guest.id})
+            _logger.info(f"Warm pool {pool.name}: guest {guest.vmid} bound to VM {vm.name}")
+        else:
+            vm.write({'warm_pool_id': pool.id})
+            _logger.info(f"Warm pool {pool.name}: no ready guest for VM {vm.name}")
+        self._trigger_replenisher()
+        return guest
+
+    @api.model
+    def _trigger_replenisher(self):
+        cron = self.env.ref('vm_rental.cron_replenish_warm_pools', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+
+    # === Пополнение ===
+
+    @api.model
+    def _cron_replenish(self):
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        for pool in self.search([]):
+            try:
+                with self.env.cr.savepoint():
+                    pool._replenish()
+            except Exception as e:
+                _logger.warning(f"Could not replenish warm pool {pool.name}: {e}")
+            # Запущенные клоны фиксируются сразу, чтобы не потерять их при ошибке следующего пула
+            if auto_commit:
+                self.env.cr.commit()
+
+    def action_replenish(self):
+        for pool in self:
+            pool._replenish()
+        return True
+
+    def _replenish(self):
+        """Доводит число готовых и клонируемых гостей до target_size, лишних готовых удаляет"""
+        self.ensure_one()
+        product = self.product_tmpl_id
+        server = product.hypervisor_server_id
+        active_guests = self.guest_ids.filtered(lambda g: g.state in ('cloning', 'ready'))
+        deficit = self.target_size - len(active_guests)
+        failed = self.guest_ids.filtered(lambda g: g.state == 'failed')
+        if not deficit and not failed:
+            return
+
+        service = server._get_service_manager()
+        failed._destroy(service)
+        if deficit < 0:
+            surplus = active_guests.filtered(lambda g: g.state == 'ready').sorted('id', reverse=True)[:-deficit]
+            surplus._destroy(service)
+            return
+
+        template = product.hypervisor_template_id
+        storage = product.hypervisor_storage_id.name
+        clone_mode = template._resolve_clone_mode(service, product.vm_clone_mode, self.node_id.name, storage,
+                                                  cores=product.cores, memory=product.memory, disk=product.disk)
+        source_node, source_vmid = template._clone_source(self.node_id.name, storage)
+        Reservation = self.env['hypervisor.vmid.reservation'].sudo()
+        for _n in range(deficit):
+            vmid = str(Reservation.allocate(server))
+            try:
+                upid = service.clone_vm(node=self.node_id.name, vm_id=vmid, name=f'warm-{vmid}',
+                                        template_vmid=source_vmid, storage=storage,
+                                        linked=clone_mode == 'linked', source_node=source_node)
+            except Exception:
+                Reservation.release(server, vmid)
+                raise
+            guest = self.env['vm_rental.warm_pool.guest'].create({
+                'pool_id': self.id,
+                'vmid': vmid,
+                'node': self.node_id.name,
+                'clone_mode': clone_mode,
+            })
+            self.env['hypervisor.task'].track(server, upid, 'clone', node=self.node_id.name,
+                                              record=guest, callback='_on_cloned')
+        self.last_refill_at = fields.Datetime.now()
+        _logger.info(f"Warm pool {self.name}: {deficit} guests cloning ({clone_mode})")
+
+
+class VmWarmPoolGuest(models.Model):
+    """Остановленный гость теплого пула на гипервизоре"""
+    _name = 'vm_rental.warm_pool.guest'
+    _description = 'VM Warm Pool Guest'
+    _order = 'id'
+    _rec_name = 'vmid'
+
+    pool_id = fields.Many2one('vm_rental.warm_pool', string="Pool", required=True, ondelete='cascade', index=True)
+    vmid = fields.Char(string="VMID", required=True, readonly=True)
+    node = fields.Char(string="Node", readonly=True)
+    clone_mode = fields.Selection([
+        ('full', 'Full Clone'),
+        ('linked', 'Linked Clone'),
+    ], string="Cloned As", readonly=True)
+    state = fields.Selection([
+        ('cloning', 'Cloning'),
+        ('ready', 'Ready'),
+        ('claimed', 'Claimed'),
+        ('failed', 'Failed'),
+    ], string="State", default='cloning', required=True, index=True, readonly=True)
+    vm_id = fields.Many2one('vm_rental.machine', string="Bound VM", ondelete='set null', readonly=True)
+    ready_at = fields.Datetime(string="Ready Since", readonly=True)
+    error_message = fields.Text(string="Error Message", readonly=True)
+
+    def _on_cloned(self, task):
+        """Клон пула готов (или не удался)"""
+        if task and task.state == 'failed':
+            self.write({'state': 'failed', 'error_message': task.exitstatus})
+            return
+        self.write({'state': 'ready', 'ready_at': fields.Datetime.now()})
+
+    def _on_task_callback_failed(self, task, error):
+        self.write({'state': 'failed', 'error_message': str(error)})
+
+    def _destroy(self, service):
+        """Удаляет гостей пула на гипервизоре и освобождает их VMID"""
+        Reservation = self.env['hypervisor.vmid.reservation'].sudo()
+        for guest in self:
+            server = guest.pool_id.server_id
+            try:
+                service.delete_vm(guest.node, guest.vmid)
+            except Exception as e:
+                # Клон мог не создаться вовсе; остатки покажет сверка VMID
+                _logger.warning(f"Could not delete warm pool guest {guest.vmid}: {e}")
+            Reservation.release(server, guest.vmid)
+        self.unlink()
@@ -150,6 +150,10 @@ class VmBulkOperationsWizard(models.TransientModel):
         ('apply_config', 'Apply Configuration'),
         ('change_state', 'Change State'),
         ('extend_subscription', 'Extend Subscription'),
+        ('power_start', 'Start on Hypervisor'),
+        ('power_stop', 'Stop on Hypervisor'),
+        ('power_suspend', 'Suspend on Hypervisor'),
+        ('power_delete', 'Terminate on Hypervisor'),
     ], string="Operation", required=True)
 
     # Для apply_config
@@ -207,6 +211,9 @@ class VmBulkOperationsWizard(models.TransientModel):
         if not self.vm_ids:
             raise UserError(_("No VMs selected for the operation"))
 
+        if self.operation_type in self.POWER_OPERATIONS:
+            return self._execute_power_operation()
+
         success_count = 0
         error_count = 0
         messages = []
@@ -228,7 +235,33 @@ class VmBulkOperationsWizard(models.TransientModel):
                 error_count += 1
                 messages.append(f"VM {vm.name}: {str(e)}")
 
-        # Показываем результат
+        return self._result_notification(success_count, error_count, messages)
+
+    # Операция мастера -> (групповое действие, состояния VM, для которых оно допустимо)
+    POWER_OPERATIONS = {
+        'power_start': ('start', ('stopped', 'suspended')),
+        'power_stop': ('stop', ('active', 'suspended')),
+        'power_suspend': ('suspend', ('active',)),
+        'power_delete': ('delete', ('pending', 'active', 'stopped', 'suspended', 'failed')),
+    }
+
+    def _execute_power_operation(self):
+        """Действие на гипервизоре для всех VM одним групповым вызовом на сервер"""
+        action, allowed_states = self.POWER_OPERATIONS[self.operation_type]
+        messages = []
+        vms = self.vm_ids.filtered(lambda vm: vm.state in allowed_states)
+        for vm in self.vm_ids - vms:
+            messages.append(f"VM {vm.name}: {_('Operation is not allowed in state %s') % vm.state}")
+
+        errors = vms._bulk_power_action(action)
+        for vm in vms:
+            if errors.get(vm.id):
+                messages.append(f"VM {vm.name}: {errors.get(vm.id)}")
+        success_count = len(vms.filtered(lambda vm: errors.get(vm.id) is None))
+        return self._result_notification(success_count, len(self.vm_ids) - success_count, messages)
+
+    def _result_notification(self, success_count, error_count, messages):
+        """Уведомление с итогом массовой операции"""
         if error_count == 0:
             message = _("Operation completed successfully for %d VMs") % success_count
             message_type = 'success'
@@ -1,3 +1,8 @@
 from . import base_service
-from . import proxmox_service
-from . import vmware_service
\ No newline at end of file
+from . import connection_pool
+from . import retry_policy
+from . import circuit_breaker
+from . import fanout
+from . import deadline
+# Сервисы гипервизоров (proxmox_service, vmware_service) загружаются лениво через drivers
+from . import drivers
@@ -1,5 +1,13 @@
 # -*- coding: utf-8 -*-
 import logging
+import time
+from .connection_pool import ServiceSession
+from .circuit_breaker import circuit_breaker
+from .deadline import current_deadline
+from .fanout import fan_out
+from .retry_policy import (
+    READ_POLICY, WRITE_POLICY, ERROR_AUTH, CONNECTION_ERRORS, classify_error, run_with_policy,
+)
 _logger = logging.getLogger(__name__)
 
 class HypervisorException(Exception):
@@ -13,6 +21,14 @@ class HypervisorConnectionError(HypervisorException):
 class HypervisorOperationError(HypervisorException):
     """Ошибка операции гипервизора"""
     pass
+
+class HypervisorUnavailableError(HypervisorConnectionError):
+    """Сервер временно недоступен: circuit breaker разомкнут, вызов отклонен без обращения к хосту"""
+    pass
+
+class HypervisorDeadlineExceeded(HypervisorException):
+    """Истек срок запроса или операции - вызов гипервизора не выполнялся"""
+    pass
     
 class BaseHypervisorService:
     """
@@ -20,15 +36,41 @@ class BaseHypervisorService:
     It defines a common interface for the Odoo module to interact with.
     Each method must be implemented by a concrete service class.
     """
-    def __init__(self, server_record):
+    # Retry policies for safe reads and for mutations (override per service if needed)
+    read_retry_policy = READ_POLICY
+    write_retry_policy = WRITE_POLICY
+    # list_os_templates depends on the node (False: one cluster-wide call is enough)
+    TEMPLATES_PER_NODE = True
+
+    def __init__(self, server_record, session=None):
         """
         Initializes the service with the Odoo server record.
         :param server_record: An Odoo record of 'hypervisor.server'.
+        :param session: An existing ServiceSession (from the connection pool) to reuse.
         """
         if not server_record:
             raise ValueError("Server record cannot be empty.")
         self.server = server_record
-        self.connection = self._connect()
+        # Ключ счетчиков вызовов: значения, а не запись, чтобы не обращаться к ORM вне запроса
+        self._stats_key = (server_record.env.cr.dbname, server_record.id)
+        self._breaker_threshold = server_record.breaker_threshold
+        self._breaker_open_seconds = server_record.breaker_open_seconds
+        # Таймауты сервера: подключение, чтение одного ответа и общий срок одной операции
+        self._connect_timeout = server_record.connect_timeout or 5
+        self._read_timeout = server_record.read_timeout or 30
+        self._operation_timeout = server_record.operation_timeout or 120
+        self._max_concurrency = server_record.max_concurrency or 1
+        if session is None:
+            self._operation_deadline('connect')
+            self._check_breaker(trial=True)
+            try:
+                connection = self._connect()
+            except Exception as e:
+                circuit_breaker.record_failure(self._stats_key, e, self._breaker_threshold, self._breaker_open_seconds)
+                raise
+            session = ServiceSession(connection, closer=type(self)._close_connection)
+        self.session = session
+        self.connection = session.connection
 
     def _connect(self):
         """
@@ -38,6 +80,97 @@ class BaseHypervisorService:
         """
         raise NotImplementedError()
 
+    def _classify_error(self, error):
+        """Class of an API error (see retry_policy); services extend it for their client library."""
+        return classify_error(error)
+
+    def _check_breaker(self, trial=False):
+        """
+        Fails fast with HypervisorUnavailableError while the server's circuit breaker is open.
+        :param trial: allow this call to become the half-open trial request.
+        """
+        if trial:
+            allowed, retry_in = circuit_breaker.allow_request(self._stats_key)
+        else:
+            allowed, retry_in = circuit_breaker.check(self._stats_key)
+        if not allowed:
+            raise HypervisorUnavailableError(
+                f"Hypervisor server {self._stats_key[1]} is temporarily unavailable, "
+                f"next attempt in {int(retry_in) + 1} s.")
+
+    def _operation_deadline(self, description):
+        """
+        Absolute deadline (time.monotonic()) of one service call: the server's total operation
+        timeout narrowed by the request-scoped deadline set by the controller or cron.
+        Raises HypervisorDeadlineExceeded when there is no time left.
+        """
+        deadline = time.monotonic() + self._operation_timeout
+        request_deadline = current_deadline()
+        if request_deadline is not None:
+            deadline = min(deadline, request_deadline)
+        if deadline <= time.monotonic():
+            raise HypervisorDeadlineExceeded(f"{description}: deadline exceeded before the call was made")
+        return deadline
+
+    def _fan_out(self, func, items):
+        """
+        Runs func(item) for all items concurrently, at most max_concurrency requests
+        at once for this server. func must not touch ORM records.
+        :return: list of (item, result, exception) in the order of items
+        """
+        return fan_out.map(self._stats_key, self._max_concurrency, func, items)
+
+    def _call(self, func, idempotent=True, description='hypervisor call'):
+        """
+        Runs func() under the retry policy: reads are retried on any transient error,
+        mutations only when the request certainly did not reach the server.
+        Never returns silently on failure - raises HypervisorConnectionError for
+        unreachable hosts and authentication problems, HypervisorOperationError otherwise.
+        """
+        deadline = self._operation_deadline(description)
+        self._check_breaker(trial=True)
+        policy = self.read_retry_policy if idempotent else self.write_retry_policy
+        result, failure = run_with_policy(
+            func, policy,
+            classify=self._classify_error,
+            stats_key=self._stats_key,
+            description=description,
+            deadline=deadline,
+        )
+        if failure is None:
+            circuit_breaker.record_success(self._stats_key)
+            return result
+
+        error, error_class = failure
+        _logger.error(f"{description} failed ({error_class}): {error}")
+        if error_class in CONNECTION_ERRORS:
+            circuit_breaker.record_failure(self._stats_key, error, self._breaker_threshold, self._breaker_open_seconds)
+        elif not isinstance(error, HypervisorException):
+            # Хост ответил (пусть и ошибкой) - он доступен
+            circuit_breaker.record_success(self._stats_key)
+        if isinstance(error, HypervisorException):
+            raise error
+        if error_class == ERROR_AUTH:
+            raise HypervisorConnectionError(f"Authentication failed: {error}") from error
+        if error_class in CONNECTION_ERRORS:
+            raise HypervisorConnectionError(f"{description} failed: {error}") from error
+        raise HypervisorOperationError(f"{description} failed: {error}") from error
+
+    @staticmethod
+    def _close_connection(connection):
+        """
+        Closes a connection created by _connect (called when the pool evicts a session).
+        Subclasses override it when the hypervisor has an explicit logout.
+        """
+        pass
+
+    def ping(self):
+        """
+        Cheap liveness check used by the connection pool.
+        :return: True if the connection is still usable.
+        """
+        return bool(self.get_version())
+
     def get_version(self):
         """
         Gets the hypervisor version.
@@ -68,6 +201,69 @@ class BaseHypervisorService:
         """
         raise NotImplementedError()
 
+    def get_cluster_inventory(self):
+        """
+        Gets nodes, storages, templates and guests of the whole server at once.
+        The default implementation composes it from per-node calls; services with
+        a cluster-wide API override it with a single request.
+        :return: dict with keys:
+            'nodes': [{'id', 'name', 'status', 'maxcpu', 'maxmem', 'maxdisk', 'cpu', 'mem', 'disk'}]
+            'storages': [{'id', 'name', 'node', 'content', 'plugintype', 'shared', 'maxdisk', 'disk'}]
+            'templates': list_os_templates() items, unique by 'vmid', with 'node'
+            'guests': list_all_vms() items (templates excluded) with 'node'
+        """
+        inventory = {'nodes': [], 'storages': [], 'templates': [], 'guests': []}
+        seen_templates = set()
+        nodes = self.list_nodes()
+
+        def safe_templates(node_id):
+            try:
+                return self.list_os_templates(node_id)
+            except Exception as e:
+                _logger.warning(f"Could not fetch templates from node {node_id}: {e}")
+                return []
+
+        def read_node(node):
+            # Runs in a fan-out thread: hypervisor calls only, no ORM
+            return (
+                self.list_storages(node['id']),
+                safe_templates(node['id']) if self.TEMPLATES_PER_NODE else [],
+                self.list_all_vms(node['id']),
+            )
+
+        for node, result, error in self._fan_out(read_node, nodes):
+            if error is not None:
+                raise error
+            storages, templates, vms = result
+            inventory['nodes'].append(dict(node))
+            for storage in storages:
+                inventory['storages'].append(dict(storage, node=node['name']))
+            for template in templates:
+                if template.get('vmid') not in seen_templates:
+                    seen_templates.add(template.get('vmid'))
+                    inventory['templates'].append(dict(template, node=node['name']))
+            for vm in vms:
+                if not vm.get('template'):
+                    inventory['guests'].append(dict(vm, node=node['name']))
+
+        if not self.TEMPLATES_PER_NODE and nodes:
+            for template in safe_templates(None):
+                if template.get('vmid') not in seen_templates:
+                    seen_templates.add(template.get('vmid'))
+                    inventory['templates'].append(dict(template, node=nodes[0]['name']))
+
+        return inventory
+
+    def get_capacity(self):
+        """
+        Gets total and used capacity of all nodes and storages in one call (placement).
+        :return: dict with keys:
+            'nodes': [{'name', 'status', 'maxcpu', 'maxmem', 'cpu', 'mem',
+                       'allocated_cpu', 'allocated_mem', 'guests'}] (memory in bytes)
+            'storages': [{'name', 'node', 'content', 'plugintype', 'shared', 'maxdisk', 'disk'}] (bytes)
+        """
+        raise NotImplementedError()
+
     def get_next_vmid(self):
         """
         Gets the next available VM ID from the hypervisor.
@@ -75,13 +271,36 @@ class BaseHypervisorService:
         """
         raise NotImplementedError()
 
-    def create_vm(self, node, vm_id, name, template_vmid, cores, memory, disk, storage):
+    def list_used_vmids(self):
+        """
+        VM IDs currently taken on the hypervisor (guests and templates), in one request.
+        :return: set of int
+        """
+        raise NotImplementedError()
+
+    def create_vm(self, node, vm_id, name, template_vmid, cores, memory, disk, storage, linked=False):
         """
         Creates a new virtual machine.
+        :param linked: clone the template as a linked clone (only if linked_clone_possible)
         :return: A task ID or boolean indicating success.
         """
         raise NotImplementedError()
 
+    def linked_clone_possible(self, node, template_vmid, storage, cores=None, memory=None, disk=None):
+        """
+        Whether a VM with the given storage and resources can be a linked clone of the template.
+        :return: bool
+        """
+        return False
+
+    def get_task_statuses(self, tasks):
+        """
+        Gets statuses of several asynchronous hypervisor tasks in one pass.
+        :param tasks: list of (node, task_id) pairs
+        :return: dict task_id -> {'status': 'running'|'stopped', 'exitstatus': str|None}
+        """
+        raise NotImplementedError()
+
     def create_container(self, node, vm_id, name, template_volid, cores, memory, disk, storage, password):
         """Creates a new container."""
         raise NotImplementedError()
@@ -97,7 +316,46 @@ class BaseHypervisorService:
 
     def suspend_vm(self, node, vm_id):
         raise NotImplementedError()
-        
+
+    # --- Групповые операции ---
+
+    def start_many(self, vms):
+        """
+        Starts several guests.
+        :param vms: list of (node, vm_id) pairs
+        :return: dict str(vm_id) -> {'success': bool, 'error': str or None}
+        """
+        return self._run_many('start_vm', vms)
+
+    def stop_many(self, vms):
+        """Stops several guests; same arguments and result as start_many."""
+        return self._run_many('stop_vm', vms)
+
+    def suspend_many(self, vms):
+        """Suspends several guests; same arguments and result as start_many."""
+        return self._run_many('suspend_vm', vms)
+
+    def delete_many(self, vms):
+        """Deletes several guests; same arguments and result as start_many."""
+        return self._run_many('delete_vm', vms)
+
+    @staticmethod
+    def _bulk_result(error=None):
+        return {'success': error is None, 'error': str(error) if error is not None else None}
+
+    def _run_many(self, method, vms):
+        """
+        Default bulk implementation: the single-guest method for every guest,
+        concurrently within the server's max_concurrency. Never raises for one guest.
+        """
+        method = getattr(self, method)
+        results = {}
+        for (node, vm_id), result, error in self._fan_out(lambda vm: method(*vm), list(vms)):
+            if error is None and result is False:
+                error = f"{method.__name__} returned no result"
+            results[str(vm_id)] = self._bulk_result(error)
+        return results
+
     def list_all_vms(self, node):
         """
         Gets a list of all VMs on a specific node/cluster.
@@ -141,6 +399,28 @@ class BaseHypervisorService:
         """
         raise NotImplementedError()
 
+    def get_vm_configs(self, vms):
+        """
+        Configurations of several guests in one pass.
+        :param vms: list of (node, vm_id) pairs
+        :return: dict str(vm_id) -> config as returned by get_vm_config; guests that
+                 could not be read are absent
+        """
+        configs = {}
+        for (node, vm_id), config, error in self._fan_out(lambda vm: self.get_vm_config(*vm), list(vms)):
+            if error is None and config:
+                configs[str(vm_id)] = config
+            else:
+                _logger.warning(f"Could not get config of guest {vm_id}: {error}")
+        return configs
+
+    def set_vm_type_hint(self, vm_id, vm_type):
+        """
+        Передает сервису тип гостя, уже сохраненный в Odoo, чтобы не определять его через API.
+        По умолчанию игнорируется (актуально только для гипервизоров с несколькими типами гостей).
+        """
+        pass
+
     def _get_vm_type(self, node, vm_id):
         """
         Определяет тип VM (для гипервизоров, где это актуально)
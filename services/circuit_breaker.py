@@ -0,0 +1,220 @@
+# vm_rental/services/circuit_breaker.py
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+
+from odoo.modules.registry import Registry
+
+_logger = logging.getLogger(__name__)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker по серверам гипервизоров, общий для всех воркеров Odoo.
+
+    Состояние хранится в таблице hypervisor_server_breaker и изменяется через
+    отдельный курсор (upsert), поэтому видно всем процессам сразу и не зависит
+    от исхода транзакции текущего запроса. Чтобы не обращаться к БД на каждый
+    вызов API, состояние кэшируется в процессе на CACHE_TTL секунд.
+
+    closed    - вызовы разрешены, считаются подряд идущие сбои подключения
+    open      - вызовы сразу отклоняются до retry_at
+    half_open - после retry_at один воркер выполняет пробный вызов, остальные ждут
+    """
+
+    CACHE_TTL = 2               # сек. жизни локального кэша состояния
+    HALF_OPEN_TIMEOUT = 60      # сек. на пробный вызов, после чего пробу может взять другой воркер
+    DEFAULT_THRESHOLD = 3       # сбоев подряд до размыкания
+    DEFAULT_OPEN_SECONDS = 30   # сек. в состоянии open
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> {'state', 'failures', 'retry_at' (epoch), 'fetched_at'}
+        self._cache = {}
+        # False - без хранилища (бенчмарки вне Odoo): автомат всегда замкнут
+        self.enabled = True
+
+    # --- Основной API ---
+
+    def check(self, key):
+        """
+        Быстрая проверка без смены состояния.
+        Returns: (разрешено, секунд до следующей попытки)
+        """
+        entry = self._get(key)
+        if entry['state'] == STATE_CLOSED:
+            return True, 0
+        retry_in = max(entry['retry_at'] - time.time(), 0) if entry['retry_at'] else 0
+        return retry_in <= 0, retry_in
+
+    def allow_request(self, key):
+        """
+        Разрешает вызов или отклоняет его. Если срок размыкания истек, пытается
+        атомарно перевести автомат в half_open - пробный вызов получает только один воркер.
+        Returns: (разрешено, секунд до следующей попытки)
+        """
+        allowed, retry_in = self.check(key)
+        if not allowed or self._get(key)['state'] == STATE_CLOSED:
+            return allowed, retry_in
+
+        row = self._execute(key, """
+            UPDATE hypervisor_server_breaker
+               SET state = 'half_open',
+                   retry_at = (now() at time zone 'utc') + make_interval(secs => %s),
+                   write_date = (now() at time zone 'utc')
+             WHERE server_id = %s
+               AND state IN ('open', 'half_open')
+               AND retry_at <= (now() at time zone 'utc')
+         RETURNING state, failure_count, extract(epoch from retry_at)
+        """, (self.HALF_OPEN_TIMEOUT, key[1]))
+        if row:
+            self._set(key, *row)
+            _logger.info(f"Circuit breaker for hypervisor server {key[1]} is half-open, sending a trial request")
+            return True, 0
+        # Пробу уже взял другой воркер (или автомат уже замкнут) - перечитываем состояние
+        self._invalidate(key)
+        entry = self._get(key)
+        if entry['state'] == STATE_CLOSED:
+            return True, 0
+        return False, max((entry['retry_at'] or 0) - time.time(), 0)
+
+    def record_success(self, key):
+        entry = self._get(key)
+        if entry['state'] == STATE_CLOSED and not entry['failures']:
+            return
+        row = self._execute(key, """
+            UPDATE hypervisor_server_breaker
+               SET state = 'closed', failure_count = 0, retry_at = NULL,
+                   write_date = (now() at time zone 'utc')
+             WHERE server_id = %s
+         RETURNING state, failure_count, extract(epoch from retry_at)
+        """, (key[1],), status=('connected', "Hypervisor is reachable again, circuit breaker closed.", 'unavailable'))
+        if row:
+            self._set(key, *row)
+        if entry['state'] != STATE_CLOSED:
+            _logger.info(f"Circuit breaker for hypervisor server {key[1]} closed")
+
+    def record_failure(self, key, error, threshold=None, open_seconds=None):
+        """Учитывает сбой подключения; размыкает автомат по порогу или при неудачной пробе."""
+        threshold = threshold or self.DEFAULT_THRESHOLD
+        open_seconds = open_seconds or self.DEFAULT_OPEN_SECONDS
+        message = str(error)[:1000]
+        row = self._execute(key, """
+            INSERT INTO hypervisor_server_breaker
+                   (server_id, state, failure_count, last_error, last_failure_at, create_date, write_date)
+            VALUES (%(server_id)s, 'closed', 1, %(error)s,
+                    now() at time zone 'utc', now() at time zone 'utc', now() at time zone 'utc')
+            ON CONFLICT (server_id) DO UPDATE
+               SET failure_count = hypervisor_server_breaker.failure_count + 1,
+                   last_error = EXCLUDED.last_error,
+                   last_failure_at = EXCLUDED.last_failure_at,
+                   write_date = EXCLUDED.write_date,
+                   state = CASE
+                       WHEN hypervisor_server_breaker.state = 'half_open'
+                         OR hypervisor_server_breaker.failure_count + 1 >= %(threshold)s THEN 'open'
+                       ELSE hypervisor_server_breaker.state END,
+                   opened_at = CASE
+                       WHEN hypervisor_server_breaker.state <> 'open'
+                        AND (hypervisor_server_breaker.state = 'half_open'
+                             OR hypervisor_server_breaker.failure_count + 1 >= %(threshold)s)
+                       THEN EXCLUDED.write_date
+                       ELSE hypervisor_server_breaker.opened_at END,
+                   retry_at = CASE
+                       WHEN hypervisor_server_breaker.state = 'half_open'
+                         OR hypervisor_server_breaker.failure_count + 1 >= %(threshold)s
+                       THEN EXCLUDED.write_date + make_interval(secs => %(open_seconds)s)
+                       ELSE hypervisor_server_breaker.retry_at END
+         RETURNING state, failure_count, extract(epoch from retry_at)
+        """, {'server_id': key[1], 'error': message, 'threshold': threshold, 'open_seconds': open_seconds},
+            status=('unavailable', f"Circuit breaker open: {message}", None), status_if_state=STATE_OPEN)
+        if row:
+            previous = self._get(key)['state']
+            self._set(key, *row)
+            if row[0] == STATE_OPEN and previous != STATE_OPEN:
+                _logger.warning(f"Circuit breaker for hypervisor server {key[1]} opened "
+                                f"after {row[1]} failures: {message}")
+
+    def reset(self, key):
+        self._execute(key, """
+            UPDATE hypervisor_server_breaker
+               SET state = 'closed', failure_count = 0, retry_at = NULL,
+                   write_date = (now() at time zone 'utc')
+             WHERE server_id = %s
+         RETURNING state, failure_count, extract(epoch from retry_at)
+        """, (key[1],))
+        self._invalidate(key)
+
+    def invalidate(self, key=None):
+        """Сбрасывает локальный кэш (всех серверов, если key не задан)."""
+        if key is None:
+            with self._lock:
+                self._cache.clear()
+        else:
+            self._invalidate(key)
+
+    # --- Внутренние методы ---
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry and time.monotonic() - entry['fetched_at'] < self.CACHE_TTL:
+            return entry
+        row = self._execute(key, """
+            SELECT state, failure_count, extract(epoch from retry_at)
+              FROM hypervisor_server_breaker
+             WHERE server_id = %s
+        """, (key[1],), write=False)
+        return self._set(key, *(row or (STATE_CLOSED, 0, None)))
+
+    def _set(self, key, state, failures, retry_at):
+        entry = {
+            'state': state,
+            'failures': failures or 0,
+            'retry_at': float(retry_at) if retry_at is not None else None,
+            'fetched_at': time.monotonic(),
+        }
+        with self._lock:
+            self._cache[key] = entry
+        return entry
+
+    def _invalidate(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def _execute(self, key, query, params, write=True, status=None, status_if_state=None):
+        """
+        Выполняет запрос в отдельном курсоре базы key[0] и фиксирует его сразу.
+        status - (новый статус, сообщение, обновлять только из статуса | None).
+        Статус hypervisor.server обновляется только если строка не заблокирована
+        текущей транзакцией (SKIP LOCKED) - иначе возможна взаимоблокировка.
+        Ошибки хранилища не должны ломать вызовы гипервизора: автомат считается замкнутым.
+        """
+        dbname, server_id = key
+        if not self.enabled:
+            return None
+        try:
+            with Registry(dbname).cursor() as cr:
+                cr.execute(query, params)
+                row = cr.fetchone()
+                if write and status and row and (status_if_state is None or row[0] == status_if_state):
+                    new_status, message, only_from = status
+                    cr.execute("""
+                        UPDATE hypervisor_server
+                           SET status = %s, status_message = %s
+                         WHERE id IN (SELECT id FROM hypervisor_server
+                                       WHERE id = %s AND (%s IS NULL OR status = %s)
+                                         FOR UPDATE SKIP LOCKED)
+                    """, (new_status, message, server_id, only_from, only_from))
+                return row
+        except Exception as e:
+            _logger.warning(f"Circuit breaker storage unavailable for hypervisor server {server_id}: {e}")
+            return None
+
+
+# Единственный автомат на процесс (состояние - в БД)
+circuit_breaker = CircuitBreaker()
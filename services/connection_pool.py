@@ -0,0 +1,196 @@
+# vm_rental/services/connection_pool.py
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+_logger = logging.getLogger(__name__)
+
+
+class ServiceSession:
+    """
+    Живое подключение к гипервизору, которое переживает отдельный HTTP-запрос
+    или итерацию cron. Не хранит ссылок на Odoo env/записи.
+    """
+
+    def __init__(self, connection, closer=None, key=None):
+        self.key = key
+        self.connection = connection
+        self.closer = closer
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.last_checked = self.created_at
+        # Кэши уровня сессии (ServiceContent, индексы объектов и т.п.)
+        self.cache = {}
+
+    def close(self):
+        if self.closer:
+            try:
+                self.closer(self.connection)
+            except Exception as e:
+                _logger.debug(f"Error while closing hypervisor session {self.key}: {e}")
+        self.cache.clear()
+
+
+class HypervisorConnectionPool:
+    """
+    Пул подключений к гипервизорам на уровне процесса (воркера Odoo).
+
+    Ключ: (база данных, id hypervisor.server, отпечаток учетных данных), поэтому
+    смена хоста или токена никогда не приводит к повторному использованию старой
+    сессии, даже если инвалидация не была вызвана.
+    """
+
+    MAX_SIZE = 32               # максимум открытых сессий на воркер
+    IDLE_TIMEOUT = 300          # сек. простоя до закрытия сессии
+    LIVENESS_INTERVAL = 60      # сек. между проверками "живости" сессии
+
+    FINGERPRINT_FIELDS = (
+        'hypervisor_type', 'host', 'verify_ssl',
+        'user', 'token_name', 'token_value',
+        'vmware_user', 'vmware_password',
+        'connect_timeout', 'read_timeout',
+    )
+
+    def __init__(self, max_size=None, idle_timeout=None, liveness_interval=None):
+        self.max_size = max_size or self.MAX_SIZE
+        self.idle_timeout = idle_timeout or self.IDLE_TIMEOUT
+        self.liveness_interval = liveness_interval or self.LIVENESS_INTERVAL
+        self._sessions = OrderedDict()
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+
+    # --- Ключи ---
+
+    @classmethod
+    def credential_fingerprint(cls, server):
+        """Хэш всех полей, влияющих на подключение."""
+        raw = '\x1f'.join(str(server[field] or '') for field in cls.FINGERPRINT_FIELDS)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _make_key(self, server):
+        return server.env.cr.dbname, server.id, self.credential_fingerprint(server)
+
+    # --- Основной API ---
+
+    def get_service(self, server, service_cls):
+        """
+        Возвращает экземпляр сервиса для записи сервера, переиспользуя
+        живую сессию из пула или открывая новую.
+        """
+        self._check_fork()
+        self._evict_idle()
+
+        key = self._make_key(server)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+
+        if session is not None:
+            service = service_cls(server, session=session)
+            if self._is_alive(service):
+                session.last_used = time.monotonic()
+                return service
+            _logger.info(f"Pooled session for hypervisor server {server.id} is dead, reconnecting")
+            self._discard(key)
+
+        service = service_cls(server)
+        service.session.key = key
+        pooled = self._store(key, service.session)
+        if pooled is not service.session:
+            # Параллельный поток успел положить свою сессию - используем ее
+            service = service_cls(server, session=pooled)
+        return service
+
+    def invalidate(self, dbname, server_id):
+        """Закрывает все сессии сервера (при изменении настроек или удалении)."""
+        with self._lock:
+            keys = [k for k in self._sessions if k[0] == dbname and k[1] == server_id]
+        for key in keys:
+            self._discard(key)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._sessions)
+        for key in keys:
+            self._discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._sessions),
+                'max_size': self.max_size,
+                'servers': sorted({k[1] for k in self._sessions}),
+            }
+
+    # --- Внутренние методы ---
+
+    def _store(self, key, session):
+        """
+        Кладет сессию в пул и возвращает ту, что в нем оказалась: если другой поток
+        уже сохранил сессию с этим ключом, новая закрывается и возвращается его сессия.
+        """
+        evicted = []
+        with self._lock:
+            existing = self._sessions.get(key)
+            if existing is not None and existing is not session:
+                self._sessions.move_to_end(key)
+                evicted.append(session)
+                session = existing
+            else:
+                # Сессии этого же сервера со старыми учетными данными больше не нужны
+                for other in list(self._sessions):
+                    if other[:2] == key[:2] and other != key:
+                        evicted.append(self._sessions.pop(other))
+                self._sessions[key] = session
+                while len(self._sessions) > self.max_size:
+                    _old_key, old_session = self._sessions.popitem(last=False)
+                    evicted.append(old_session)
+        for old in evicted:
+            old.close()
+        return session
+
+    def _discard(self, key):
+        with self._lock:
+            session = self._sessions.pop(key, None)
+        if session is not None:
+            session.close()
+
+    def _is_alive(self, service):
+        """Проверка живости не чаще одного раза в LIVENESS_INTERVAL."""
+        session = service.session
+        now = time.monotonic()
+        if now - session.last_checked < self.liveness_interval:
+            return True
+        try:
+            alive = service.ping()
+        except Exception as e:
+            _logger.debug(f"Liveness check failed for session {session.key}: {e}")
+            alive = False
+        if alive:
+            session.last_checked = now
+        return alive
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [k for k, s in self._sessions.items() if now - s.last_used > self.idle_timeout]
+        for key in idle:
+            self._discard(key)
+
+    def _check_fork(self):
+        """После fork сокеты родителя использовать нельзя."""
+        pid = os.getpid()
+        if pid != self._pid:
+            with self._lock:
+                self._sessions.clear()
+                self._pid = pid
+
+
+# Единственный пул на процесс
+connection_pool = HypervisorConnectionPool()
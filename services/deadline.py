@@ -0,0 +1,65 @@
+# vm_rental/services/deadline.py
+# -*- coding: utf-8 -*-
+import contextvars
+import time
+from contextlib import contextmanager
+
+# Абсолютный срок (time.monotonic()) для всех вызовов гипервизоров в текущем контексте
+_current_deadline = contextvars.ContextVar('vm_rental_hypervisor_deadline', default=None)
+
+
+@contextmanager
+def deadline_scope(seconds=None, until=None):
+    """
+    Ограничивает время всех вызовов гипервизоров внутри блока.
+    Используется контроллерами и cron-задачами; вложенные блоки могут только сузить срок.
+
+    Args:
+        seconds: срок от текущего момента, сек.
+        until: абсолютный срок (time.monotonic())
+    """
+    deadline = until
+    if seconds is not None:
+        deadline = time.monotonic() + seconds if deadline is None else min(deadline, time.monotonic() + seconds)
+    outer = _current_deadline.get()
+    if outer is not None and (deadline is None or outer < deadline):
+        deadline = outer
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def current_deadline():
+    return _current_deadline.get()
+
+
+def remaining():
+    """Оставшееся время в секундах или None, если срок не задан"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def cap_timeout(timeout):
+    """Сужает таймаут операции до оставшегося времени запроса"""
+    left = remaining()
+    if left is None:
+        return timeout
+    return left if timeout is None else min(timeout, left)
+
+
+# Срок по умолчанию для вызовов гипервизора из HTTP-запроса портала, сек.
+PORTAL_REQUEST_TIMEOUT = 25
+
+
+def portal_deadline(env):
+    """
+    Срок вызовов гипервизора для HTTP-запроса портала
+    (ir.config_parameter vm_rental.portal_request_timeout).
+    """
+    timeout = env['ir.config_parameter'].sudo().get_param(
+        'vm_rental.portal_request_timeout', PORTAL_REQUEST_TIMEOUT)
+    return deadline_scope(float(timeout))
@@ -0,0 +1,105 @@
+# vm_rental/services/drivers.py
+# -*- coding: utf-8 -*-
+import importlib
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+# Возможности драйверов: вызывающий код проверяет их до обращения к API
+CAP_SNAPSHOTS = 'snapshots'                    # снапшоты VM
+CAP_LXC_SNAPSHOTS = 'lxc_snapshots'            # снапшоты контейнеров LXC
+CAP_CONTAINERS = 'containers'                  # гости двух типов (qemu/lxc)
+CAP_LINKED_CLONES = 'linked_clones'            # связанные клоны шаблонов
+CAP_BULK_POWER = 'bulk_power'                  # групповые операции питания одним вызовом
+CAP_ASYNC_PROVISIONING = 'async_provisioning'  # провижининг по шагам через hypervisor.task
+CAP_CONSOLE = 'console'                        # веб-консоль
+CAP_VMIDS = 'vmids'                            # числовые VMID, выбираемые клиентом
+CAP_CAPACITY = 'capacity'                      # емкость нод и хранилищ одним запросом
+
+
+class HypervisorDriver:
+    """Описание драйвера: класс сервиса импортируется только при первом обращении."""
+
+    def __init__(self, key, label, module, class_name, capabilities=()):
+        self.key = key
+        self.label = label
+        self.module = module
+        self.class_name = class_name
+        self.capabilities = frozenset(capabilities)
+        self._service_class = None
+
+    def supports(self, capability):
+        return capability in self.capabilities
+
+    @property
+    def loaded(self):
+        return self._service_class is not None
+
+
+class DriverRegistry:
+    """
+    Реестр драйверов гипервизоров на уровне процесса.
+
+    Драйвер регистрируется по ключу hypervisor_type с путем к модулю, поэтому
+    тяжелые клиентские библиотеки (proxmoxer, pyVmomi) загружаются только воркером,
+    который реально обращается к гипервизору этого типа. Сторонние модули могут
+    регистрировать свои драйверы тем же вызовом register().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._drivers = {}
+
+    def register(self, key, label, module, class_name, capabilities=()):
+        """
+        Args:
+            key: значение hypervisor.server.hypervisor_type
+            label: название для выбора в форме сервера
+            module: модуль сервиса ('odoo.addons.x.services.y' или относительный '.y' в этом пакете)
+            class_name: имя подкласса BaseHypervisorService в модуле
+            capabilities: набор констант CAP_*
+        """
+        driver = HypervisorDriver(key, label, module, class_name, capabilities)
+        with self._lock:
+            if key in self._drivers:
+                _logger.info(f"Hypervisor driver '{key}' is re-registered ({module}.{class_name})")
+            self._drivers[key] = driver
+        return driver
+
+    def get(self, key):
+        """Описание драйвера без загрузки модуля; KeyError для неизвестного типа"""
+        with self._lock:
+            return self._drivers[key]
+
+    def load(self, key):
+        """Класс сервиса драйвера (модуль импортируется при первом вызове)"""
+        driver = self.get(key)
+        if driver._service_class is None:
+            module = importlib.import_module(driver.module, __package__ if driver.module.startswith('.') else None)
+            with self._lock:
+                driver._service_class = getattr(module, driver.class_name)
+            _logger.debug(f"Hypervisor driver '{key}' loaded from {module.__name__}")
+        return driver._service_class
+
+    def supports(self, key, capability):
+        with self._lock:
+            driver = self._drivers.get(key)
+        return bool(driver and driver.supports(capability))
+
+    def selection(self):
+        with self._lock:
+            return [(driver.key, driver.label) for driver in self._drivers.values()]
+
+
+driver_registry = DriverRegistry()
+
+driver_registry.register(
+    'proxmox', 'Proxmox VE', '.proxmox_service', 'ProxmoxService',
+    capabilities={CAP_SNAPSHOTS, CAP_CONTAINERS, CAP_BULK_POWER, CAP_ASYNC_PROVISIONING, CAP_CONSOLE,
+                  CAP_VMIDS, CAP_LINKED_CLONES, CAP_CAPACITY},
+)
+driver_registry.register(
+    'vmware', 'VMware vCenter', '.vmware_service', 'VmwareService',
+    capabilities={CAP_SNAPSHOTS, CAP_CONSOLE, CAP_LINKED_CLONES, CAP_CAPACITY},
+)
@@ -0,0 +1,78 @@
+# vm_rental/services/fanout.py
+# -*- coding: utf-8 -*-
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_logger = logging.getLogger(__name__)
+
+
+class FanOut:
+    """
+    Параллельное выполнение независимых чтений гипервизора (по нодам, хранилищам)
+    с ограничением одновременных запросов на сервер в рамках процесса.
+
+    Функции, выполняемые в потоках, не должны обращаться к ORM: результаты
+    возвращаются вызывающему, и записи в БД делаются в основном потоке.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key сервера -> (лимит, семафор)
+        self._semaphores = {}
+        self._local = threading.local()
+
+    def _semaphore(self, key, limit):
+        with self._lock:
+            current = self._semaphores.get(key)
+            if current is None or current[0] != limit:
+                current = (limit, threading.BoundedSemaphore(limit))
+                self._semaphores[key] = current
+            return current[1]
+
+    def map(self, key, limit, func, items):
+        """
+        Выполняет func(item) для всех items, не более limit одновременно для сервера key.
+
+        Returns:
+            list: (item, результат, исключение) в порядке items
+        """
+        items = list(items)
+        limit = max(int(limit or 1), 1)
+        # Один элемент или вложенный вызов из потока fan-out - выполняем на месте,
+        # иначе внутренний вызов может ждать разрешений, занятых внешним
+        if len(items) <= 1 or limit == 1 or getattr(self._local, 'active', False):
+            return [self._run_inline(func, item) for item in items]
+
+        semaphore = self._semaphore(key, limit)
+
+        def run(item):
+            with semaphore:
+                self._local.active = True
+                try:
+                    return func(item)
+                finally:
+                    self._local.active = False
+
+        with ThreadPoolExecutor(max_workers=min(limit, len(items)), thread_name_prefix='vm_rental_fanout') as pool:
+            # Контекст (срок запроса и т.п.) передается в каждый поток
+            futures = [pool.submit(contextvars.copy_context().run, run, item) for item in items]
+            results = []
+            for item, future in zip(items, futures):
+                try:
+                    results.append((item, future.result(), None))
+                except Exception as e:
+                    results.append((item, None, e))
+        return results
+
+    @staticmethod
+    def _run_inline(func, item):
+        try:
+            return item, func(item), None
+        except Exception as e:
+            return item, None, e
+
+
+# Единый механизм на процесс (семафоры общие для всех запросов воркера)
+fan_out = FanOut()
@@ -1,14 +1,31 @@
 # vm_rental/services/proxmox_service.py
 # -*- coding: utf-8 -*-
-from proxmoxer import ProxmoxAPI
+from proxmoxer import ProxmoxAPI, AuthenticationError
 from .base_service import BaseHypervisorService, HypervisorConnectionError, HypervisorOperationError
+from .retry_policy import ERROR_AUTH
+from .deadline import cap_timeout
 import logging
+import re
 import time
 
 _logger = logging.getLogger(__name__)
 
 class ProxmoxService(BaseHypervisorService):
 
+    # Время жизни индекса VMID -> (нода, тип гостя), сек.
+    VM_INDEX_TTL = 60
+    # Время жизни результата проверки возможности связанного клона, сек.
+    LINKED_CLONE_CHECK_TTL = 300
+    # Типы хранилищ PVE со связанными клонами; на файловых - только для дисков qcow2
+    LINKED_CLONE_STORAGE_TYPES = {'lvmthin', 'zfspool', 'rbd', 'btrfs', 'dir', 'nfs', 'cifs', 'glusterfs'}
+    FILE_STORAGE_TYPES = {'dir', 'nfs', 'cifs', 'glusterfs'}
+    DISK_KEY = re.compile(r'^(scsi|virtio|sata|ide|efidisk|tpmstate)\d+$')
+
+    def __init__(self, server_record, session=None):
+        super().__init__(server_record, session=session)
+        # Типы гостей, уже известные Odoo (vm_rental.machine.vm_type) - им доверяем без запросов
+        self._vm_type_hints = {}
+
     def _connect(self):
         try:
             return ProxmoxAPI(
@@ -17,40 +34,33 @@ class ProxmoxService(BaseHypervisorService):
                 token_name=self.server.token_name,
                 token_value=self.server.token_value,
                 verify_ssl=self.server.verify_ssl,
-                port=8006
+                port=8006,
+                # (подключение, чтение) - requests применяет их к каждому запросу
+                timeout=(self._connect_timeout, self._read_timeout),
             )
         except Exception as e:
             _logger.error(f"Proxmox connection failed: {e}")
             raise ConnectionError(f"Could not connect to Proxmox host {self.server.host}.") from e
 
     def _execute(self, action, *args, **kwargs):
-        """Выполнение операции с улучшенной обработкой ошибок"""
-        max_retries = 3
-        retry_delay = 1
-        
-        for attempt in range(max_retries):
-            try:
-                return action(*args, **kwargs)
-            except Exception as e:
-                error_msg = str(e)
-                _logger.error(f"Proxmox API error (attempt {attempt + 1}/{max_retries}): {error_msg}", exc_info=True)
-                
-                # Проверка на временные ошибки
-                if any(temp_err in error_msg.lower() for temp_err in ['timeout', 'connection reset', 'temporary']):
-                    if attempt < max_retries - 1:
-                        time.sleep(retry_delay * (attempt + 1))
-                        continue
-                
-                # Проверка на критические ошибки
-                if any(crit_err in error_msg.lower() for crit_err in ['authentication', 'unauthorized', 'forbidden']):
-                    raise HypervisorConnectionError(f"Authentication failed: {error_msg}")
-                
-                # Для последней попытки или некритических ошибок
-                if attempt == max_retries - 1:
-                    raise HypervisorOperationError(f"Operation failed after {max_retries} attempts: {error_msg}")
-        
-        return None
-    
+        """
+        Выполнение вызова API через политику повторов: GET считается безопасным чтением,
+        POST/PUT/DELETE - мутацией, которая повторяется только если сервер ее не получил.
+        """
+        method = getattr(action, '__name__', '').lower()
+        resource = getattr(action, '__self__', None)
+        path = getattr(resource, '_store', {}).get('base_url', '') if resource is not None else ''
+        return self._call(
+            lambda: action(*args, **kwargs),
+            idempotent=method == 'get',
+            description=f"Proxmox {method.upper() or 'API'} {path}".strip(),
+        )
+
+    def _classify_error(self, error):
+        if isinstance(error, AuthenticationError):
+            return ERROR_AUTH
+        return super()._classify_error(error)
+
     def get_version(self):
         version_info = self._execute(self.connection.version.get)
         return version_info.get('version') if version_info else "N/A"
@@ -95,6 +105,158 @@ class ProxmoxService(BaseHypervisorService):
                     })
         return templates
 
+    def get_cluster_inventory(self):
+        """
+        Вся инвентаризация кластера из одного снимка /cluster/resources.
+        Дополнительные запросы нужны только для содержимого vztmpl-хранилищ
+        (по одному на общее хранилище, а не на каждую ноду).
+        """
+        resources = self._execute(self.connection.cluster.resources.get) or []
+        inventory = {'nodes': [], 'storages': [], 'templates': [], 'guests': []}
+        vm_index = {}
+
+        for res in resources:
+            res_type = res.get('type')
+            if res_type == 'node':
+                inventory['nodes'].append({
+                    'id': res['node'],
+                    'name': res['node'],
+                    'status': res.get('status'),
+                    'maxcpu': res.get('maxcpu', 0),
+                    'maxmem': res.get('maxmem', 0),
+                    'maxdisk': res.get('maxdisk', 0),
+                    'cpu': res.get('cpu', 0),
+                    'mem': res.get('mem', 0),
+                    'disk': res.get('disk', 0),
+                })
+            elif res_type == 'storage':
+                # Как и list_storages - только активные хранилища
+                if res.get('status') != 'available':
+                    continue
+                inventory['storages'].append({
+                    'id': res['storage'],
+                    'name': res['storage'],
+                    'node': res.get('node'),
+                    'content': res.get('content', ''),
+                    'plugintype': res.get('plugintype'),
+                    'shared': bool(res.get('shared')),
+                    'maxdisk': res.get('maxdisk', 0),
+                    'disk': res.get('disk', 0),
+                })
+            elif res_type in ('qemu', 'lxc') and res.get('vmid') is not None:
+                vmid = res['vmid']
+                vm_index[str(vmid)] = (res.get('node'), res_type)
+                if res.get('template'):
+                    if res_type == 'qemu':
+                        inventory['templates'].append({
+                            'id': vmid,
+                            'name': f"{res.get('name')} (ID: {vmid})",
+                            'vmid': vmid,
+                            'template_type': 'qemu',
+                            'node': res.get('node'),
+                        })
+                    continue
+                inventory['guests'].append({
+                    'vmid': vmid,
+                    'name': res.get('name') or f"{res_type.upper()}-{vmid}",
+                    'node': res.get('node'),
+                    'status': res.get('status'),
+                    'vm_type': res_type,
+                    'maxcpu': res.get('maxcpu', 0),
+                    'maxmem': res.get('maxmem', 0),
+                    'maxdisk': res.get('maxdisk', 0),
+                })
+
+        inventory['templates'].extend(self._list_lxc_templates(inventory['storages']))
+
+        # Снимок содержит все гости кластера - заодно обновляем индекс VMID
+        index = self._vm_index()
+        index['entries'] = vm_index
+        index['built_at'] = time.monotonic()
+
+        return inventory
+
+    def get_capacity(self):
+        """Емкость нод и хранилищ одним запросом /cluster/resources"""
+        resources = self._execute(self.connection.cluster.resources.get) or []
+        nodes = {}
+        storages = []
+        allocated = {}
+        for res in resources:
+            res_type = res.get('type')
+            if res_type == 'node':
+                nodes[res['node']] = {
+                    'name': res['node'],
+                    'status': res.get('status'),
+                    'maxcpu': res.get('maxcpu', 0),
+                    'maxmem': res.get('maxmem', 0),
+                    'cpu': res.get('cpu', 0),
+                    'mem': res.get('mem', 0),
+                }
+            elif res_type == 'storage':
+                if res.get('status') != 'available':
+                    continue
+                storages.append({
+                    'name': res['storage'],
+                    'node': res.get('node'),
+                    'content': res.get('content', ''),
+                    'plugintype': res.get('plugintype'),
+                    'shared': bool(res.get('shared')),
+                    'maxdisk': res.get('maxdisk', 0),
+                    'disk': res.get('disk', 0),
+                })
+            elif res_type in ('qemu', 'lxc') and not res.get('template'):
+                # Выделенные гостям vCPU и память - основа для коэффициентов переподписки
+                node_allocated = allocated.setdefault(res.get('node'), {'cpu': 0, 'mem': 0, 'guests': 0})
+                node_allocated['cpu'] += res.get('maxcpu', 0)
+                node_allocated['mem'] += res.get('maxmem', 0)
+                node_allocated['guests'] += 1
+
+        for name, node in nodes.items():
+            node_allocated = allocated.get(name, {})
+            node['allocated_cpu'] = node_allocated.get('cpu', 0)
+            node['allocated_mem'] = node_allocated.get('mem', 0)
+            node['guests'] = node_allocated.get('guests', 0)
+        return {'nodes': list(nodes.values()), 'storages': storages}
+
+    def _list_lxc_templates(self, storages):
+        """LXC шаблоны из vztmpl-хранилищ; общие хранилища опрашиваются один раз"""
+        templates = []
+        seen_volids = set()
+        queried = {}
+
+        for storage in storages:
+            if 'vztmpl' not in (storage.get('content') or ''):
+                continue
+            key = storage['name'] if storage.get('shared') else (storage['node'], storage['name'])
+            queried.setdefault(key, storage)
+
+        def read_contents(storage):
+            return self._execute(
+                self.connection.nodes(storage['node']).storage(storage['name']).content.get,
+                content='vztmpl'
+            ) or []
+
+        # Хранилища опрашиваются параллельно, результаты сводятся в исходном порядке
+        for storage, contents, error in self._fan_out(read_contents, queried.values()):
+            if error is not None:
+                _logger.warning(f"Could not list templates of storage {storage['name']} on {storage['node']}: {error}")
+                continue
+
+            for content_item in contents:
+                volid = content_item.get('volid')
+                if not volid or volid in seen_volids:
+                    continue
+                seen_volids.add(volid)
+                templates.append({
+                    'id': volid,
+                    'name': volid.split('/')[-1],
+                    'vmid': volid,
+                    'template_type': 'lxc',
+                    'node': storage['node'],
+                })
+        return templates
+
     def create_container(self, node, vm_id, name, template_volid, cores, memory, disk, storage, password):
         """Создает LXC контейнер."""
         lxc_params = {
@@ -108,34 +270,202 @@ class ProxmoxService(BaseHypervisorService):
             'rootfs': disk, # Для LXC размер диска указывается так
             'net0': 'name=eth0,bridge=vmbr0,ip=dhcp' # Пример сетевой конфигурации
         }
-        return self._execute(self.connection.nodes(node).lxc.create, **lxc_params)
+        task_id = self._execute(self.connection.nodes(node).lxc.create, **lxc_params)
+        self._remember_vm(node, vm_id, 'lxc')
+        return task_id
 
 
     def get_next_vmid(self):
         return self._execute(self.connection.cluster.nextid.get)
 
-    def create_vm(self, node, vm_id, name, template_vmid, cores, memory, disk, storage):
+    def list_used_vmids(self):
+        return {int(res['vmid']) for res in self._guest_resources()}
+
+    # --- Асинхронные задачи (UPID) ---
+
+    # Задержки ожидания задачи: от 0.5 до 5 сек. с удвоением
+    TASK_POLL_MIN_DELAY = 0.5
+    TASK_POLL_MAX_DELAY = 5
+
+    def get_task_statuses(self, tasks):
+        """
+        Статусы нескольких задач: один запрос /cluster/tasks на все задачи и
+        /nodes/{node}/tasks/{upid}/status только для тех, что в нем не найдены.
+
+        Args:
+            tasks: список пар (node, upid)
+
+        Returns:
+            dict: upid -> {'status': 'running'|'stopped', 'exitstatus': str|None}
+        """
+        tasks = list(tasks)
+        statuses = {}
+        if not tasks:
+            return statuses
+
+        try:
+            recent = self._execute(self.connection.cluster.tasks.get) or []
+        except Exception as e:
+            _logger.debug(f"Could not list cluster tasks, polling individually: {e}")
+            recent = []
+        recent_by_upid = {t.get('upid'): t for t in recent}
+
+        for node, upid in tasks:
+            info = recent_by_upid.get(upid)
+            if info is not None:
+                if info.get('endtime'):
+                    statuses[upid] = {'status': 'stopped', 'exitstatus': info.get('status')}
+                else:
+                    statuses[upid] = {'status': 'running', 'exitstatus': None}
+                continue
+
+            node = node or self._task_node(upid)
+            try:
+                info = self._execute(self.connection.nodes(node).tasks(upid).status.get) or {}
+                statuses[upid] = {'status': info.get('status', 'running'), 'exitstatus': info.get('exitstatus')}
+            except Exception as e:
+                _logger.warning(f"Could not get status of task {upid}: {e}")
+        return statuses
+
+    def wait_for_tasks(self, tasks, timeout=600):
+        """
+        Ожидание нескольких задач сразу: на каждом шаге один get_task_statuses
+        по всем еще не завершенным задачам, а не цикл ожидания на каждую.
+
+        Args:
+            tasks: список пар (node, upid); пустые upid пропускаются
+
+        Returns:
+            dict: upid -> {'status', 'exitstatus'}; задачи, не завершившиеся
+            за timeout, остаются со статусом 'running'
+        """
+        pending = {upid: node or self._task_node(upid) for node, upid in tasks if upid}
+        statuses = {upid: {'status': 'running', 'exitstatus': None} for upid in pending}
+        delay = self.TASK_POLL_MIN_DELAY
+        # Ожидание не выходит за срок запроса (контроллер/cron)
+        timeout = cap_timeout(timeout)
+        started = time.monotonic()
+        while pending:
+            current = self.get_task_statuses([(node, upid) for upid, node in pending.items()])
+            for upid, status in current.items():
+                statuses[upid] = status
+                if status.get('status') == 'stopped':
+                    pending.pop(upid, None)
+            if not pending:
+                break
+            left = timeout - (time.monotonic() - started)
+            if left <= 0:
+                break
+            time.sleep(min(delay, left))
+            delay = min(delay * 2, self.TASK_POLL_MAX_DELAY)
+        return statuses
+
+    @staticmethod
+    def _task_succeeded(status):
+        exitstatus = status.get('exitstatus') or ''
+        return status.get('status') == 'stopped' and (exitstatus == 'OK' or exitstatus.startswith('WARNINGS'))
+
+    @staticmethod
+    def _task_node(upid):
+        parts = str(upid or '').split(':')
+        return parts[1] if len(parts) > 2 else None
+
+    # --- Провижининг по шагам ---
+
+    def clone_vm(self, node, vm_id, name, template_vmid, storage, linked=False, source_node=None):
+        """
+        Запускает клонирование шаблона, возвращает UPID задачи клонирования.
+        Связанный клон (linked) остается на хранилище шаблона, storage для него не передается.
+        source_node - нода шаблона, если она отличается от целевой node.
+        """
         clone_params = {
             'newid': vm_id,
             'name': name,
-            'full': True,
-            'storage': storage,
             'target': node,
         }
-        task_id = self._execute(self.connection.nodes(node).qemu(template_vmid).clone.post, **clone_params)
-        if not task_id: return None
+        if linked:
+            clone_params['full'] = 0
+        else:
+            clone_params.update(full=True, storage=storage)
+        upid = self._execute(self.connection.nodes(source_node or node).qemu(template_vmid).clone.post,
+                             **clone_params)
+        if upid:
+            self._remember_vm(node, vm_id, 'qemu')
+        return upid
+
+    def linked_clone_possible(self, node, template_vmid, storage, cores=None, memory=None, disk=None):
+        """
+        Можно ли получить VM на storage связанным клоном шаблона. Связанный клон
+        создается на хранилище дисков шаблона, поэтому все диски должны лежать на storage,
+        а хранилище - поддерживать связанные клоны. Ресурсы VM не важны: диск связанного
+        клона увеличивается обычным resize. Результат кэшируется в сессии.
+        """
+        key = (node, str(template_vmid), storage)
+        cache = self.session.cache.setdefault('linked_clone', {})
+        cached = cache.get(key)
+        if cached and time.monotonic() - cached[0] < self.LINKED_CLONE_CHECK_TTL:
+            return cached[1]
+
+        reason = self._linked_clone_obstacle(node, template_vmid, storage)
+        if reason:
+            _logger.info(f"Linked clone of template {template_vmid} to {storage} is not possible: {reason}")
+        cache[key] = (time.monotonic(), reason is None)
+        return reason is None
+
+    def _linked_clone_obstacle(self, node, template_vmid, storage):
+        """Причина, по которой связанный клон невозможен, или None"""
+        config = self._execute(self.connection.nodes(node).qemu(template_vmid).config.get) or {}
+        if not int(config.get('template') or 0):
+            return "source is not a template"
+        volumes = [str(value).split(',')[0] for key, value in config.items()
+                   if self.DISK_KEY.match(key) and 'media=cdrom' not in str(value)]
+        disk_storages = {volume.split(':')[0] for volume in volumes}
+        if disk_storages != {storage}:
+            return f"template disks are on {', '.join(sorted(disk_storages)) or 'no storage'}"
+
+        storage_info = next((item for item in self._execute(self.connection.nodes(node).storage.get) or []
+                             if item.get('storage') == storage), {})
+        storage_type = storage_info.get('type')
+        if storage_type not in self.LINKED_CLONE_STORAGE_TYPES:
+            return f"storage type {storage_type} does not support linked clones"
+        if storage_type in self.FILE_STORAGE_TYPES and not all(v.endswith('.qcow2') for v in volumes):
+            return "template disks on file storage are not qcow2"
+        return None
+
+    def get_template_info(self, template_vmid):
+        """Нода шаблона, хранилища его дисков и digest конфигурации (меняется при любой правке)"""
+        node, _vm_type = self._resolve_vm(None, template_vmid)
+        if not node:
+            raise HypervisorOperationError(f"Template {template_vmid} not found in the cluster")
+        config = self._execute(self.connection.nodes(node).qemu(template_vmid).config.get) or {}
+        volumes = [str(value).split(',')[0] for key, value in config.items()
+                   if self.DISK_KEY.match(key) and 'media=cdrom' not in str(value)]
+        return {
+            'node': node,
+            'storages': sorted({volume.split(':')[0] for volume in volumes}),
+            'digest': config.get('digest'),
+            'is_template': bool(int(config.get('template') or 0)),
+        }
+
+    def convert_to_template(self, node, vm_id):
+        """Превращает VM в шаблон; возвращает UPID"""
+        return self._execute(self.connection.nodes(node).qemu(vm_id).template.post)
 
+    def configure_vm(self, node, vm_id, cores, memory, name=None):
+        """Задает CPU, память и (опционально) имя; возвращает UPID (асинхронный POST config)"""
         config_params = {'cores': cores, 'memory': memory}
-        self._execute(self.connection.nodes(node).qemu(vm_id).config.post, **config_params)
-        
-        self._execute(self.connection.nodes(node).qemu(vm_id).resize.put, disk='scsi0', size=f'+{disk}G')
-        
-        return task_id
+        if name:
+            config_params['name'] = name
+        return self._execute(self.connection.nodes(node).qemu(vm_id).config.post, **config_params)
+
+    def resize_disk(self, node, vm_id, disk):
+        """Увеличивает диск; возвращает UPID (PVE 8) или None (синхронно в PVE 7)"""
+        return self._execute(self.connection.nodes(node).qemu(vm_id).resize.put, disk='scsi0', size=f'+{disk}G')
 
     # ... остальные методы без изменений ...
     def start_vm(self, node, vm_id):
         """Универсальный метод запуска VM/LXC с правильным определением типа"""
-        vm_type = self._get_vm_type(node, vm_id)
+        node, vm_type = self._resolve_vm(node, vm_id)
         _logger.info(f"Starting {vm_type.upper()} {vm_id} on node {node}")
 
         try:
@@ -149,7 +479,7 @@ class ProxmoxService(BaseHypervisorService):
 
     def stop_vm(self, node, vm_id):
         """Универсальный метод остановки VM/LXC с правильным определением типа"""
-        vm_type = self._get_vm_type(node, vm_id)
+        node, vm_type = self._resolve_vm(node, vm_id)
         _logger.info(f"Stopping {vm_type.upper()} {vm_id} on node {node}")
 
         try:
@@ -163,7 +493,7 @@ class ProxmoxService(BaseHypervisorService):
 
     def reboot_vm(self, node, vm_id):
         """Перезагрузка VM/LXC с правильным определением типа"""
-        vm_type = self._get_vm_type(node, vm_id)
+        node, vm_type = self._resolve_vm(node, vm_id)
         _logger.info(f"Rebooting {vm_type.upper()} {vm_id} on node {node}")
 
         try:
@@ -178,6 +508,123 @@ class ProxmoxService(BaseHypervisorService):
     def suspend_vm(self, node, vm_id):
         return self._execute(self.connection.nodes(node).qemu(vm_id).status.suspend.post)
 
+    # --- Групповые операции ---
+
+    # Метод одиночной операции -> (групповой эндпоинт ноды, параметры, ожидаемый статус гостя)
+    BULK_POWER_ENDPOINTS = {
+        'start_vm': ('startall', {'force': 1}, 'running'),
+        'stop_vm': ('stopall', {}, 'stopped'),
+        'suspend_vm': ('suspendall', {}, None),
+    }
+
+    def start_many(self, vms):
+        return self._power_many('start_vm', vms)
+
+    def stop_many(self, vms):
+        return self._power_many('stop_vm', vms)
+
+    def suspend_many(self, vms):
+        return self._power_many('suspend_vm', vms)
+
+    def _power_many(self, method, vms):
+        """
+        Групповое действие питания: один POST /nodes/{node}/startall|stopall|suspendall
+        с параметром vms на ноду, общее ожидание задач и проверка статусов гостей
+        одним /cluster/resources. Если групповая задача ноды завершилась ошибкой,
+        гости этой ноды обрабатываются по одному.
+        """
+        endpoint, params, expected_status = self.BULK_POWER_ENDPOINTS[method]
+        results = {}
+        by_node = {}
+        for node, vm_id in vms:
+            node, vm_type = self._resolve_vm(node, vm_id)
+            if method == 'suspend_vm' and vm_type != 'qemu':
+                results[str(vm_id)] = self._bulk_result(f"Suspend is not supported for LXC container {vm_id}")
+                continue
+            by_node.setdefault(node, []).append(str(vm_id))
+
+        node_tasks = {}
+        fallback = []
+        for node, vm_ids in by_node.items():
+            _logger.info(f"Bulk {endpoint} of {len(vm_ids)} guests on node {node}")
+            try:
+                node_tasks[node] = self._execute(
+                    getattr(self.connection.nodes(node), endpoint).post, vms=','.join(vm_ids), **params
+                )
+            except Exception as e:
+                _logger.warning(f"Bulk {endpoint} failed on node {node}, falling back to single calls: {e}")
+                fallback.extend((node, vm_id) for vm_id in vm_ids)
+
+        task_statuses = self.wait_for_tasks([(node, upid) for node, upid in node_tasks.items()])
+        guest_statuses = {}
+        if expected_status and node_tasks:
+            try:
+                guest_statuses = self._guest_statuses()
+            except Exception as e:
+                _logger.warning(f"Could not verify guest statuses after bulk {endpoint}: {e}")
+
+        for node, upid in node_tasks.items():
+            status = task_statuses.get(upid, {'status': 'stopped', 'exitstatus': 'OK'}) if upid else None
+            if status and status.get('status') != 'stopped':
+                for vm_id in by_node[node]:
+                    results[vm_id] = self._bulk_result(f"Timed out waiting for bulk {endpoint} task {upid}")
+                continue
+            if status and not self._task_succeeded(status):
+                _logger.warning(f"Bulk {endpoint} task {upid} failed ({status.get('exitstatus')}), "
+                                f"falling back to single calls on node {node}")
+                fallback.extend((node, vm_id) for vm_id in by_node[node])
+                continue
+            for vm_id in by_node[node]:
+                guest_status = guest_statuses.get(vm_id)
+                if guest_statuses and guest_status != expected_status:
+                    results[vm_id] = self._bulk_result(f"Guest {vm_id} is {guest_status or 'missing'} after {endpoint}")
+                else:
+                    results[vm_id] = self._bulk_result()
+
+        if fallback:
+            results.update(self._run_many(method, fallback))
+        return results
+
+    def _guest_resources(self):
+        """Все гости кластера одним /cluster/resources?type=vm; заодно обновляет индекс VMID"""
+        resources = self._execute(self.connection.cluster.resources.get, type='vm') or []
+        self._refresh_vm_index(resources)
+        return [res for res in resources if res.get('vmid') is not None and res.get('type') in ('qemu', 'lxc')]
+
+    def _guest_statuses(self):
+        return {str(res['vmid']): res.get('status') for res in self._guest_resources()}
+
+    def delete_many(self, vms):
+        """Удаление нескольких гостей: все DELETE отправляются сразу, задачи ожидаются вместе"""
+        # Тип определяется до параллельной отправки: индекс обновляется не более одного раза
+        resolved = [(vm_id,) + self._resolve_vm(node, vm_id) for node, vm_id in vms]
+
+        def submit(guest):
+            vm_id, node, vm_type = guest
+            resource = getattr(self.connection.nodes(node), vm_type)(vm_id)
+            return node, self._execute(resource.delete)
+
+        results = {}
+        tasks = {}
+        for (vm_id, node, vm_type), submitted, error in self._fan_out(submit, resolved):
+            if error is not None:
+                _logger.error(f"Failed to delete {vm_type.upper()} {vm_id}: {error}")
+                results[str(vm_id)] = self._bulk_result(error)
+            else:
+                tasks[str(vm_id)] = submitted
+
+        statuses = self.wait_for_tasks(list(tasks.values()))
+        for vm_id, (node, upid) in tasks.items():
+            status = statuses.get(upid) if upid else None
+            if status is not None and not self._task_succeeded(status):
+                results[vm_id] = self._bulk_result(
+                    f"Proxmox task {upid} did not complete: {status.get('exitstatus') or status.get('status')}"
+                )
+                continue
+            self._forget_vm(vm_id)
+            results[vm_id] = self._bulk_result()
+        return results
+
     def list_all_vms(self, node):
         """Получает список всех VM и LXC контейнеров с отладкой"""
         all_vms = []
@@ -210,7 +657,7 @@ class ProxmoxService(BaseHypervisorService):
 
     def create_snapshot(self, node, vm_id, snap_name, description):
         """Создание снапшота (только для QEMU VM)"""
-        vm_type = self._get_vm_type(node, vm_id)
+        node, vm_type = self._resolve_vm(node, vm_id)
 
         if vm_type != 'qemu':
             raise HypervisorOperationError(f"Snapshots are not supported for LXC containers (ID: {vm_id})")
@@ -226,7 +673,7 @@ class ProxmoxService(BaseHypervisorService):
 
     def rollback_snapshot(self, node, vm_id, snap_name):
         """Откат к снапшоту (только для QEMU VM)"""
-        vm_type = self._get_vm_type(node, vm_id)
+        node, vm_type = self._resolve_vm(node, vm_id)
 
         if vm_type != 'qemu':
             raise HypervisorOperationError(f"Snapshots are not supported for LXC containers (ID: {vm_id})")
@@ -241,7 +688,7 @@ class ProxmoxService(BaseHypervisorService):
 
     def delete_snapshot(self, node, vm_id, snap_name):
         """Удаление снапшота (только для QEMU VM)"""
-        vm_type = self._get_vm_type(node, vm_id)
+        node, vm_type = self._resolve_vm(node, vm_id)
 
         if vm_type != 'qemu':
             raise HypervisorOperationError(f"Snapshots are not supported for LXC containers (ID: {vm_id})")
@@ -256,7 +703,7 @@ class ProxmoxService(BaseHypervisorService):
 
     def get_console_url(self, node, vm_id):
         """Генерация URL консоли с правильным определением типа"""
-        vm_type = self._get_vm_type(node, vm_id)
+        node, vm_type = self._resolve_vm(node, vm_id)
 
         try:
             if vm_type == 'qemu':
@@ -280,14 +727,16 @@ class ProxmoxService(BaseHypervisorService):
 
     def delete_vm(self, node, vm_id):
         """Удаление VM/LXC с правильным определением типа"""
-        vm_type = self._get_vm_type(node, vm_id)
+        node, vm_type = self._resolve_vm(node, vm_id)
         _logger.info(f"Deleting {vm_type.upper()} {vm_id} on node {node}")
 
         try:
             if vm_type == 'qemu':
-                return self._execute(self.connection.nodes(node).qemu(vm_id).delete)
+                result = self._execute(self.connection.nodes(node).qemu(vm_id).delete)
             else:  # lxc
-                return self._execute(self.connection.nodes(node).lxc(vm_id).delete)
+                result = self._execute(self.connection.nodes(node).lxc(vm_id).delete)
+            self._forget_vm(vm_id)
+            return result
         except Exception as e:
             _logger.error(f"Failed to delete {vm_type.upper()} {vm_id}: {e}")
             raise HypervisorOperationError(f"Cannot delete {vm_type.upper()} {vm_id}: {e}")
@@ -297,7 +746,7 @@ class ProxmoxService(BaseHypervisorService):
 
         # Если тип не передан, определяем его
         if vm_type is None:
-            vm_type = self._get_vm_type(node, vm_id)
+            node, vm_type = self._resolve_vm(node, vm_id)
 
         _logger.info(f"Getting config for {vm_type.upper()} {vm_id} on node {node}")
 
@@ -338,6 +787,35 @@ class ProxmoxService(BaseHypervisorService):
             'vm_type': vm_type
         }
 
+    def get_vm_configs(self, vms):
+        """
+        Пакетный вариант get_vm_config: ресурсы всех гостей из одного
+        /cluster/resources?type=vm вместо определения типа и чтения config
+        для каждого гостя. maxcpu - число vCPU, maxmem и maxdisk - в байтах
+        (maxdisk - загрузочный диск, как и в get_vm_config).
+        """
+        wanted = {str(vm_id) for _node, vm_id in vms if vm_id}
+        if not wanted:
+            return {}
+
+        configs = {}
+        for res in self._guest_resources():
+            vm_id = str(res['vmid'])
+            if vm_id not in wanted:
+                continue
+            is_qemu = res['type'] == 'qemu'
+            configs[vm_id] = {
+                'cores': int(res.get('maxcpu') or 1),
+                'memory': int((res.get('maxmem') or 0) / 2 ** 20) or (1024 if is_qemu else 512),
+                'disk': int((res.get('maxdisk') or 0) / 2 ** 30) or (10 if is_qemu else 8),
+                'vm_type': res['type'],
+            }
+
+        missing = wanted - set(configs)
+        if missing:
+            _logger.warning(f"Proxmox guests not found while fetching configs: {', '.join(sorted(missing))}")
+        return configs
+
     def _extract_disk_size(self, config):
         """Извлекает размер диска из конфигурации QEMU VM"""
         for key, value in config.items():
@@ -363,27 +841,70 @@ class ProxmoxService(BaseHypervisorService):
         return 8  # Значение по умолчанию для LXC
 
 
-    def _get_vm_type(self, node, vm_id):
-        """Определяет тип VM (qemu или lxc) по VMID"""
-        try:
-            # Получаем список QEMU VM
-            qemu_vms = self._execute(self.connection.nodes(node).qemu.get) or []
-            for vm in qemu_vms:
-                if str(vm.get('vmid')) == str(vm_id):
-                    return 'qemu'
-        except Exception:
-            pass
+    def set_vm_type_hint(self, vm_id, vm_type):
+        """Запоминает тип гостя, сохраненный в Odoo, чтобы не определять его через API"""
+        if vm_id and vm_type in ('qemu', 'lxc'):
+            self._vm_type_hints[str(vm_id)] = vm_type
 
-        try:
-            # Получаем список LXC контейнеров
-            lxc_containers = self._execute(self.connection.nodes(node).lxc.get) or []
-            for container in lxc_containers:
-                if str(container.get('vmid')) == str(vm_id):
-                    return 'lxc'
-        except Exception:
-            pass
+    def _vm_index(self):
+        """Индекс гостей кластера, общий для всех запросов через эту сессию"""
+        return self.session.cache.setdefault('vm_index', {'built_at': None, 'entries': {}})
 
-        # По умолчанию считаем QEMU VM
-        return 'qemu'
+    def _refresh_vm_index(self, resources=None):
+        """
+        Перестраивает индекс одним запросом /cluster/resources?type=vm
+        (или из уже полученного ответа этого запроса).
+        """
+        if resources is None:
+            resources = self._execute(self.connection.cluster.resources.get, type='vm') or []
+        entries = {}
+        for res in resources:
+            if res.get('vmid') is not None and res.get('type') in ('qemu', 'lxc'):
+                entries[str(res['vmid'])] = (res.get('node'), res['type'])
+
+        index = self._vm_index()
+        index['entries'] = entries
+        index['built_at'] = time.monotonic()
+        _logger.debug(f"Proxmox VM index refreshed: {len(entries)} guests")
+        return entries
+
+    def _remember_vm(self, node, vm_id, vm_type):
+        self._vm_index()['entries'][str(vm_id)] = (node, vm_type)
+
+    def _forget_vm(self, vm_id):
+        self._vm_index()['entries'].pop(str(vm_id), None)
+        self._vm_type_hints.pop(str(vm_id), None)
+
+    def _resolve_vm(self, node, vm_id):
+        """
+        Определяет ноду и тип гостя (qemu или lxc) по VMID.
+        Порядок: тип из Odoo -> свежий индекс -> обновление индекса при промахе.
+        """
+        key = str(vm_id)
+        hinted_type = self._vm_type_hints.get(key)
+        if hinted_type:
+            return node, hinted_type
+
+        index = self._vm_index()
+        is_fresh = index['built_at'] is not None and time.monotonic() - index['built_at'] < self.VM_INDEX_TTL
+        entry = index['entries'].get(key) if is_fresh else None
+
+        if entry is None:
+            try:
+                entry = self._refresh_vm_index().get(key)
+            except Exception as e:
+                _logger.warning(f"Could not refresh Proxmox VM index: {e}")
+
+        if entry is None:
+            # По умолчанию считаем QEMU VM
+            _logger.warning(f"VMID {vm_id} not found in cluster resources, assuming QEMU on node {node}")
+            return node, 'qemu'
 
+        indexed_node, vm_type = entry
+        if indexed_node and node and indexed_node != node:
+            _logger.info(f"VMID {vm_id} is on node {indexed_node}, not {node} (migrated?)")
+        return indexed_node or node, vm_type
 
+    def _get_vm_type(self, node, vm_id):
+        """Определяет тип VM (qemu или lxc) по VMID"""
+        return self._resolve_vm(node, vm_id)[1]
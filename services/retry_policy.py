@@ -0,0 +1,181 @@
+# vm_rental/services/retry_policy.py
+# -*- coding: utf-8 -*-
+import logging
+import random
+import socket
+import threading
+import time
+from collections import Counter
+
+import requests
+
+_logger = logging.getLogger(__name__)
+
+# Классы ошибок
+ERROR_CONNECT = 'connect'          # запрос не дошел до сервера (отказ/таймаут подключения)
+ERROR_TIMEOUT = 'timeout'          # сервер не ответил вовремя, запрос мог быть выполнен
+ERROR_NETWORK = 'network'          # соединение оборвано во время запроса
+ERROR_THROTTLED = 'throttled'      # 429 - сервер отклонил запрос
+ERROR_UNAVAILABLE = 'unavailable'  # 503 - сервис временно недоступен
+ERROR_GATEWAY = 'gateway'          # 502/504 - неизвестно, дошел ли запрос
+ERROR_SERVER = 'server'            # прочие 5xx
+ERROR_AUTH = 'auth'                # 401/403
+ERROR_CLIENT = 'client'            # прочие 4xx
+ERROR_UNKNOWN = 'unknown'
+
+# Ошибки, при которых запрос можно безопасно повторить
+READ_RETRYABLE = frozenset({
+    ERROR_CONNECT, ERROR_TIMEOUT, ERROR_NETWORK, ERROR_THROTTLED,
+    ERROR_UNAVAILABLE, ERROR_GATEWAY, ERROR_SERVER,
+})
+# Мутации (clone, snapshot, ...) повторяем, только если сервер их точно не выполнял
+WRITE_RETRYABLE = frozenset({ERROR_CONNECT, ERROR_THROTTLED, ERROR_UNAVAILABLE})
+
+# Ошибки, говорящие о недоступности самого хоста
+CONNECTION_ERRORS = frozenset({ERROR_CONNECT, ERROR_TIMEOUT, ERROR_NETWORK})
+
+
+def classify_status(status_code):
+    """Класс ошибки по HTTP-коду ответа"""
+    if status_code in (401, 403):
+        return ERROR_AUTH
+    if status_code == 429:
+        return ERROR_THROTTLED
+    if status_code == 503:
+        return ERROR_UNAVAILABLE
+    if status_code in (502, 504):
+        return ERROR_GATEWAY
+    if 500 <= status_code < 600:
+        return ERROR_SERVER
+    if 400 <= status_code < 500:
+        return ERROR_CLIENT
+    return ERROR_UNKNOWN
+
+
+def classify_error(error):
+    """
+    Класс ошибки по типу исключения и HTTP-коду (без разбора текста сообщения).
+    Сервисы могут расширять классификацию через _classify_error.
+    """
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        response = getattr(error, 'response', None)
+        status_code = getattr(response, 'status_code', None)
+    if isinstance(status_code, int):
+        return classify_status(status_code)
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return ERROR_CONNECT
+    if isinstance(error, requests.exceptions.ConnectionError):
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        if isinstance(reason, (ConnectionRefusedError, socket.gaierror)) or 'NewConnectionError' in type(reason).__name__:
+            return ERROR_CONNECT
+        return ERROR_NETWORK
+    if isinstance(error, (requests.exceptions.Timeout, socket.timeout, TimeoutError)):
+        return ERROR_TIMEOUT
+    if isinstance(error, (ConnectionRefusedError, socket.gaierror)):
+        return ERROR_CONNECT
+    if isinstance(error, (ConnectionError, OSError)):
+        return ERROR_NETWORK
+    return ERROR_UNKNOWN
+
+
+class RetryPolicy:
+    """
+    Политика повторов: экспоненциальная задержка с полным джиттером,
+    ограничение числа попыток и общий бюджет времени на операцию.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0, budget=30.0, retryable=READ_RETRYABLE):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.retryable = frozenset(retryable)
+
+    def backoff(self, attempt):
+        """Задержка перед попыткой attempt + 1 (attempt начинается с 1)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def should_retry(self, error_class, attempt):
+        return error_class in self.retryable and attempt < self.max_attempts
+
+
+# Политики по умолчанию
+READ_POLICY = RetryPolicy(max_attempts=4, base_delay=0.5, max_delay=8.0, budget=30.0, retryable=READ_RETRYABLE)
+WRITE_POLICY = RetryPolicy(max_attempts=3, base_delay=1.0, max_delay=8.0, budget=60.0, retryable=WRITE_RETRYABLE)
+
+
+class CallStats:
+    """Счетчики вызовов гипервизоров (success/failure/retry) по серверам в рамках процесса"""
+
+    OUTCOMES = ('success', 'failure', 'retry')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def record(self, key, outcome):
+        with self._lock:
+            self._counters.setdefault(key, Counter())[outcome] += 1
+
+    def get(self, key):
+        with self._lock:
+            counter = self._counters.get(key, Counter())
+            return {outcome: counter[outcome] for outcome in self.OUTCOMES}
+
+    def reset(self, key=None):
+        with self._lock:
+            if key is None:
+                self._counters.clear()
+            else:
+                self._counters.pop(key, None)
+
+
+# Единые счетчики на процесс
+call_stats = CallStats()
+
+
+def run_with_policy(func, policy, classify=classify_error, stats_key=None, description='hypervisor call',
+                    deadline=None):
+    """
+    Выполняет func() по политике повторов.
+
+    Args:
+        func: вызываемый объект без аргументов
+        policy: RetryPolicy
+        classify: функция исключение -> класс ошибки
+        stats_key: ключ счетчиков call_stats (обычно (база, id сервера))
+        description: описание операции для логов
+        deadline: абсолютный срок (time.monotonic()), сужающий бюджет политики
+
+    Returns:
+        tuple: (результат, None) при успехе или (None, (исключение, класс ошибки)) при неудаче
+    """
+    started = time.monotonic()
+    budget_end = started + policy.budget
+    if deadline is not None:
+        budget_end = min(budget_end, deadline)
+
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            result = func()
+        except Exception as e:
+            error_class = classify(e)
+            delay = policy.backoff(attempt)
+            if policy.should_retry(error_class, attempt) and time.monotonic() + delay < budget_end:
+                _logger.warning(f"{description} failed ({error_class}, attempt {attempt}/{policy.max_attempts}), "
+                                f"retrying in {delay:.2f}s: {e}")
+                if stats_key is not None:
+                    call_stats.record(stats_key, 'retry')
+                time.sleep(delay)
+                continue
+            if stats_key is not None:
+                call_stats.record(stats_key, 'failure')
+            return None, (e, error_class)
+        else:
+            if stats_key is not None:
+                call_stats.record(stats_key, 'success')
+            return result, None
@@ -3,26 +3,69 @@
 from pyVim import connect
 from pyVmomi import vim, vmodl
 from .base_service import BaseHypervisorService, HypervisorOperationError
+from .retry_policy import ERROR_AUTH
+from .deadline import cap_timeout
 from odoo.exceptions import UserError
+import copy
 import logging
+import socket
 import ssl
 import time
 
 _logger = logging.getLogger(__name__)
 
+# Режимы ожидания задач (как в concurrent.futures.wait)
+FIRST_COMPLETED = 'FIRST_COMPLETED'
+ALL_COMPLETED = 'ALL_COMPLETED'
+
+
 class VmwareService(BaseHypervisorService):
 
-    def __init__(self, server_record):
-        super().__init__(server_record)
-        self.content = self.connection.RetrieveContent()
+    # Шаблоны ищутся по всему vCenter, а не по ноде
+    TEMPLATES_PER_NODE = False
+    # Количество объектов на страницу RetrievePropertiesEx
+    PROPERTY_PAGE_SIZE = 500
+    # Ожидание задач: общий лимит и длительность одного WaitForUpdatesEx, сек.
+    TASK_WAIT_TIMEOUT = 600
+    TASK_UPDATE_WAIT = 30
+    TASK_FINAL_STATES = (vim.TaskInfo.State.success, vim.TaskInfo.State.error)
+    # Индекс имя -> moref: время жизни и минимальный интервал перестроения при промахе, сек.
+    MOREF_INDEX_TTL = 300
+    MOREF_INDEX_MISS_REFRESH = 10
+    # Типы объектов индекса (порядок важен: подклассы проверяются через isinstance)
+    MOREF_INDEX_TYPES = (
+        ('datastore', vim.Datastore),
+        ('host', vim.HostSystem),
+        ('compute_resource', vim.ComputeResource),
+        ('resource_pool', vim.ResourcePool),
+        ('folder', vim.Folder),
+    )
+    # InstantClone_Task доступен начиная с этой версии API
+    INSTANT_CLONE_MIN_API = (6, 7)
+    # Время жизни сведений об источнике клонирования (снапшот, питание, железо), сек.
+    CLONE_SOURCE_TTL = 300
+    CLONE_SOURCE_PATHS = ['snapshot.currentSnapshot', 'runtime.powerState', 'config.hardware.numCPU',
+                          'config.hardware.memoryMB', 'config.hardware.device']
+
+    def __init__(self, server_record, session=None):
+        super().__init__(server_record, session=session)
+        # ServiceContent не меняется в рамках сессии - получаем его один раз
+        self.content = self.session.cache.get('content')
+        if self.content is None:
+            self.content = self.session.cache['content'] = self.connection.RetrieveContent()
 
     def _connect(self):
         try:
-            si = connect.SmartConnectNoSSL(
+            # SmartConnect не различает таймауты подключения и чтения - сначала быстро
+            # проверяем доступность порта с connect_timeout
+            socket.create_connection((self.server.host, 443), timeout=self._connect_timeout).close()
+            si = connect.SmartConnect(
                 host=self.server.host,
                 user=self.server.vmware_user,
                 pwd=self.server.vmware_password,
-                port=443
+                port=443,
+                disableSslCertValidation=True,
+                httpConnectionTimeout=self._read_timeout,
             )
             if not si:
                 raise ConnectionError("Could not connect to vCenter.")
@@ -31,19 +74,209 @@ class VmwareService(BaseHypervisorService):
             _logger.error(f"VMware connection failed: {e}")
             raise ConnectionError(f"Could not connect to vCenter {self.server.host}.") from e
 
+    @staticmethod
+    def _close_connection(connection):
+        connect.Disconnect(connection)
+
+    def ping(self):
+        """CurrentTime - самый дешевый вызов, требующий живой сессии."""
+        return bool(self.connection.CurrentTime())
+
     # --- Вспомогательные методы ---
+
+    def _classify_error(self, error):
+        if isinstance(error, (vim.fault.NotAuthenticated, vim.fault.InvalidLogin)):
+            return ERROR_AUTH
+        return super()._classify_error(error)
     
-    def _wait_for_task(self, task):
+    def _wait_for_tasks(self, tasks, timeout=None, return_when=ALL_COMPLETED):
+        """
+        Ожидает задачи VMware через WaitForUpdatesEx по свойству info.state,
+        без периодического опроса: vCenter сам присылает изменения.
+
+        Args:
+            tasks: набор vim.Task (можно ждать десятки задач сразу)
+            timeout: общее время ожидания, сек.
+            return_when: FIRST_COMPLETED - вернуться при завершении любой задачи,
+                         ALL_COMPLETED - после завершения всех
+
+        Returns:
+            tuple: (done, pending) - списки завершенных (success/error) и еще выполняющихся задач
+        """
+        tasks = list(tasks)
+        if not tasks:
+            return [], []
+
+        PC = vmodl.query.PropertyCollector
+        tasks_by_id = {task._moId: task for task in tasks}
+        finished = set()
+        deadline = time.monotonic() + cap_timeout(timeout or self.TASK_WAIT_TIMEOUT)
+        # Ответ WaitForUpdatesEx должен прийти раньше таймаута чтения сокета
+        update_wait = max(min(self.TASK_UPDATE_WAIT, self._read_timeout - 5), 1)
+
+        # Отдельный коллектор, чтобы фильтры не пересекались с другими ожиданиями сессии
+        collector = self.content.propertyCollector.CreatePropertyCollector()
+        try:
+            collector.CreateFilter(PC.FilterSpec(
+                objectSet=[PC.ObjectSpec(obj=task, skip=False) for task in tasks],
+                propSet=[PC.PropertySpec(type=vim.Task, pathSet=['info.state'], all=False)],
+            ), partialUpdates=True)
+
+            version = ''
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                options = PC.WaitOptions(maxWaitSeconds=max(int(min(remaining, update_wait)), 1))
+                update = collector.WaitForUpdatesEx(version=version, options=options)
+                if update is None:
+                    # Истек maxWaitSeconds без изменений
+                    continue
+                version = update.version
+                for filter_update in update.filterSet or []:
+                    for object_update in filter_update.objectSet or []:
+                        for change in object_update.changeSet or []:
+                            if change.name == 'info.state' and change.val in self.TASK_FINAL_STATES:
+                                finished.add(object_update.obj._moId)
+
+                if finished and (return_when == FIRST_COMPLETED or len(finished) == len(tasks_by_id)):
+                    break
+        finally:
+            try:
+                collector.DestroyPropertyCollector()
+            except Exception as e:
+                _logger.debug(f"Could not destroy task property collector: {e}")
+
+        done = [task for moid, task in tasks_by_id.items() if moid in finished]
+        pending = [task for moid, task in tasks_by_id.items() if moid not in finished]
+        return done, pending
+
+    def _task_result(self, task):
+        """Результат завершенной задачи или UserError с текстом ошибки VMware."""
+        info = task.info
+        if info.state == vim.TaskInfo.State.success:
+            return info.result
+        error_msg = info.error.msg if info.error else "Unknown VMware task error"
+        _logger.error(f"VMware task failed: {error_msg}")
+        raise UserError(f"VMware task failed: {error_msg}")
+
+    def _wait_for_task(self, task, timeout=None):
         """Ожидает завершения задачи VMware."""
-        while task.info.state in [vim.TaskInfo.State.running, vim.TaskInfo.State.queued]:
-            time.sleep(2)
-        
-        if task.info.state == vim.TaskInfo.State.success:
-            return task.info.result
+        done, pending = self._wait_for_tasks([task], timeout=timeout)
+        if pending:
+            raise UserError(f"VMware task {task._moId} did not finish in {timeout or self.TASK_WAIT_TIMEOUT} seconds")
+        return self._task_result(task)
+
+    def _retrieve_properties(self, obj_type, path_set, objects=None, container=None):
+        """
+        Читает только нужные свойства объектов через PropertyCollector постранично
+        (RetrievePropertiesEx/ContinueRetrievePropertiesEx) вместо обращения
+        к свойствам каждого объекта отдельным SOAP-запросом.
+
+        Args:
+            obj_type: тип объектов (vim.VirtualMachine и т.п.) или список типов
+            path_set: список путей свойств ('name', 'config.template', ...), общий для всех типов,
+                или словарь {тип: список путей}
+            objects: конкретные объекты; если не заданы - все объекты типа в container
+            container: корень поиска (по умолчанию rootFolder)
+
+        Returns:
+            list: пары (managed object, {путь: значение}); незаданные свойства отсутствуют
+        """
+        PC = vmodl.query.PropertyCollector
+        obj_types = list(obj_type) if isinstance(obj_type, (list, tuple)) else [obj_type]
+        view = None
+        if objects is None:
+            view = self.content.viewManager.CreateContainerView(
+                container or self.content.rootFolder, obj_types, True)
+            traversal = PC.TraversalSpec(name='traverseView', path='view', skip=False, type=vim.view.ContainerView)
+            object_specs = [PC.ObjectSpec(obj=view, skip=True, selectSet=[traversal])]
         else:
-            error_msg = task.info.error.msg if task.info.error else "Unknown VMware task error"
-            _logger.error(f"VMware task failed: {error_msg}")
-            raise UserError(f"VMware task failed: {error_msg}")
+            if not objects:
+                return []
+            object_specs = [PC.ObjectSpec(obj=obj, skip=False) for obj in objects]
+
+        filter_spec = PC.FilterSpec(
+            objectSet=object_specs,
+            propSet=[PC.PropertySpec(type=t, pathSet=list(path_set[t] if isinstance(path_set, dict) else path_set),
+                                     all=False) for t in obj_types],
+        )
+        options = PC.RetrieveOptions(maxObjects=self.PROPERTY_PAGE_SIZE)
+        collector = self.content.propertyCollector
+
+        results = []
+        try:
+            page = self._call(lambda: collector.RetrievePropertiesEx(specSet=[filter_spec], options=options),
+                              description="vCenter RetrievePropertiesEx")
+            while page:
+                for obj_content in page.objects or []:
+                    props = {prop.name: prop.val for prop in obj_content.propSet or []}
+                    results.append((obj_content.obj, props))
+                if not page.token:
+                    break
+                token = page.token
+                page = self._call(lambda: collector.ContinueRetrievePropertiesEx(token=token),
+                                  description="vCenter ContinueRetrievePropertiesEx")
+        finally:
+            if view is not None:
+                view.Destroy()
+        return results
+
+    # --- Индекс имя -> moref ---
+
+    def _moref_index(self):
+        """
+        Индекс объектов инвентаря на уровне сессии:
+        {'built_at', 'by_name': {вид: {имя: moref}}, 'names': {moId: имя}, 'parents': {moId: moref}}
+        """
+        index = self.session.cache.get('moref_index')
+        if index is None or time.monotonic() - index['built_at'] > self.MOREF_INDEX_TTL:
+            index = self._refresh_moref_index()
+        return index
+
+    def _refresh_moref_index(self):
+        """Перестраивает индекс одним запросом PropertyCollector (name + parent)."""
+        by_name = {kind: {} for kind, _cls in self.MOREF_INDEX_TYPES}
+        names = {}
+        parents = {}
+        index_types = [cls for _kind, cls in self.MOREF_INDEX_TYPES]
+        for obj, props in self._retrieve_properties(index_types, ['name', 'parent']):
+            name = props.get('name')
+            names[obj._moId] = name
+            parents[obj._moId] = props.get('parent')
+            for kind, cls in self.MOREF_INDEX_TYPES:
+                if isinstance(obj, cls):
+                    # Имена пулов и папок ("Resources", "vm") повторяются - оставляем первое
+                    by_name[kind].setdefault(name, obj)
+                    break
+
+        index = {'built_at': time.monotonic(), 'by_name': by_name, 'names': names, 'parents': parents}
+        self.session.cache['moref_index'] = index
+        return index
+
+    def _find_by_name(self, kind, name):
+        """
+        Возвращает moref объекта вида kind ('datastore', 'host', 'compute_resource',
+        'resource_pool', 'folder') по имени. При промахе индекс перестраивается,
+        но не чаще MOREF_INDEX_MISS_REFRESH.
+        """
+        if not name:
+            return None
+        index = self._moref_index()
+        obj = index['by_name'][kind].get(name)
+        if obj is None and time.monotonic() - index['built_at'] > self.MOREF_INDEX_MISS_REFRESH:
+            index = self._refresh_moref_index()
+            obj = index['by_name'][kind].get(name)
+        return obj
+
+    def _names_of(self, objects):
+        """Имена объектов из индекса; неизвестные объекты дочитываются одним запросом."""
+        names = self._moref_index()['names']
+        unknown = [obj for obj in objects if obj._moId not in names]
+        if unknown:
+            for obj, props in self._retrieve_properties(type(unknown[0]), ['name'], objects=unknown):
+                names[obj._moId] = props.get('name')
+        return [names.get(obj._moId) for obj in objects]
 
     def _get_vm_by_uuid(self, vm_uuid):
         """Находит объект ВМ по ее instanceUuid."""
@@ -70,92 +303,142 @@ class VmwareService(BaseHypervisorService):
     def list_nodes(self):
         """
         ИСПРАВЛЕНИЕ: Возвращаем "чистые" имена без суффиксов.
+        Кластеры и хосты вне кластеров берутся из индекса объектов сессии.
         """
-        nodes = []
-        # Ищем кластеры
-        container = self.content.viewManager.CreateContainerView(self.content.rootFolder, [vim.ClusterComputeResource], True)
-        for cluster in container.view:
-            nodes.append({'id': cluster.name, 'name': cluster.name})
-        container.Destroy()
-
-        # Ищем хосты, которые не в кластере
-        container = self.content.viewManager.CreateContainerView(self.content.rootFolder, [vim.HostSystem], True)
-        for host in container.view:
-            if not isinstance(host.parent, vim.ClusterComputeResource):
-                # Добавляем чистое имя хоста
-                nodes.append({'id': host.name, 'name': host.name})
-        container.Destroy()
-        
-        return [dict(t) for t in {tuple(d.items()) for d in nodes}]
+        index = self._moref_index()
+        nodes = set()
+        # Кластеры
+        for name, compute_resource in index['by_name']['compute_resource'].items():
+            if isinstance(compute_resource, vim.ClusterComputeResource):
+                nodes.add(name)
+        # Хосты, которые не в кластере
+        for name, host in index['by_name']['host'].items():
+            if not isinstance(index['parents'].get(host._moId), vim.ClusterComputeResource):
+                nodes.add(name)
+
+        return [{'id': name, 'name': name} for name in nodes]
 
-    # ... все остальные методы (list_storages, create_vm и т.д.) остаются без изменений ...
-    # Они уже ожидают "чистое" имя ноды, поэтому теперь все должно работать
     def list_storages(self, node_id):
         if not node_id: return []
-        target_node = None
-        container = self.content.viewManager.CreateContainerView(self.content.rootFolder, [vim.ComputeResource], True)
-        for compute_resource in container.view:
-            if compute_resource.name == node_id:
-                target_node = compute_resource
-                break
-        container.Destroy()
+        target_node = self._find_by_name('compute_resource', node_id)
         if not target_node:
             _logger.warning(f"Could not find node '{node_id}' to list its storages.")
             return []
-        storages = []
-        for datastore in target_node.datastore:
-            storages.append({'id': datastore.name, 'name': datastore.name})
-        return storages
+        results = self._retrieve_properties(vim.ComputeResource, ['datastore'], objects=[target_node])
+        datastores = (results[0][1].get('datastore') or []) if results else []
+        return [{'id': name, 'name': name} for name in self._names_of(datastores)]
 
     def list_os_templates(self, node_id=None):
         # Этот метод ищет все шаблоны, он также не зависит от ноды
-        container = self.content.viewManager.CreateContainerView(self.content.rootFolder, [vim.VirtualMachine], True)
         templates = []
-        for vm in container.view:
-            if vm.config.template:
+        vm_props = self._retrieve_properties(vim.VirtualMachine, ['name', 'config.template', 'config.instanceUuid'])
+        for vm, props in vm_props:
+            if props.get('config.template'):
                 templates.append({
-                    'id': vm.summary.config.instanceUuid, 
-                    'name': vm.name,
-                    'vmid': vm.summary.config.instanceUuid
+                    'id': props.get('config.instanceUuid'),
+                    'name': props.get('name'),
+                    'vmid': props.get('config.instanceUuid')
                 })
-        container.Destroy()
         return templates
 
-    
     def list_all_vms(self, node_id):
         """
-        ИСПРАВЛЕНИЕ: Правильно обходим иерархию ComputeResource -> HostSystem -> VM.
+        VM ComputeResource одним запросом PropertyCollector по ContainerView ноды:
+        читаются только VM ее хостов, а не всего vCenter.
         """
         if not node_id:
             return []
-        
-        target_node = None
-        container = self.content.viewManager.CreateContainerView(self.content.rootFolder, [vim.ComputeResource], True)
-        for compute_resource in container.view:
-            if compute_resource.name == node_id:
-                target_node = compute_resource
-                break
-        container.Destroy()
-        
+
+        target_node = self._find_by_name('compute_resource', node_id)
         if not target_node:
             _logger.warning(f"Could not find node '{node_id}' to list its VMs.")
             return []
-            
+
         vms = []
-        # Проверяем, есть ли у ComputeResource свойство .host
-        if hasattr(target_node, 'host'):
-            # Итерируем по хостам внутри ComputeResource
-            for host in target_node.host:
-                # И уже у хоста берем список его ВМ
-                for vm in host.vm:
-                    if not vm.config.template:
-                        vms.append({
-                            'vmid': vm.summary.config.instanceUuid,
-                            'name': vm.name,
-                            'status': vm.summary.runtime.powerState,
-                        })
+        vm_props = self._retrieve_properties(vim.VirtualMachine, [
+            'name', 'config.template', 'config.instanceUuid', 'runtime.powerState'
+        ], container=target_node)
+        for vm, props in vm_props:
+            if props.get('config.template'):
+                continue
+            vms.append({
+                'vmid': props.get('config.instanceUuid'),
+                'name': props.get('name'),
+                'status': props.get('runtime.powerState'),
+            })
         return vms
 
+    def get_capacity(self):
+        """
+        Емкость кластеров/хостов и хранилищ одним обходом PropertyCollector:
+        summary.hardware и summary.quickStats хостов, ресурсы VM и summary хранилищ.
+        """
+        index = self._moref_index()
+        paths = {
+            vim.HostSystem: ['parent', 'summary.hardware', 'summary.quickStats', 'runtime.connectionState'],
+            vim.VirtualMachine: ['config.template', 'config.hardware.numCPU', 'config.hardware.memoryMB',
+                                 'runtime.host'],
+            vim.Datastore: ['summary', 'host'],
+        }
+        objects = self._retrieve_properties(list(paths), paths)
+
+        nodes = {}
+        host_nodes = {}
+        for obj, props in objects:
+            if not isinstance(obj, vim.HostSystem):
+                continue
+            parent = props.get('parent')
+            name = index['names'].get(parent._moId) if parent is not None else None
+            if not name:
+                continue
+            host_nodes[obj._moId] = name
+            node = nodes.setdefault(name, {'name': name, 'status': 'offline', 'maxcpu': 0, 'maxmem': 0,
+                                           'cpu_mhz': 0, 'used_mhz': 0, 'mem': 0,
+                                           'allocated_cpu': 0, 'allocated_mem': 0, 'guests': 0})
+            hardware = props.get('summary.hardware')
+            stats = props.get('summary.quickStats')
+            if props.get('runtime.connectionState') != 'connected' or hardware is None:
+                continue
+            # Емкость ноды - только подключенные хосты
+            node['status'] = 'online'
+            node['maxcpu'] += hardware.numCpuCores or 0
+            node['maxmem'] += hardware.memorySize or 0
+            node['cpu_mhz'] += (hardware.cpuMhz or 0) * (hardware.numCpuCores or 0)
+            if stats is not None:
+                node['used_mhz'] += stats.overallCpuUsage or 0
+                node['mem'] += (stats.overallMemoryUsage or 0) * 2 ** 20
+
+        storages = []
+        for obj, props in objects:
+            if isinstance(obj, vim.VirtualMachine):
+                host = props.get('runtime.host')
+                node = nodes.get(host_nodes.get(host._moId)) if host is not None else None
+                if node is None or props.get('config.template'):
+                    continue
+                node['allocated_cpu'] += props.get('config.hardware.numCPU') or 0
+                node['allocated_mem'] += (props.get('config.hardware.memoryMB') or 0) * 2 ** 20
+                node['guests'] += 1
+            elif isinstance(obj, vim.Datastore):
+                summary = props.get('summary')
+                if summary is None or not summary.accessible:
+                    continue
+                mounted_on = {host_nodes.get(mount.key._moId) for mount in props.get('host') or []}
+                for node_name in sorted(name for name in mounted_on if name):
+                    storages.append({
+                        'name': summary.name,
+                        'node': node_name,
+                        'content': 'images',
+                        'plugintype': summary.type,
+                        'shared': bool(summary.multipleHostAccess),
+                        'maxdisk': summary.capacity or 0,
+                        'disk': (summary.capacity or 0) - (summary.freeSpace or 0),
+                    })
+
+        for node in nodes.values():
+            node['cpu'] = node.pop('used_mhz') / node['cpu_mhz'] if node['cpu_mhz'] else 0
+            node.pop('cpu_mhz')
+        return {'nodes': list(nodes.values()), 'storages': storages}
+
     def get_next_vmid(self):
         """Для VMware ID генерируется при создании, возвращаем None."""
         return None
@@ -196,54 +479,204 @@ class VmwareService(BaseHypervisorService):
             self._wait_for_task(task)
         return True
 
-    def create_vm(self, node, name, template_vmid, cores, memory, disk, storage, **kwargs):
-        template = self._get_vm_by_uuid(template_vmid)
-        if not template: raise UserError(f"VMware Template with UUID {template_vmid} not found.")
-        
-        datastore = None
-        container = self.content.viewManager.CreateContainerView(self.content.rootFolder, [vim.Datastore], True)
-        for ds in container.view:
-            if ds.name == storage:
-                datastore = ds
-                break
-        container.Destroy()
-        if not datastore: raise UserError(f"Datastore '{storage}' not found.")
-        
-        # --- ФИНАЛЬНОЕ ИСПРАВЛЕНИЕ: Ищем конкретные типы ---
-        target_node = None
-        # Ищем среди хостов и кластеров
-        view_types = [vim.HostSystem, vim.ClusterComputeResource]
-        container = self.content.viewManager.CreateContainerView(self.content.rootFolder, view_types, True)
-        for res in container.view:
-            if res.name == node:
-                target_node = res
-                break
-        container.Destroy()
-        
-        if not target_node: raise UserError(f"Target node (Cluster or Host) '{node}' not found.")
-        # --- КОД ДЛЯ ГЛУБОКОГО ЛОГИРОВАНИЯ ---
-        _logger.info("--- DEBUGGING TARGET NODE ---")
-        _logger.info(f"Node Name from Odoo: {node}")
-        _logger.info(f"Found vSphere Object: {target_node}")
-        _logger.info(f"Type of vSphere Object: {type(target_node)}")
-        
-        _logger.info("--- DUMPING ALL ATTRIBUTES ---")
-        for prop in sorted(dir(target_node)):
-            if not prop.startswith('_'): # Пропускаем служебные атрибуты
+    # --- Групповые операции ---
+
+    # Метод одиночной операции -> (задача VM, состояния питания, в которых задача не нужна)
+    BULK_POWER_TASKS = {
+        'start_vm': ('PowerOnVM_Task', ('poweredOn',)),
+        'stop_vm': ('PowerOffVM_Task', ('poweredOff',)),
+        'suspend_vm': ('SuspendVM_Task', ('poweredOff', 'suspended')),
+    }
+    # До стольких VM ищем через FindByUuid, больше - одним проходом по инвентарю
+    FIND_BY_UUID_LIMIT = 10
+
+    def start_many(self, vms):
+        return self._power_many('start_vm', vms)
+
+    def stop_many(self, vms):
+        return self._power_many('stop_vm', vms)
+
+    def suspend_many(self, vms):
+        return self._power_many('suspend_vm', vms)
+
+    def _power_many(self, method, vms):
+        """Все задачи питания отправляются сразу и ожидаются одним циклом WaitForUpdatesEx"""
+        task_method, skip_states = self.BULK_POWER_TASKS[method]
+        vm_uuids = [str(vm_uuid) for _node, vm_uuid in vms]
+        found = self._find_vms(vm_uuids)
+
+        results = {}
+        tasks = {}
+        for vm_uuid in vm_uuids:
+            if vm_uuid not in found:
+                results[vm_uuid] = self._bulk_result(f"VMware VM with UUID {vm_uuid} not found.")
+                continue
+            vm, power_state = found[vm_uuid]
+            if power_state in skip_states:
+                results[vm_uuid] = self._bulk_result()
+                continue
+            try:
+                tasks[vm_uuid] = getattr(vm, task_method)()
+            except Exception as e:
+                _logger.error(f"Failed to submit {task_method} for VM {vm_uuid}: {e}")
+                results[vm_uuid] = self._bulk_result(e)
+
+        results.update(self._collect_task_results(tasks))
+        return results
+
+    def delete_many(self, vms):
+        """Выключение работающих VM одной волной задач, затем Destroy_Task для всех сразу"""
+        vm_uuids = [str(vm_uuid) for _node, vm_uuid in vms]
+        found = self._find_vms(vm_uuids)
+
+        results = {}
+        for vm_uuid in vm_uuids:
+            if vm_uuid not in found:
+                results[vm_uuid] = self._bulk_result(f"VMware VM with UUID {vm_uuid} not found.")
+
+        power_off = {}
+        for vm_uuid, (vm, power_state) in found.items():
+            if power_state != 'poweredOff':
                 try:
-                    value = getattr(target_node, prop)
-                    _logger.info(f"  - Attribute '{prop}': {value}")
+                    power_off[vm_uuid] = vm.PowerOffVM_Task()
                 except Exception as e:
-                    _logger.info(f"  - Attribute '{prop}': Could not read value ({e})")
-        _logger.info("--- END DEBUGGING ---")
-        # --- КОНЕЦ КОДА ДЛЯ ЛОГИРОВАНИЯ ---
-   
-                
+                    results[vm_uuid] = self._bulk_result(e)
+        for vm_uuid, result in self._collect_task_results(power_off).items():
+            if not result['success']:
+                results[vm_uuid] = result
+
+        destroy = {}
+        for vm_uuid, (vm, _power_state) in found.items():
+            if vm_uuid in results:
+                continue
+            try:
+                destroy[vm_uuid] = vm.Destroy_Task()
+            except Exception as e:
+                results[vm_uuid] = self._bulk_result(e)
+        results.update(self._collect_task_results(destroy))
+        return results
+
+    def _find_vms(self, vm_uuids):
+        """
+        instanceUuid -> (VM, runtime.powerState); ненайденные VM отсутствуют.
+        Состояние питания читается одним запросом PropertyCollector, а не свойством каждой VM.
+        """
+        wanted = {str(vm_uuid) for vm_uuid in vm_uuids if vm_uuid}
+        if not wanted:
+            return {}
+        if len(wanted) > self.FIND_BY_UUID_LIMIT:
+            return {
+                props.get('config.instanceUuid'): (vm, props.get('runtime.powerState'))
+                for vm, props in self._retrieve_properties(
+                    vim.VirtualMachine, ['config.instanceUuid', 'runtime.powerState'])
+                if props.get('config.instanceUuid') in wanted
+            }
+
+        uuid_by_moid = {}
+        for vm_uuid in wanted:
+            vm = self.content.searchIndex.FindByUuid(uuid=vm_uuid, vmSearch=True, instanceUuid=True)
+            if vm:
+                uuid_by_moid[vm._moId] = (vm_uuid, vm)
+        vms = [vm for _vm_uuid, vm in uuid_by_moid.values()]
+        return {
+            uuid_by_moid[vm._moId][0]: (vm, props.get('runtime.powerState'))
+            for vm, props in self._retrieve_properties(vim.VirtualMachine, ['runtime.powerState'], objects=vms)
+        }
+
+    def _collect_task_results(self, tasks):
+        """
+        Ожидает задачи {ключ: vim.Task} вместе и читает их итог одним запросом.
+
+        Returns:
+            dict: ключ -> {'success', 'error'} (формат _bulk_result)
+        """
+        if not tasks:
+            return {}
+        done, pending = self._wait_for_tasks(tasks.values())
+        infos = {
+            task._moId: props
+            for task, props in self._retrieve_properties(vim.Task, ['info.state', 'info.error'], objects=done)
+        }
+
+        results = {}
+        for key, task in tasks.items():
+            info = infos.get(task._moId)
+            if info is None:
+                results[key] = self._bulk_result(
+                    f"VMware task {task._moId} did not finish in {self.TASK_WAIT_TIMEOUT} seconds")
+            elif info.get('info.state') == vim.TaskInfo.State.success:
+                results[key] = self._bulk_result()
+            else:
+                error = info.get('info.error')
+                error_msg = error.msg if error else "Unknown VMware task error"
+                _logger.error(f"VMware task failed: {error_msg}")
+                results[key] = self._bulk_result(f"VMware task failed: {error_msg}")
+        return results
+
+    def _clone_source(self, template_uuid):
+        """
+        Сведения о шаблоне для выбора способа клонирования, одним запросом с кэшем в сессии:
+        {'vm', 'snapshot', 'powered_on', 'cores', 'memory', 'disk'} (disk - первый VirtualDisk)
+        """
+        cache = self.session.cache.setdefault('clone_sources', {})
+        cached = cache.get(template_uuid)
+        if cached and time.monotonic() - cached['fetched_at'] < self.CLONE_SOURCE_TTL:
+            return cached
+
+        template = self._get_vm_by_uuid(template_uuid)
+        props = next((props for _vm, props in self._retrieve_properties(
+            vim.VirtualMachine, self.CLONE_SOURCE_PATHS, objects=[template])), {})
+        devices = props.get('config.hardware.device') or []
+        source = {
+            'fetched_at': time.monotonic(),
+            'vm': template,
+            'snapshot': props.get('snapshot.currentSnapshot'),
+            'powered_on': props.get('runtime.powerState') == vim.VirtualMachinePowerState.poweredOn,
+            'cores': props.get('config.hardware.numCPU'),
+            'memory': props.get('config.hardware.memoryMB'),
+            'disk': next((d for d in devices if isinstance(d, vim.vm.device.VirtualDisk)), None),
+        }
+        cache[template_uuid] = source
+        return source
+
+    def _clone_kind(self, source, cores=None, memory=None, disk=None):
+        """
+        Самый быстрый доступный способ клонирования: 'instant' (InstantClone работающей VM,
+        CPU и память - как у источника), 'linked' (дочерний диск от текущего снапшота) или 'full'.
+        Диск связанного и instant-клона увеличить нельзя - для большего диска нужен полный клон.
+        """
+        source_disk_gb = source['disk'].capacityInKB / (1024 * 1024) if source['disk'] else 0
+        if disk and disk > source_disk_gb:
+            return 'full'
+        api_version = tuple(int(part) for part in (self.content.about.apiVersion or '0').split('.')[:2])
+        if (source['powered_on'] and api_version >= self.INSTANT_CLONE_MIN_API
+                and cores in (None, source['cores']) and memory in (None, source['memory'])):
+            return 'instant'
+        if source['snapshot']:
+            return 'linked'
+        return 'full'
+
+    def linked_clone_possible(self, node, template_vmid, storage, cores=None, memory=None, disk=None):
+        return self._clone_kind(self._clone_source(template_vmid), cores, memory, disk) != 'full'
+
+    def _relocate_spec(self, node, storage):
+        """Размещение клона: хранилище, пул ресурсов и (для отдельного хоста) хост"""
+        datastore = self._find_by_name('datastore', storage)
+        if not datastore: raise UserError(f"Datastore '{storage}' not found.")
+
+        # Нода - кластер или отдельный хост
+        target_node = self._find_by_name('compute_resource', node)
+        if not isinstance(target_node, vim.ClusterComputeResource):
+            target_node = self._find_by_name('host', node)
+
+        if not target_node: raise UserError(f"Target node (Cluster or Host) '{node}' not found.")
+
         # Создаем спецификацию с пулом. Для standalone хоста это его корневой пул.
-        relospec = vim.vm.RelocateSpec(datastore=datastore)      
+        relospec = vim.vm.RelocateSpec(datastore=datastore)
         if isinstance(target_node, vim.HostSystem):
             # Для хоста пул ресурсов находится у его родителя
-            pool = target_node.parent.resourcePool
+            parent = self._moref_index()['parents'].get(target_node._moId) or target_node.parent
+            pool = parent.resourcePool
             if not pool: raise UserError(f"Could not find a Resource Pool on the parent of host '{node}'.")
             relospec.pool = pool
             relospec.host = target_node # Указываем сам хост
@@ -252,34 +685,46 @@ class VmwareService(BaseHypervisorService):
             pool = target_node.resourcePool
             if not pool: raise UserError(f"The selected cluster '{node}' does not have a Resource Pool.")
             relospec.pool = pool
+        return relospec
+
+    def create_vm(self, node, name, template_vmid, cores, memory, disk, storage, linked=False, **kwargs):
+        """
+        Провижининг одной задачей: CPU, память и размер диска задаются в CloneSpec.config,
+        VM включается самим клонированием (без отдельных ReconfigVM_Task и PowerOnVM_Task).
+        При linked используется InstantClone или связанный клон от снапшота шаблона,
+        если они возможны, иначе - полный клон.
+        """
+        source = self._clone_source(template_vmid)
+        template = source['vm']
+        relospec = self._relocate_spec(node, storage)
+
+        kind = self._clone_kind(source, cores, memory, disk) if linked else 'full'
+        if linked and kind == 'full':
+            _logger.info(f"Linked clone of template {template_vmid} is not possible, making a full clone")
+
+        if kind == 'instant':
+            task = template.InstantClone_Task(spec=vim.vm.InstantCloneSpec(name=name, location=relospec))
+        else:
+            config_spec = vim.vm.ConfigSpec(numCPUs=cores, memoryMB=memory)
+            if kind == 'full' and source['disk'] and disk:
+                # Диск дочернего (связанного) клона не увеличивается - только для полного
+                disk_spec = vim.vm.device.VirtualDeviceSpec()
+                disk_spec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
+                disk_spec.device = copy.copy(source['disk'])
+                disk_spec.device.capacityInKB = max(disk * 1024 * 1024, source['disk'].capacityInKB)
+                config_spec.deviceChange = [disk_spec]
+            clonespec = vim.vm.CloneSpec(location=relospec, powerOn=True, template=False, config=config_spec)
+            if kind == 'linked':
+                relospec.diskMoveType = vim.vm.RelocateSpec.DiskMoveOptions.createNewChildDiskBacking
+                clonespec.snapshot = source['snapshot']
+            task = template.Clone(folder=template.parent, name=name, spec=clonespec)
 
-  
-        clonespec = vim.vm.CloneSpec(location=relospec, powerOn=False, template=False)
-        
-        task = template.Clone(folder=template.parent, name=name, spec=clonespec)
         new_vm = self._wait_for_task(task)
         if not new_vm: raise UserError("VMware clone task failed to return a new VM object.")
-        
-        config_spec = vim.vm.ConfigSpec(numCPUs=cores, memoryMB=memory)
-        disk_spec = vim.vm.device.VirtualDeviceSpec()
-        disk_spec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
-        
-        for device in new_vm.config.hardware.device:
-            if isinstance(device, vim.vm.device.VirtualDisk):
-                disk_spec.device = device
-                disk_spec.device.capacityInKB = disk * 1024 * 1024
-                break
-        if disk_spec.device:
-            config_spec.deviceChange = [disk_spec]
-            
-        task = new_vm.ReconfigVM_Task(spec=config_spec)
-        self._wait_for_task(task)
-        
-        task = new_vm.PowerOnVM_Task()
-        self._wait_for_task(task)
-        
-        return new_vm.summary.config.instanceUuid
 
+        props = next((props for _vm, props in self._retrieve_properties(
+            vim.VirtualMachine, ['config.instanceUuid'], objects=[new_vm])), {})
+        return props.get('config.instanceUuid')
 
     # --- Управление снапшотами ---
 
@@ -287,6 +732,8 @@ class VmwareService(BaseHypervisorService):
         vm = self._get_vm_by_uuid(vm_uuid)
         task = vm.CreateSnapshot_Task(name=snap_name, description=description, memory=False, quiesce=True)
         self._wait_for_task(task)
+        # Текущий снапшот - база связанных клонов, если VM служит шаблоном
+        self.session.cache.get('clone_sources', {}).pop(vm_uuid, None)
         return True
 
     def rollback_snapshot(self, node, vm_uuid, snap_name):
@@ -307,6 +754,7 @@ class VmwareService(BaseHypervisorService):
         
         task = snapshot.RemoveSnapshot_Task(removeChildren=False)
         self._wait_for_task(task)
+        self.session.cache.get('clone_sources', {}).pop(vm_uuid, None)
         return True
 
     # --- Консоль ---
@@ -346,6 +794,25 @@ class VmwareService(BaseHypervisorService):
         self._wait_for_task(task)
         return True
 
+    # Свойства, необходимые для расчета конфигурации VM
+    VM_CONFIG_PATHS = ['config.instanceUuid', 'config.hardware.numCPU', 'config.hardware.memoryMB',
+                       'config.hardware.device']
+
+    def _config_from_properties(self, props):
+        """Конфигурация VM из свойств, полученных PropertyCollector"""
+        # Вычисляем размер диска (сумма всех дисков)
+        total_disk_gb = 0
+        for device in props.get('config.hardware.device') or []:
+            if isinstance(device, vim.vm.device.VirtualDisk) and device.capacityInKB:
+                total_disk_gb += int(device.capacityInKB / 1024 / 1024)  # KB -> GB
+
+        return {
+            'cores': props.get('config.hardware.numCPU'),
+            'memory': props.get('config.hardware.memoryMB'),
+            'disk': total_disk_gb or 20,  # Если не удалось вычислить, берем 20GB
+            'vm_type': 'vmware'
+        }
+
     def get_vm_config(self, vm_uuid):
         """Получает конфигурацию существующей VM в VMware"""
         try:
@@ -353,21 +820,36 @@ class VmwareService(BaseHypervisorService):
             if not vm:
                 raise HypervisorOperationError(f"VM with UUID {vm_uuid} not found")
 
-            # Получаем конфигурацию
-            config = vm.summary.config
-
-            # Вычисляем размер диска (сумма всех дисков)
-            total_disk_gb = 0
-            for device in vm.config.hardware.device:
-                if hasattr(device, 'capacityInKB'):
-                    total_disk_gb += int(device.capacityInKB / 1024 / 1024)  # KB -> GB
-
-            return {
-                'cores': config.numCpu,
-                'memory': config.memorySizeMB,
-                'disk': total_disk_gb or 20,  # Если не удалось вычислить, берем 20GB
-                'vm_type': 'vmware'
-            }
+            # Все нужные свойства одним запросом
+            results = self._retrieve_properties(vim.VirtualMachine, self.VM_CONFIG_PATHS, objects=[vm])
+            if not results:
+                raise HypervisorOperationError(f"VM with UUID {vm_uuid} has no configuration")
+            return self._config_from_properties(results[0][1])
         except Exception as e:
             _logger.error(f"Failed to get VMware VM config for {vm_uuid}: {e}")
             raise HypervisorOperationError(f"Cannot get VM {vm_uuid} configuration: {e}")
+
+    def get_vm_configs(self, vms):
+        """
+        Пакетный вариант get_vm_config: поиск VM по UUID (_find_vms), затем
+        конфигурация только найденных VM одним запросом PropertyCollector.
+
+        Args:
+            vms: список пар (node, instanceUuid); node не используется
+
+        Returns:
+            dict: instanceUuid -> конфигурация (как у get_vm_config); ненайденные VM отсутствуют
+        """
+        wanted = {str(vm_uuid) for _node, vm_uuid in vms if vm_uuid}
+        if not wanted:
+            return {}
+
+        found = [vm for vm, _power_state in self._find_vms(wanted).values()]
+        configs = {}
+        for vm, props in self._retrieve_properties(vim.VirtualMachine, self.VM_CONFIG_PATHS, objects=found):
+            configs[props.get('config.instanceUuid')] = self._config_from_properties(props)
+
+        missing = wanted - set(configs)
+        if missing:
+            _logger.warning(f"VMware VMs not found while fetching configs: {', '.join(sorted(missing))}")
+        return configs
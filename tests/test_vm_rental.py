@@ -1,8 +1,11 @@
 # tests/test_vm_rental.py
 
+from datetime import timedelta
+from odoo import api, fields
 from odoo.tests import common
 from odoo.exceptions import UserError, ValidationError
 from unittest.mock import patch, MagicMock
+import time
 
 class TestVmRental(common.TransactionCase):
     
@@ -86,21 +89,132 @@ class TestVmRental(common.TransactionCase):
         self.assertEqual(vm.state, 'pending')
         self.assertFalse(vm.hypervisor_vm_ref)
         
+        # VMID выделяется из диапазона сервера (уже сверенного с гипервизором)
+        self.hypervisor_server.write({'vmid_range_start': 100, 'vmid_range_end': 199})
+        self.hypervisor_server.vmid_reconciled_at = fields.Datetime.now()
+
         # Мокаем сервис гипервизора
-        with patch.object(vm, '_get_hypervisor_service') as mock_service:
-            mock_service.return_value.get_next_vmid.return_value = '100'
-            mock_service.return_value.create_vm.return_value = 'task-123'
+        with patch.object(type(vm), '_get_hypervisor_service') as mock_service:
+            mock_service.return_value.clone_vm.return_value = 'UPID:test-node-01:0001:clone'
+            mock_service.return_value.configure_vm.return_value = None
+            mock_service.return_value.resize_disk.return_value = None
             
-            # Провижининг ВМ
+            # Провижининг ВМ: клонирование запускается в фоне
             vm.action_provision_vm()
+            self.assertEqual(vm.state, 'provisioning')
+
+            task = self.env['hypervisor.task'].search([('vm_id', '=', vm.id)])
+            self.assertEqual(task.operation, 'clone')
+            self.assertEqual(task.node, 'test-node-01')
+
+            # Завершение клонирования запускает остальные шаги
+            task._mark_finished('OK')
+            mock_service.return_value.configure_vm.assert_called_once_with('test-node-01', '100', 2, 2048)
+            mock_service.return_value.resize_disk.assert_called_once_with('test-node-01', '100', 20)
             
             # Проверяем изменения состояния
+            self.assertEqual(task.state, 'done')
             self.assertEqual(vm.state, 'active')
             self.assertEqual(vm.hypervisor_vm_ref, '100')
             self.assertEqual(vm.hypervisor_node_name, 'test-node-01')
             self.assertTrue(vm.start_date)
+            self.assertEqual(self.env['hypervisor.vmid.reservation'].search([
+                ('server_id', '=', self.hypervisor_server.id), ('vmid', '=', 100)]).state, 'in_use')
             self.assertTrue(vm.end_date)
-    
+
+            # Этапы провижининга и время до готовности записаны в журнал аудита
+            logs = self.env['vm_rental.audit_log'].search([('vm_id', '=', vm.id)])
+            self.assertEqual(set(logs.filtered(lambda l: l.action == 'provision_stage').mapped('stage')),
+                             {'allocate_id', 'clone', 'configure', 'resize'})
+            self.assertEqual(logs.filtered(lambda l: l.action == 'provision').stage, 'done')
+            self.assertEqual(vm.provision_stage, 'done')
+
+    def test_lost_task_times_out(self):
+        """Тест потерянной задачи: без статуса дольше таймаута - ошибка и провал провижининга"""
+        vm = self.env['vm_rental.machine'].create({
+            'name': 'Lost Task VM',
+            'partner_id': self.partner.id,
+            'hypervisor_server_id': self.hypervisor_server.id,
+            'hypervisor_node_id': self.node.id,
+            'hypervisor_vm_ref': '150',
+            'hypervisor_node_name': 'test-node-01',
+            'state': 'provisioning',
+            'cores': 2,
+            'memory': 2048,
+            'disk': 20,
+        })
+        Task = self.env['hypervisor.task']
+        task = Task.track(self.hypervisor_server, 'UPID:test-node-01:0002:clone', 'clone',
+                          vm=vm, callback='_on_provision_cloned')
+
+        with patch.object(type(self.hypervisor_server), '_get_service_manager') as mock_service:
+            mock_service.return_value.get_task_statuses.return_value = {}
+
+            # Статус еще может появиться - задача опрашивается дальше
+            task._poll()
+            self.assertEqual(task.state, 'running')
+            self.assertEqual(task.poll_count, 1)
+
+            task.started_at = fields.Datetime.now() - timedelta(seconds=Task.LOST_TASK_TIMEOUT + 1)
+            task._poll()
+
+        self.assertEqual(task.state, 'failed')
+        self.assertIn('timeout', task.exitstatus)
+        self.assertEqual(vm.state, 'failed')
+
+    def test_failed_callback_fails_provisioning(self):
+        """Тест сбоя шага цепочки: исключение в callback переводит VM в failed и освобождает слот очереди"""
+        vm = self.env['vm_rental.machine'].create({
+            'name': 'Callback Failure VM',
+            'partner_id': self.partner.id,
+            'hypervisor_server_id': self.hypervisor_server.id,
+            'hypervisor_node_id': self.node.id,
+            'hypervisor_vm_ref': '151',
+            'hypervisor_node_name': 'test-node-01',
+            'state': 'provisioning',
+            'cores': 2,
+            'memory': 2048,
+            'disk': 20,
+        })
+        job = self.env['vm_rental.provision_job'].create({
+            'vm_id': vm.id, 'server_id': self.hypervisor_server.id, 'state': 'provisioning'})
+        task = self.env['hypervisor.task'].track(self.hypervisor_server, 'UPID:test-node-01:0003:clone', 'clone',
+                                                 vm=vm, callback='_on_provision_cloned')
+
+        with patch.object(type(vm), '_enter_provision_stage', side_effect=Exception('stage write failed')):
+            task._mark_finished('OK')
+
+        self.assertEqual(task.state, 'done')
+        self.assertIn('stage write failed', task.error_message)
+        self.assertEqual(vm.state, 'failed')
+        self.assertEqual(job.state, 'failed')
+
+    def test_clone_submitted_survives_notification_error(self):
+        """Тест запущенного клона: ошибка после отправки клона не проваливает VM и не освобождает VMID"""
+        vm = self.env['vm_rental.machine'].create({
+            'name': 'Submitted Clone VM',
+            'partner_id': self.partner.id,
+            'hypervisor_server_id': self.hypervisor_server.id,
+            'hypervisor_node_id': self.node.id,
+            'hypervisor_storage_id': self.storage.id,
+            'hypervisor_template_id': self.template.id,
+            'cores': 1,
+            'memory': 1024,
+            'disk': 10,
+        })
+        self.hypervisor_server.write({'vmid_range_start': 100, 'vmid_range_end': 199})
+        self.hypervisor_server.vmid_reconciled_at = fields.Datetime.now()
+
+        with patch.object(type(vm), '_get_hypervisor_service') as mock_service, \
+                patch.object(type(vm), 'message_post', side_effect=Exception('chatter unavailable')):
+            mock_service.return_value.clone_vm.return_value = 'UPID:test-node-01:0004:clone'
+            vm.action_provision_vm()
+
+        self.assertEqual(vm.state, 'provisioning')
+        self.assertTrue(self.env['hypervisor.task'].search([('vm_id', '=', vm.id), ('operation', '=', 'clone')]))
+        self.assertEqual(self.env['hypervisor.vmid.reservation'].search([
+            ('server_id', '=', self.hypervisor_server.id), ('vmid', '=', int(vm.hypervisor_vm_ref))]).state, 'reserved')
+
     def test_vm_expiry_cron(self):
         """Тест cron задачи проверки истечения срока"""
         # Создаем ВМ с истекшим сроком
@@ -118,17 +232,351 @@ class TestVmRental(common.TransactionCase):
             'disk': 10,
         })
         
-        # Мокаем сервис
-        with patch.object(vm, '_get_hypervisor_service') as mock_service:
-            mock_service.return_value.suspend_vm.return_value = True
+        # Мокаем сервис: cron приостанавливает VM одним групповым вызовом на сервер
+        with patch.object(type(self.hypervisor_server), '_get_service_manager') as mock_service:
+            mock_service.return_value.suspend_many.return_value = {'101': {'success': True, 'error': None}}
             
             # Запускаем cron
             self.env['vm_rental.machine']._cron_check_expiry()
             
             # Проверяем, что ВМ приостановлена
             self.assertEqual(vm.state, 'suspended')
-            mock_service.return_value.suspend_vm.assert_called_once()
+            mock_service.return_value.suspend_many.assert_called_once_with([('test-node-01', '101')])
     
+    def test_provision_queue_respects_server_limit(self):
+        """Тест очереди провижининга: лимит параллельных заданий на сервер"""
+        self.hypervisor_server.max_parallel_provisioning = 1
+        vms = self.env['vm_rental.machine'].create([{
+            'name': f'Queued VM {n}',
+            'partner_id': self.partner.id,
+            'hypervisor_server_id': self.hypervisor_server.id,
+            'hypervisor_node_id': self.node.id,
+            'hypervisor_storage_id': self.storage.id,
+            'hypervisor_template_id': self.template.id,
+            'cores': 1,
+            'memory': 1024,
+            'disk': 10,
+        } for n in range(2)])
+
+        Job = self.env['vm_rental.provision_job']
+        jobs = Job.enqueue(vms)
+        self.assertEqual(len(jobs), 2)
+        # Повторная постановка не создает дублей
+        self.assertFalse(Job.enqueue(vms))
+
+        first = Job._claim_next()
+        self.assertEqual(first, jobs[0])
+        self.assertEqual(first.state, 'running')
+        # Слот сервера занят - второе задание ждет
+        self.assertFalse(Job._claim_next())
+
+        first._mark_finished()
+        self.assertEqual(Job._claim_next(), jobs[1])
+
+    def test_provision_claims_run_concurrently(self):
+        """Тест конкурентного захвата: два воркера одновременно получают разные задания"""
+        # Воркеры работают в своих транзакциях - данные фиксируются отдельным курсором
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, self.env.uid, {})
+            partner = env['res.partner'].create({'name': 'Concurrent Claim Customer'})
+            servers = env['hypervisor.server'].create([{
+                'name': f'Concurrent Claim Server {n}',
+                'hypervisor_type': 'proxmox',
+                'host': f'192.168.1.{110 + n}',
+                'user': 'root@pam',
+                'token_name': 'test_token',
+                'token_value': 'test_token_value',
+            } for n in range(2)])
+            vms = env['vm_rental.machine'].create([{
+                'name': f'Concurrent Claim VM {n}',
+                'partner_id': partner.id,
+                'hypervisor_server_id': server.id,
+                'cores': 1,
+                'memory': 1024,
+                'disk': 10,
+            } for n, server in enumerate(servers)])
+            env['vm_rental.provision_job'].create([{
+                'vm_id': vm.id, 'server_id': vm.hypervisor_server_id.id} for vm in vms])
+        self.addCleanup(self._drop_committed, vms.ids, servers.ids, partner.id)
+
+        cr1, cr2 = self.registry.cursor(), self.registry.cursor()
+        try:
+            # В тестах захват не фиксируется - первый воркер держит блокировку, пока второй захватывает
+            first = api.Environment(cr1, self.env.uid, {})['vm_rental.provision_job']._claim_next()
+            second = api.Environment(cr2, self.env.uid, {})['vm_rental.provision_job']._claim_next()
+            self.assertTrue(first)
+            self.assertTrue(second)
+            self.assertNotEqual(first.id, second.id)
+        finally:
+            for cr in (cr1, cr2):
+                cr.rollback()
+                cr.close()
+
+    def _drop_committed(self, vm_ids, server_ids, partner_id):
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, self.env.uid, {})
+            env['vm_rental.machine'].browse(vm_ids).unlink()
+            env['hypervisor.server'].browse(server_ids).unlink()
+            env['res.partner'].browse(partner_id).unlink()
+
+    def test_linked_clone_falls_back_to_full(self):
+        """Тест режима клонирования: связанный клон при поддержке хранилища, иначе полный"""
+        self.template.clone_mode = 'linked'
+        self.hypervisor_server.vmid_reconciled_at = fields.Datetime.now()
+        vms = self.env['vm_rental.machine'].create([{
+            'name': f'Clone VM {n}',
+            'partner_id': self.partner.id,
+            'hypervisor_server_id': self.hypervisor_server.id,
+            'hypervisor_node_id': self.node.id,
+            'hypervisor_storage_id': self.storage.id,
+            'hypervisor_template_id': self.template.id,
+            'cores': 1,
+            'memory': 1024,
+            'disk': 10,
+        } for n in range(2)])
+
+        with patch.object(type(vms), '_get_hypervisor_service') as mock_service:
+            service = mock_service.return_value
+            service.clone_vm.return_value = 'UPID:test-node-01:0001:clone'
+
+            service.linked_clone_possible.return_value = True
+            vms[0].action_provision_vm()
+            self.assertTrue(service.clone_vm.call_args.kwargs['linked'])
+            self.assertEqual(vms[0].provisioned_clone_mode, 'linked')
+
+            service.linked_clone_possible.return_value = False
+            vms[1].action_provision_vm()
+            self.assertFalse(service.clone_vm.call_args.kwargs['linked'])
+            self.assertEqual(vms[1].provisioned_clone_mode, 'full')
+
+    def test_placement_policies(self):
+        """Тест размещения: spread выбирает свободную ноду, pack - заполненную, без места - ошибка"""
+        node2 = self.env['hypervisor.node'].create({'name': 'test-node-02', 'server_id': self.hypervisor_server.id})
+        self.storage.node_ids = [(4, node2.id)]
+        vm = self.env['vm_rental.machine'].create({
+            'name': 'Placed VM',
+            'partner_id': self.partner.id,
+            'hypervisor_server_id': self.hypervisor_server.id,
+            'hypervisor_node_id': self.node.id,
+            'hypervisor_storage_id': self.storage.id,
+            'hypervisor_template_id': self.template.id,
+            'cores': 2,
+            'memory': 2048,
+            'disk': 20,
+        })
+        gib = 2 ** 30
+        service = MagicMock()
+        service.get_capacity.return_value = {
+            'nodes': [
+                {'name': 'test-node-01', 'status': 'online', 'maxcpu': 8, 'maxmem': 32 * gib,
+                 'allocated_cpu': 24, 'allocated_mem': 24 * gib},
+                {'name': 'test-node-02', 'status': 'online', 'maxcpu': 8, 'maxmem': 32 * gib,
+                 'allocated_cpu': 2, 'allocated_mem': 4 * gib},
+            ],
+            'storages': [
+                {'name': 'local-lvm', 'node': node, 'content': 'images,rootdir', 'shared': False,
+                 'maxdisk': 500 * gib, 'disk': 100 * gib}
+                for node in ('test-node-01', 'test-node-02')
+            ],
+        }
+
+        Placement = self.env['hypervisor.placement']
+        self.hypervisor_server.placement_policy = 'spread'
+        decision = Placement.place(vm, service)
+        self.assertEqual(decision.node_id, node2)
+        self.assertEqual(vm.hypervisor_node_id, node2)
+        self.assertEqual(decision.candidate_count, 2)
+
+        self.hypervisor_server.placement_policy = 'pack'
+        self.assertEqual(Placement.place(vm, service).node_id, self.node)
+
+        vm.memory = 64 * 1024
+        with self.assertRaises(UserError):
+            Placement.place(vm, service)
+
+    def test_placement_follows_template(self):
+        """Тест размещения: только ноды, откуда доступен шаблон; неразмещенные задания не нагружают ноду"""
+        node2 = self.env['hypervisor.node'].create({'name': 'test-node-02', 'server_id': self.hypervisor_server.id})
+        local2 = self.env['hypervisor.storage'].create({
+            'name': 'local-lvm-02',
+            'server_id': self.hypervisor_server.id,
+            'node_ids': [(4, node2.id)],
+        })
+        # Шаблон на локальном хранилище первой ноды
+        self.template.write({'node_id': self.node.id, 'storage_id': self.storage.id})
+        vms = self.env['vm_rental.machine'].create([{
+            'name': f'Template Placed VM {n}',
+            'partner_id': self.partner.id,
+            'hypervisor_server_id': self.hypervisor_server.id,
+            'hypervisor_node_id': self.node.id,
+            'hypervisor_storage_id': self.storage.id,
+            'hypervisor_template_id': self.template.id,
+            'cores': 2,
+            'memory': 2048,
+            'disk': 20,
+        } for n in range(2)])
+        gib = 2 ** 30
+        service = MagicMock()
+        service.get_capacity.return_value = {
+            'nodes': [
+                {'name': 'test-node-01', 'status': 'online', 'maxcpu': 8, 'maxmem': 32 * gib,
+                 'allocated_cpu': 24, 'allocated_mem': 24 * gib},
+                {'name': 'test-node-02', 'status': 'online', 'maxcpu': 8, 'maxmem': 32 * gib,
+                 'allocated_cpu': 2, 'allocated_mem': 4 * gib},
+            ],
+            'storages': [
+                {'name': 'local-lvm', 'node': 'test-node-01', 'content': 'images', 'shared': False,
+                 'maxdisk': 500 * gib, 'disk': 100 * gib},
+                {'name': 'local-lvm-02', 'node': 'test-node-02', 'content': 'images', 'shared': False,
+                 'maxdisk': 500 * gib, 'disk': 100 * gib},
+            ],
+        }
+
+        # Свободная вторая нода не видит шаблон - spread выбирает ноду шаблона
+        Placement = self.env['hypervisor.placement']
+        self.hypervisor_server.placement_policy = 'spread'
+        decision = Placement.place(vms[0], service)
+        self.assertEqual(decision.node_id, self.node)
+        self.assertEqual(decision.rejected_count, 1)
+
+        # Готовая реплика на хранилище второй ноды делает ее доступной
+        self.env['hypervisor.template.replica'].create({
+            'template_id': self.template.id,
+            'storage_id': local2.id,
+            'node': 'test-node-02',
+            'vmid': '9102',
+            'state': 'ready',
+        })
+        self.assertEqual(Placement.place(vms[0], service).node_id, node2)
+
+        # Задание, еще не прошедшее размещение, не считается нагрузкой на ноду продукта
+        job = self.env['vm_rental.provision_job'].create({
+            'vm_id': vms[1].id, 'server_id': self.hypervisor_server.id, 'state': 'running'})
+        self.assertEqual(Placement._provisioning_load(vms[0]), ({}, {}))
+        job.write({'state': 'provisioning', 'storage_id': self.storage.id})
+        self.assertEqual(Placement._provisioning_load(vms[0]), ({self.node.id: 1}, {self.storage.id: 1}))
+
+    def test_capacity_snapshot(self):
+        """Тест снимка емкости: последние значения на ноде и хранилище, общее хранилище - одна строка"""
+        gib = 2 ** 30
+        capacity = {
+            'nodes': [{'name': 'test-node-01', 'status': 'online', 'maxcpu': 16, 'maxmem': 64 * gib,
+                       'cpu': 0.25, 'mem': 16 * gib, 'allocated_cpu': 20, 'allocated_mem': 32 * gib, 'guests': 5}],
+            'storages': [
+                {'name': 'local-lvm', 'node': node, 'maxdisk': 1000 * gib, 'disk': 250 * gib}
+                for node in ('test-node-01', 'test-node-02')
+            ],
+        }
+        snapshots = self.env['hypervisor.capacity.snapshot']._collect(self.hypervisor_server, capacity)
+
+        self.assertEqual(len(snapshots), 2)
+        self.assertEqual((self.node.cpu_total, self.node.cpu_allocated, self.node.cpu_load), (16, 20, 25.0))
+        self.assertEqual(self.node.memory_usage, 25.0)
+        self.assertEqual((self.storage.disk_free, self.storage.disk_usage), (750.0, 25.0))
+
+    def test_template_replica_clone_source(self):
+        """Тест реплик шаблона: VM на хранилище с готовой репликой клонируется из нее, иначе из шаблона"""
+        ceph = self.env['hypervisor.storage'].create({
+            'name': 'ceph-pool',
+            'server_id': self.hypervisor_server.id,
+            'shared': True,
+        })
+        self.template.node_id = self.node
+        replica = self.env['hypervisor.template.replica'].create({
+            'template_id': self.template.id,
+            'storage_id': ceph.id,
+            'node': 'test-node-01',
+            'vmid': '9101',
+        })
+
+        # Клонируемая реплика еще не готова
+        self.assertEqual(self.template._clone_source('test-node-02', 'ceph-pool'), ('test-node-01', '9001'))
+        replica.state = 'converting'
+        replica._on_converted(None)
+        self.assertEqual(replica.state, 'ready')
+        self.assertEqual(self.template._clone_source('test-node-02', 'ceph-pool'), ('test-node-01', '9101'))
+        self.assertEqual(self.template._clone_source('test-node-01', 'local-lvm'), ('test-node-01', '9001'))
+
+    def test_stale_replica_is_not_converted(self):
+        """Тест устаревшей реплики: завершение ее копирования не превращает ее в шаблон"""
+        ceph = self.env['hypervisor.storage'].create({
+            'name': 'ceph-pool',
+            'server_id': self.hypervisor_server.id,
+            'shared': True,
+        })
+        replica = self.env['hypervisor.template.replica'].create({
+            'template_id': self.template.id,
+            'storage_id': ceph.id,
+            'node': 'test-node-01',
+            'vmid': '9101',
+        })
+        # Шаблон изменился, пока реплика копировалась
+        replica.state = 'stale'
+
+        with patch.object(type(self.hypervisor_server), '_get_service_manager') as mock_service:
+            replica._on_cloned(None)
+            replica._on_converted(None)
+            mock_service.return_value.convert_to_template.assert_not_called()
+        self.assertEqual(replica.state, 'stale')
+        self.assertEqual(self.template._clone_source('test-node-01', 'ceph-pool'), ('test-node-01', '9001'))
+
+    def test_vmid_allocation_from_range(self):
+        """Тест локального выделения VMID: последовательные номера, освобожденный не выдается до сверки"""
+        self.hypervisor_server.write({'vmid_range_start': 500, 'vmid_range_end': 502})
+        # Диапазон уже сверен - выделение не обращается к гипервизору
+        self.hypervisor_server.vmid_reconciled_at = fields.Datetime.now()
+
+        Reservation = self.env['hypervisor.vmid.reservation']
+        self.assertEqual(Reservation.allocate(self.hypervisor_server), 500)
+        self.assertEqual(Reservation.allocate(self.hypervisor_server), 501)
+
+        Reservation.release(self.hypervisor_server, 500)
+        self.assertEqual(Reservation.allocate(self.hypervisor_server), 502)
+        with self.assertRaises(UserError):
+            Reservation.allocate(self.hypervisor_server)
+
+    def test_warm_pool_binds_ready_guest(self):
+        """Тест теплого пула: готовый гость выдается одной VM, следующая получает промах"""
+        product = self.env['product.template'].create({
+            'name': 'Warm VM',
+            'hypervisor_server_id': self.hypervisor_server.id,
+            'hypervisor_node_id': self.node.id,
+            'hypervisor_storage_id': self.storage.id,
+            'hypervisor_template_id': self.template.id,
+        })
+        pool = self.env['vm_rental.warm_pool'].create({
+            'product_tmpl_id': product.id,
+            'node_id': self.node.id,
+            'target_size': 1,
+        })
+        guest = self.env['vm_rental.warm_pool.guest'].create({
+            'pool_id': pool.id,
+            'vmid': '100500',
+            'node': self.node.name,
+            'clone_mode': 'linked',
+            'state': 'ready',
+        })
+        vms = self.env['vm_rental.machine'].create([{
+            'name': f'Warm VM {n}',
+            'partner_id': self.partner.id,
+            'hypervisor_server_id': self.hypervisor_server.id,
+            'hypervisor_node_id': self.node.id,
+            'hypervisor_storage_id': self.storage.id,
+            'hypervisor_template_id': self.template.id,
+            'cores': 1,
+            'memory': 1024,
+            'disk': 10,
+        } for n in range(2)])
+
+        WarmPool = self.env['vm_rental.warm_pool']
+        self.assertEqual(WarmPool._bind_warm_guest(vms[0], product), guest)
+        self.assertFalse(WarmPool._bind_warm_guest(vms[1], product))
+
+        self.assertEqual(guest.state, 'claimed')
+        self.assertEqual(vms[0].warm_guest_id, guest)
+        self.assertEqual((pool.hit_count, pool.miss_count, pool.hit_rate), (1, 1, 50.0))
+        self.assertEqual(pool.ready_count, 0)
+
     def test_snapshot_operations(self):
         """Тест операций со снапшотами"""
         vm = self.env['vm_rental.machine'].create({
@@ -225,6 +673,35 @@ class TestHypervisorService(common.TransactionCase):
             port=8006
         )
     
+    @patch('vm_rental.services.proxmox_service.ProxmoxAPI')
+    def test_service_manager_reuses_pooled_connection(self, mock_proxmox_api):
+        """Тест переиспользования подключения из пула"""
+        first = self.server._get_service_manager()
+        second = self.server._get_service_manager()
+
+        self.assertIs(first.connection, second.connection)
+        self.assertEqual(mock_proxmox_api.call_count, 1)
+
+        # Изменение учетных данных должно привести к новому подключению
+        self.server.write({'token_value': 'rotated'})
+        self.server._get_service_manager()
+        self.assertEqual(mock_proxmox_api.call_count, 2)
+
+    def test_pool_store_keeps_concurrent_session(self):
+        """Тест гонки в пуле: вторая сессия с тем же ключом закрывается, а не вытесняет первую"""
+        from vm_rental.services.connection_pool import HypervisorConnectionPool, ServiceSession
+
+        pool = HypervisorConnectionPool()
+        key = (self.env.cr.dbname, self.server.id, 'fingerprint')
+        first = ServiceSession(MagicMock(), closer=MagicMock(), key=key)
+        second = ServiceSession(MagicMock(), closer=MagicMock(), key=key)
+
+        self.assertIs(pool._store(key, first), first)
+        self.assertIs(pool._store(key, second), first)
+        second.closer.assert_called_once_with(second.connection)
+        first.closer.assert_not_called()
+        self.assertEqual(pool.stats()['size'], 1)
+
     @patch('vm_rental.services.proxmox_service.ProxmoxAPI')
     def test_list_nodes(self, mock_proxmox_api):
         """Тест получения списка нод"""
@@ -243,6 +720,373 @@ class TestHypervisorService(common.TransactionCase):
         self.assertEqual(nodes[0]['name'], 'pve01')
         self.assertEqual(nodes[1]['name'], 'pve02')
 
+    @patch('vm_rental.services.proxmox_service.ProxmoxAPI')
+    def test_cluster_inventory_single_snapshot(self, mock_proxmox_api):
+        """Тест инвентаризации кластера из одного снимка /cluster/resources"""
+        mock_instance = MagicMock()
+        mock_proxmox_api.return_value = mock_instance
+        mock_instance.cluster.resources.get.return_value = [
+            {'type': 'node', 'node': 'pve01', 'status': 'online', 'maxcpu': 16, 'maxmem': 68719476736},
+            {'type': 'storage', 'storage': 'local-lvm', 'node': 'pve01', 'status': 'available',
+             'content': 'images,rootdir', 'plugintype': 'lvmthin'},
+            {'type': 'storage', 'storage': 'offline', 'node': 'pve01', 'status': 'unknown', 'content': 'images'},
+            {'type': 'qemu', 'vmid': 9001, 'name': 'ubuntu-tpl', 'node': 'pve01', 'template': 1},
+            {'type': 'qemu', 'vmid': 100, 'name': 'web', 'node': 'pve01', 'status': 'running', 'maxcpu': 2},
+            {'type': 'lxc', 'vmid': 200, 'name': 'ct', 'node': 'pve01', 'status': 'stopped'},
+        ]
+
+        service = self.server._get_service_manager()
+        inventory = service.get_cluster_inventory()
+
+        self.assertEqual([n['name'] for n in inventory['nodes']], ['pve01'])
+        self.assertEqual([s['name'] for s in inventory['storages']], ['local-lvm'])
+        self.assertEqual([t['vmid'] for t in inventory['templates']], [9001])
+        self.assertEqual({g['vmid']: g['vm_type'] for g in inventory['guests']}, {100: 'qemu', 200: 'lxc'})
+        mock_instance.cluster.resources.get.assert_called_once_with()
+        # Снимок заполняет индекс VMID - определение типа не требует запросов
+        self.assertEqual(service._get_vm_type('pve01', 200), 'lxc')
+
+
+    @patch('vm_rental.services.proxmox_service.ProxmoxAPI')
+    def test_mutations_are_not_retried_on_server_errors(self, mock_proxmox_api):
+        """Тест: неидемпотентный clone не повторяется при 5xx, ошибка не теряется"""
+        from proxmoxer.core import ResourceException
+        from vm_rental.services.base_service import HypervisorOperationError
+
+        mock_instance = MagicMock()
+        mock_proxmox_api.return_value = mock_instance
+        clone_post = mock_instance.nodes.return_value.qemu.return_value.clone.post
+        clone_post.side_effect = ResourceException(500, 'Internal Server Error', 'clone failed')
+
+        service = self.server._get_service_manager()
+        with self.assertRaises(HypervisorOperationError):
+            service.clone_vm('pve01', 101, 'test-vm', 9000, 'local-lvm')
+        self.assertEqual(clone_post.call_count, 1)
+        self.assertEqual(self.server.get_call_stats()['failure'], 1)
+
+    def test_circuit_breaker_fails_fast_when_host_is_down(self):
+        """Тест: после серии сбоев подключения вызовы отклоняются без обращения к хосту"""
+        from vm_rental.services.circuit_breaker import circuit_breaker
+        from vm_rental.services.base_service import HypervisorUnavailableError
+
+        # Состояние автомата пишется отдельным курсором - в тесте он должен видеть транзакцию теста
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+
+        key = (self.env.cr.dbname, self.server.id)
+        for _i in range(self.server.breaker_threshold):
+            circuit_breaker.record_failure(key, ConnectionError('connection refused'))
+
+        with patch('vm_rental.services.proxmox_service.ProxmoxAPI') as mock_proxmox_api:
+            with self.assertRaises(HypervisorUnavailableError):
+                self.server._get_service_manager()
+            mock_proxmox_api.assert_not_called()
+
+        self.server.invalidate_recordset()
+        self.assertEqual(self.server.status, 'unavailable')
+        self.assertEqual(self.server.breaker_state, 'open')
+
+        self.server.action_reset_breaker()
+        self.assertEqual(self.server.breaker_state, 'closed')
+
+    def test_driver_capabilities(self):
+        """Тест реестра драйверов: класс сервиса и возможности без обращения к API"""
+        from vm_rental.services.drivers import driver_registry, CAP_CONTAINERS, CAP_LXC_SNAPSHOTS
+
+        self.assertIn('proxmox', dict(driver_registry.selection()))
+        self.assertIs(self.server._get_service_class(), driver_registry.load('proxmox'))
+        self.assertTrue(self.server.has_capability(CAP_CONTAINERS))
+        self.assertFalse(self.server.has_capability(CAP_LXC_SNAPSHOTS))
+
+        container = self.env['vm_rental.machine'].new({'hypervisor_server_id': self.server.id, 'vm_type': 'lxc'})
+        self.assertFalse(container._can_snapshot())
+
+    def test_request_budget_against_simulator(self):
+        """Тест числа запросов к API на операцию (локальный симулятор Proxmox)"""
+        from vm_rental.benchmarks.proxmox_simulator import ProxmoxSimulator
+        from vm_rental.services.connection_pool import ServiceSession
+        from vm_rental.services.proxmox_service import ProxmoxService
+
+        with ProxmoxSimulator(nodes=2, vms_per_node=5, lxc_per_node=2) as simulator:
+            service = ProxmoxService(self.server, session=ServiceSession(simulator.make_api()))
+            lxc_vmid = next(g['vmid'] for g in simulator.guests.values() if g['type'] == 'lxc')
+
+            # Первое обращение к гостю строит индекс VMID одним запросом
+            service.start_vm('pve01', lxc_vmid)
+            self.assertEqual(simulator.requests['GET /cluster/resources'], 1)
+            self.assertEqual(simulator.requests['POST /nodes/{node}/{type}/{vmid}/status/{action}'], 1)
+
+            # Повторные операции с тем же гостем - ровно один запрос
+            simulator.reset_counters()
+            service.stop_vm('pve01', lxc_vmid)
+            service.get_console_url('pve01', lxc_vmid)
+            self.assertEqual(simulator.total_requests(), 2)
+            self.assertEqual(simulator.guests[lxc_vmid]['status'], 'stopped')
+
+    def test_request_deadline_limits_retries(self):
+        """Тест срока запроса: повторы не выходят за срок, истекший срок - без обращения к API"""
+        from vm_rental.benchmarks.proxmox_simulator import ProxmoxSimulator
+        from vm_rental.services.base_service import HypervisorDeadlineExceeded, HypervisorOperationError
+        from vm_rental.services.connection_pool import ServiceSession
+        from vm_rental.services.deadline import current_deadline, deadline_scope
+        from vm_rental.services.proxmox_service import ProxmoxService
+
+        with ProxmoxSimulator(nodes=1, vms_per_node=1, error_rate=1.0, error_status=503) as simulator:
+            service = ProxmoxService(self.server, session=ServiceSession(simulator.make_api()))
+            with deadline_scope(0.3) as deadline:
+                # Вложенный блок может только сузить срок
+                with deadline_scope(100) as inner:
+                    self.assertEqual(inner, deadline)
+
+                started = time.monotonic()
+                with self.assertRaises(HypervisorOperationError):
+                    service.get_version()
+                self.assertLess(time.monotonic() - started, 0.5)
+
+                time.sleep(max(deadline - time.monotonic(), 0) + 0.01)
+                simulator.reset_counters()
+                with self.assertRaises(HypervisorDeadlineExceeded):
+                    service.get_version()
+                self.assertEqual(simulator.total_requests(), 0)
+            self.assertIsNone(current_deadline())
+
+    def test_stale_replica_waits_for_delete_task(self):
+        """Тест удаления реплики: ошибка задачи удаления оставляет реплику, успех снимает ее с учета"""
+        from vm_rental.benchmarks.proxmox_simulator import ProxmoxSimulator
+        from vm_rental.services.connection_pool import ServiceSession
+        from vm_rental.services.proxmox_service import ProxmoxService
+
+        node = self.env['hypervisor.node'].create({'name': 'pve01', 'server_id': self.server.id})
+        storage = self.env['hypervisor.storage'].create({
+            'name': 'local-lvm', 'server_id': self.server.id, 'node_ids': [(4, node.id)]})
+        template = self.env['hypervisor.template'].create({
+            'name': 'Base', 'vmid': '8000', 'server_id': self.server.id, 'template_type': 'qemu'})
+        Task = self.env['hypervisor.task']
+
+        with ProxmoxSimulator(nodes=1, vms_per_node=1, lxc_per_node=0) as simulator:
+            service = ProxmoxService(self.server, session=ServiceSession(simulator.make_api()))
+            replica_vmid = next(g['vmid'] for g in simulator.guests.values() if g['template'])
+            replica = self.env['hypervisor.template.replica'].create({
+                'template_id': template.id,
+                'storage_id': storage.id,
+                'node': 'pve01',
+                'vmid': str(replica_vmid),
+                'state': 'stale',
+            })
+            # Связанный клон реплики, созданный в обход Odoo: о нем знает только задача удаления
+            service.clone_vm(node='pve01', vm_id='500', name='linked', template_vmid=replica_vmid,
+                             storage='local-lvm', linked=True)
+
+            with patch.object(type(self.server), '_get_service_manager', return_value=service):
+                replica._destroy(service)
+                self.assertEqual(replica.state, 'deleting')
+                task = Task.search([('res_model', '=', replica._name), ('res_id', '=', replica.id)])
+                self.assertEqual(task.operation, 'delete')
+                task._poll()
+                self.assertEqual(task.state, 'failed')
+                self.assertEqual(replica.state, 'stale')
+                self.assertIn(replica_vmid, simulator.guests)
+
+                # VM в Odoo еще клонируется на хранилище реплики - удаление не запрашивается
+                partner = self.env['res.partner'].create({'name': 'Replica Customer'})
+                vm = self.env['vm_rental.machine'].create({
+                    'name': 'Replica Clone VM',
+                    'partner_id': partner.id,
+                    'hypervisor_server_id': self.server.id,
+                    'hypervisor_template_id': template.id,
+                    'hypervisor_storage_id': storage.id,
+                    'state': 'provisioning',
+                    'cores': 1,
+                    'memory': 1024,
+                    'disk': 10,
+                })
+                simulator.reset_counters()
+                replica._destroy(service)
+                self.assertEqual(simulator.requests['DELETE /nodes/{node}/{type}/{vmid}'], 0)
+
+                vm.state = 'terminated'
+                service.delete_vm('pve01', '500')
+                replica._destroy(service)
+                Task.search([('res_model', '=', replica._name), ('res_id', '=', replica.id),
+                             ('state', '=', 'running')])._poll()
+
+            self.assertFalse(replica.exists())
+            self.assertNotIn(replica_vmid, simulator.guests)
+
+    def test_fan_out_bounds_workers_and_isolates_errors(self):
+        """Тест fan-out: не больше limit одновременных чтений, ошибка одной ноды не мешает остальным"""
+        import threading
+        from vm_rental.services.deadline import current_deadline, deadline_scope
+        from vm_rental.services.fanout import FanOut
+
+        lock = threading.Lock()
+        running = {'now': 0, 'max': 0}
+
+        def read_node(item):
+            with lock:
+                running['now'] += 1
+                running['max'] = max(running['max'], running['now'])
+            try:
+                time.sleep(0.05)
+                if item == 4:
+                    raise ConnectionError('node down')
+                return item * 10, current_deadline()
+            finally:
+                with lock:
+                    running['now'] -= 1
+
+        with deadline_scope(30) as deadline:
+            results = FanOut().map((self.env.cr.dbname, self.server.id), 3, read_node, range(8))
+
+        self.assertEqual(running['max'], 3)
+        self.assertEqual([item for item, _result, _error in results], list(range(8)))
+        self.assertIsInstance(results[4][2], ConnectionError)
+        self.assertEqual([result for _item, result, error in results if not error],
+                         [(item * 10, deadline) for item in range(8) if item != 4])
+
+    def test_vm_index_invalidation(self):
+        """Тест индекса VMID: перестраивается по истечении TTL и забывает удаленного гостя"""
+        from vm_rental.benchmarks.proxmox_simulator import ProxmoxSimulator
+        from vm_rental.services.connection_pool import ServiceSession
+        from vm_rental.services.proxmox_service import ProxmoxService
+
+        with ProxmoxSimulator(nodes=2, vms_per_node=2, lxc_per_node=1, task_duration=0) as simulator:
+            service = ProxmoxService(self.server, session=ServiceSession(simulator.make_api()))
+            lxc_vmid = next(vmid for vmid, g in simulator.guests.items()
+                            if g['type'] == 'lxc' and g['node'] == 'pve01')
+
+            self.assertEqual(service._resolve_vm('pve01', lxc_vmid), ('pve01', 'lxc'))
+            self.assertEqual(simulator.requests['GET /cluster/resources'], 1)
+
+            # Гость мигрировал: свежий индекс еще отвечает старой нодой без запросов
+            simulator.guests[lxc_vmid]['node'] = 'pve02'
+            self.assertEqual(service._resolve_vm('pve01', lxc_vmid), ('pve01', 'lxc'))
+            self.assertEqual(simulator.requests['GET /cluster/resources'], 1)
+
+            # Устаревший индекс перестраивается
+            service._vm_index()['built_at'] -= service.VM_INDEX_TTL + 1
+            self.assertEqual(service._resolve_vm('pve01', lxc_vmid), ('pve02', 'lxc'))
+            self.assertEqual(simulator.requests['GET /cluster/resources'], 2)
+
+            # Удаленный гость выпадает из индекса
+            service.delete_vm('pve02', lxc_vmid)
+            self.assertNotIn(str(lxc_vmid), service._vm_index()['entries'])
+
+    def test_bulk_power_against_simulator(self):
+        """Тест групповых операций: один startall/stopall на ноду вместо запроса на каждого гостя"""
+        from vm_rental.benchmarks.proxmox_simulator import ProxmoxSimulator
+        from vm_rental.services.connection_pool import ServiceSession
+        from vm_rental.services.proxmox_service import ProxmoxService
+
+        with ProxmoxSimulator(nodes=2, vms_per_node=4, lxc_per_node=1, task_duration=0) as simulator:
+            service = ProxmoxService(self.server, session=ServiceSession(simulator.make_api()))
+            guests = [(g['node'], vmid) for vmid, g in simulator.guests.items() if not g['template']]
+
+            results = service.stop_many(guests)
+            self.assertTrue(all(r['success'] for r in results.values()))
+            self.assertEqual(simulator.requests['POST /nodes/{node}/{bulk}'], 2)
+            self.assertEqual(simulator.requests['POST /nodes/{node}/{type}/{vmid}/status/{action}'], 0)
+
+            # Приостановка поддерживается только для qemu - LXC получает ошибку, а не исключение
+            results = service.suspend_many(guests)
+            lxc_vmid = next(str(vmid) for node, vmid in guests if simulator.guests[vmid]['type'] == 'lxc')
+            self.assertFalse(results[lxc_vmid]['success'])
+            self.assertEqual(sum(r['success'] for r in results.values()), len(guests) - 2)
+
+    def test_vmware_round_trips_do_not_grow_with_fleet(self):
+        """Тест: число SOAP-запросов list_all_vms не зависит от количества VM (заменитель vCenter)"""
+        from vm_rental.benchmarks.vcenter_simulator import VcenterSimulator
+        from vm_rental.services.connection_pool import ServiceSession
+        from vm_rental.services.vmware_service import VmwareService
+
+        round_trips = []
+        for vm_count in (20, 400):
+            simulator = VcenterSimulator(vms=vm_count)
+            service = VmwareService(self.server, session=ServiceSession(simulator.service_instance()))
+            service.list_all_vms('Cluster-1')
+            simulator.reset_counters()
+
+            vms = service.list_all_vms('Cluster-1')
+            self.assertTrue(vms)
+            # Только PropertyCollector, без чтения свойств каждой VM
+            self.assertFalse([call for call in simulator.calls if call.endswith('(property)')])
+            # Читаются только VM хостов кластера (и лежащие на них шаблоны), а не весь vCenter
+            self.assertEqual(simulator.objects_returned, len(vms) + 5)
+            round_trips.append(simulator.total_calls())
+        self.assertEqual(round_trips[0], round_trips[1])
+
+    def test_vmware_wait_for_tasks_first_and_all(self):
+        """Тест ожидания задач VMware: FIRST_COMPLETED возвращает первую завершенную, ALL_COMPLETED - все"""
+        from vm_rental.benchmarks.vcenter_simulator import VcenterSimulator
+        from vm_rental.services.connection_pool import ServiceSession
+        from vm_rental.services.vmware_service import VmwareService, FIRST_COMPLETED
+
+        simulator = VcenterSimulator(vms=2, templates=0)
+        service = VmwareService(self.server, session=ServiceSession(simulator.service_instance()))
+        vm = next(state['mo'] for state in simulator._vms.values())
+        fast = simulator._new_task(vm, 'PowerOnVM_Task', lambda: None, duration=0.0)
+        slow = simulator._new_task(vm, 'PowerOffVM_Task', lambda: None, duration=0.3)
+        simulator.reset_counters()
+
+        done, pending = service._wait_for_tasks([slow, fast], return_when=FIRST_COMPLETED)
+        self.assertEqual((done, pending), ([fast], [slow]))
+        # Одно ожидание изменений, без опроса info каждой задачи
+        self.assertEqual(simulator.calls['PropertyCollector.WaitForUpdatesEx'], 1)
+
+        done, pending = service._wait_for_tasks([slow, fast])
+        self.assertEqual(set(done), {fast, slow})
+        self.assertFalse(pending)
+
+    def test_vmware_moref_index_refreshes_on_miss(self):
+        """Тест индекса имен VMware: попадания без запросов, промах перестраивает индекс не чаще интервала"""
+        from pyVmomi import vim
+        from vm_rental.benchmarks.vcenter_simulator import VcenterSimulator
+        from vm_rental.services.connection_pool import ServiceSession
+        from vm_rental.services.vmware_service import VmwareService
+
+        simulator = VcenterSimulator(vms=2, templates=0)
+        service = VmwareService(self.server, session=ServiceSession(simulator.service_instance()))
+        datastore = service._find_by_name('datastore', 'datastore1')
+        simulator.reset_counters()
+
+        self.assertIs(service._find_by_name('datastore', 'datastore1'), datastore)
+        self.assertEqual(simulator.total_calls(), 0)
+
+        # Новое хранилище: сразу после построения индекса промах не вызывает запросов
+        added = simulator._add(vim.Datastore('datastore-99', simulator), name='datastore-new',
+                               parent=simulator.datastore_folder, summary=None, host=None)
+        self.assertIsNone(service._find_by_name('datastore', 'datastore-new'))
+        self.assertEqual(simulator.total_calls(), 0)
+
+        service._moref_index()['built_at'] -= service.MOREF_INDEX_MISS_REFRESH + 1
+        self.assertEqual(service._find_by_name('datastore', 'datastore-new'), added)
+        self.assertEqual(simulator.calls['PropertyCollector.RetrievePropertiesEx'], 1)
+
+    def test_vmware_linked_clone_single_task(self):
+        """Тест: связанный клон VMware - одна задача клонирования с CPU/памятью в спецификации"""
+        from vm_rental.benchmarks.vcenter_simulator import VcenterSimulator
+        from vm_rental.services.connection_pool import ServiceSession
+        from vm_rental.services.vmware_service import VmwareService
+
+        simulator = VcenterSimulator(vms=5, templates=1)
+        service = VmwareService(self.server, session=ServiceSession(simulator.service_instance()))
+        template_uuid = simulator.vm_uuids(template=True)[0]
+        node, datastore = simulator.cluster_names[0], simulator.datastore_names[0]
+
+        # Без снапшота шаблона связанный клон невозможен
+        self.assertFalse(service.linked_clone_possible(node, template_uuid, datastore, disk=32))
+        service.create_snapshot(node, template_uuid, 'base', '')
+        self.assertTrue(service.linked_clone_possible(node, template_uuid, datastore, disk=32))
+        # Диск дочернего клона не увеличивается
+        self.assertFalse(service.linked_clone_possible(node, template_uuid, datastore, disk=64))
+
+        simulator.reset_counters()
+        vm_uuid = service.create_vm(node, 'linked-vm', template_uuid, 4, 4096, 32, datastore, linked=True)
+        self.assertEqual(simulator.calls['VirtualMachine.CloneVM_Task'], 1)
+        self.assertFalse(simulator.calls['VirtualMachine.ReconfigVM_Task'])
+        self.assertFalse(simulator.calls['VirtualMachine.PowerOnVM_Task'])
+        config = service.get_vm_config(vm_uuid)
+        self.assertEqual((config['cores'], config['memory']), (4, 4096))
 
 class TestVmLinking(common.TransactionCase):
     
@@ -273,10 +1117,15 @@ class TestVmLinking(common.TransactionCase):
         # Настраиваем мок сервиса
         mock_service = MagicMock()
         mock_get_service.return_value = mock_service
-        mock_service.list_all_vms.return_value = [
-            {'vmid': '100', 'name': 'existing-vm-1', 'status': 'running'},
-            {'vmid': '101', 'name': 'existing-vm-2', 'status': 'stopped'},
-        ]
+        mock_service.get_cluster_inventory.return_value = {
+            'nodes': [{'id': 'pve01', 'name': 'pve01'}],
+            'storages': [],
+            'templates': [],
+            'guests': [
+                {'vmid': '100', 'name': 'existing-vm-1', 'status': 'running', 'node': 'pve01', 'vm_type': 'qemu'},
+                {'vmid': '101', 'name': 'existing-vm-2', 'status': 'stopped', 'node': 'pve01', 'vm_type': 'qemu'},
+            ],
+        }
         
         # Создаем задание на привязку
         linking_job = self.env['vm_rental.linking_job'].create({
@@ -292,6 +1141,9 @@ class TestVmLinking(common.TransactionCase):
         
         # Выбираем первую ВМ для привязки
         linking_job.line_ids[0].should_link = True
+        mock_service.get_vm_configs.return_value = {
+            '100': {'cores': 2, 'memory': 2048, 'disk': 30, 'vm_type': 'qemu'},
+        }
         
         # Выполняем привязку
         result = linking_job.action_link_vms()
@@ -304,4 +1156,6 @@ class TestVmLinking(common.TransactionCase):
         self.assertEqual(linked_vms.name, 'existing-vm-1')
         self.assertEqual(linked_vms.partner_id.id, self.partner.id)
         self.assertEqual(linked_vms.state, 'active')
+        self.assertEqual(linked_vms.cores, 2)
+        mock_service.get_vm_configs.assert_called_once_with([('pve01', '100')])
         
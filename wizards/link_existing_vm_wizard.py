@@ -44,21 +44,25 @@ class VmLinkingJob(models.Model):
         nodes = self.env['hypervisor.node'].search([
             ('server_id', '=', self.hypervisor_server_id.id)
         ])
+        node_names = set(nodes.mapped('name'))
 
-        for node in nodes:
-            vms_on_node = service.list_all_vms(node.name)
-            if vms_on_node:
-                for vm_data in vms_on_node:
-                    vm_data['node'] = node.name
-                    # Определяем тип VM по наличию полей
-                    if 'type' in vm_data:
-                        vm_data['vm_type'] = vm_data['type']
-                    elif 'hostname' in vm_data and 'name' not in vm_data:
-                        vm_data['vm_type'] = 'lxc'
-                        vm_data['name'] = vm_data.get('hostname', f"Container-{vm_data.get('vmid')}")
-                    else:
-                        vm_data['vm_type'] = 'qemu'
-                all_vms_on_server.extend(vms_on_node)
+        # Все гости сервера одним запросом вместо обхода нод
+        inventory = service.get_cluster_inventory()
+        for vm_data in inventory['guests']:
+            if vm_data.get('node') not in node_names:
+                continue
+            vm_data = dict(vm_data)
+            # Определяем тип VM по наличию полей
+            if vm_data.get('vm_type') in ('qemu', 'lxc'):
+                pass
+            elif 'type' in vm_data:
+                vm_data['vm_type'] = vm_data['type']
+            elif 'hostname' in vm_data and 'name' not in vm_data:
+                vm_data['vm_type'] = 'lxc'
+                vm_data['name'] = vm_data.get('hostname', f"Container-{vm_data.get('vmid')}")
+            else:
+                vm_data['vm_type'] = 'qemu'
+            all_vms_on_server.append(vm_data)
 
         # Исключаем уже привязанные VM
         linked_vm_refs = self.env['vm_rental.machine'].search([
@@ -97,56 +101,50 @@ class VmLinkingJob(models.Model):
             raise UserError(_("Please select at least one VM to link."))
 
         service = self.hypervisor_server_id._get_service_manager()
-        created_vms = self.env['vm_rental.machine']
 
+        # Конфигурация всех выбранных гостей одним проходом, а не запросом на каждую VM
+        try:
+            configs = service.get_vm_configs([(vm_line.node, vm_line.vmid) for vm_line in vms_to_link])
+        except HypervisorOperationError as e:
+            _logger.error(f"Failed to get configs for {len(vms_to_link)} VMs on {self.hypervisor_server_id.name}: {e}")
+            configs = {}
+
+        vals_list = []
         for vm_line in vms_to_link:
-            try:
-                # ИСПРАВЛЕНИЕ: Передаем тип VM в метод get_vm_config
-                if self.hypervisor_server_id.hypervisor_type == 'proxmox':
-                    vm_config = service.get_vm_config(vm_line.node, vm_line.vmid, vm_line.vm_type)
-                else:  # VMware
-                    vm_config = service.get_vm_config(vm_line.vmid)
-
-                vals = {
-                    'name': vm_line.name,
-                    'partner_id': self.partner_id.id,
-                    'hypervisor_server_id': self.hypervisor_server_id.id,
-                    'hypervisor_vm_ref': vm_line.vmid,
-                    'hypervisor_node_name': vm_line.node,
-                    'state': 'active' if vm_line.status in ['running', 'poweredOn'] else 'stopped',
-                    'start_date': fields.Date.today(),
+            vals = {
+                'name': vm_line.name,
+                'partner_id': self.partner_id.id,
+                'hypervisor_server_id': self.hypervisor_server_id.id,
+                'hypervisor_vm_ref': vm_line.vmid,
+                'hypervisor_node_name': vm_line.node,
+                'state': 'active' if vm_line.status in ['running', 'poweredOn'] else 'stopped',
+                'start_date': fields.Date.today(),
+            }
+            vm_config = configs.get(str(vm_line.vmid))
+            if vm_config:
+                vals.update({
                     # ИСПРАВЛЕНИЕ: Используем реальные ресурсы VM
                     'cores': vm_config['cores'],
                     'memory': vm_config['memory'],
                     'disk': vm_config['disk'],
                     # НОВОЕ: Сохраняем тип VM
                     'vm_type': vm_config.get('vm_type', 'unknown'),
-                }
-
+                })
                 _logger.info(
                     f"Linking {vm_config.get('vm_type', 'unknown').upper()} {vm_line.name} with config: {vm_config}")
-
-            except HypervisorOperationError as e:
-                _logger.error(f"Failed to get config for {vm_line.vm_type.upper()} {vm_line.name}: {e}")
-                # Fallback к значениям по умолчанию
-                vals = {
-                    'name': vm_line.name,
-                    'partner_id': self.partner_id.id,
-                    'hypervisor_server_id': self.hypervisor_server_id.id,
-                    'hypervisor_vm_ref': vm_line.vmid,
-                    'hypervisor_node_name': vm_line.node,
-                    'state': 'active' if vm_line.status in ['running', 'poweredOn'] else 'stopped',
-                    'start_date': fields.Date.today(),
-                    # Значения по умолчанию в зависимости от типа
+            else:
+                # Fallback к значениям по умолчанию в зависимости от типа
+                vals.update({
                     'cores': 1,
                     'memory': 1024 if vm_line.vm_type == 'qemu' else 512,
                     'disk': 10 if vm_line.vm_type == 'qemu' else 8,
                     'vm_type': vm_line.vm_type,
-                }
-                _logger.warning(
-                    f"Using default resources for {vm_line.vm_type.upper()} {vm_line.name} due to error: {e}")
+                })
+                _logger.warning(f"Using default resources for {vm_line.vm_type.upper()} {vm_line.name}: "
+                                f"configuration not available")
+            vals_list.append(vals)
 
-            created_vms |= self.env['vm_rental.machine'].create(vals)
+        created_vms = self.env['vm_rental.machine'].create(vals_list)
 
         self.write({'state': 'done'})
 